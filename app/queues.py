@@ -0,0 +1,197 @@
+"""
+Upload queue lanes shared by the server, the workers and the supervisor.
+
+Each lane is its own Redis list (pending_files:<lane>). Jobs are JSON blobs
+carrying the file path and enqueue time so workers can report queue lag per
+lane, and every job has a job_status:<id> hash the server can poll.
+"""
+import json
+import os
+import time
+import uuid
+from typing import Dict, Iterable, List, Optional
+
+
+QUEUE_PREFIX = "pending_files"
+
+# lane -> dequeue weight. Listed in priority order: workers check lanes left to right.
+LANES: Dict[str, int] = {
+    "interactive": 8,
+    "bulk": 1,
+}
+DEFAULT_LANE = "interactive"
+
+JOB_STATUS_PREFIX = "job_status:"
+JOB_STATUS_TTL_SECONDS = 7 * 24 * 3600
+LAG_KEY_PREFIX = "queue_lag:"
+# worker_stats:<pid>: cumulative per-worker counters, kept until the supervisor reaps the worker
+WORKER_STATS_PREFIX = "worker_stats:"
+# worker_heartbeat:<pid>: short-TTL liveness key, refreshed in the background while a batch runs
+WORKER_HEARTBEAT_PREFIX = "worker_heartbeat:"
+HEARTBEAT_INTERVAL_SECONDS = 10
+HEARTBEAT_TTL_SECONDS = 60
+# pending_files:processing:<pid>: jobs a worker has claimed, moved there atomically from their lane
+PROCESSING_PREFIX = f"{QUEUE_PREFIX}:processing:"
+# spool_job:<spool path>: id of the job queued for that file, so a re-upload can report it
+SPOOL_JOB_PREFIX = "spool_job:"
+
+
+def lane_key(lane: str) -> str:
+    return f"{QUEUE_PREFIX}:{lane}"
+
+
+def lane_keys() -> List[str]:
+    return [lane_key(lane) for lane in LANES]
+
+
+def processing_key(worker_id: str) -> str:
+    return f"{PROCESSING_PREFIX}{worker_id}"
+
+
+def spool_job_key(path: str) -> str:
+    return f"{SPOOL_JOB_PREFIX}{path}"
+
+
+def make_job(path: str, filename: str, lane: str) -> Dict:
+    return {
+        "id": uuid.uuid4().hex,
+        "path": path,
+        "filename": filename,
+        "lane": lane,
+        "enqueued_at": time.time(),
+    }
+
+
+def encode_job(job: Dict) -> str:
+    return json.dumps(job)
+
+
+def decode_job(raw: str, lane: str = DEFAULT_LANE) -> Dict:
+    """Parse a queued job. Bare file paths from the old single queue are accepted."""
+    try:
+        job = json.loads(raw)
+    except json.JSONDecodeError:
+        job = None
+    if not isinstance(job, dict):
+        job = {"id": None, "path": raw, "filename": os.path.basename(raw), "lane": lane, "enqueued_at": None}
+    return job
+
+
+class WeightedLanePicker:
+    """
+    Smooth weighted round-robin over the lanes that currently have work.
+    With weights 8:1 a saturated bulk lane still gets one slot in nine, and an
+    idle interactive lane costs nothing.
+    """
+
+    def __init__(self, weights: Dict[str, int] = LANES):
+        self.weights = dict(weights)
+        self.current = {lane: 0 for lane in self.weights}
+
+    def next(self, available: Iterable[str]) -> Optional[str]:
+        available = [lane for lane in available if lane in self.weights]
+        if not available:
+            return None
+        total = 0
+        for lane in available:
+            self.current[lane] += self.weights[lane]
+            total += self.weights[lane]
+        chosen = max(available, key=lambda lane: self.current[lane])
+        self.current[chosen] -= total
+        return chosen
+
+
+async def set_job_status(redis_client, job: Dict, status: str, detail: Optional[str] = None):
+    if not job.get("id"):
+        return
+    key = f"{JOB_STATUS_PREFIX}{job['id']}"
+    fields = {
+        "status": status,
+        "filename": job.get("filename") or "",
+        "lane": job.get("lane") or "",
+        "updated_at": time.time(),
+    }
+    if detail:
+        fields["detail"] = detail
+    await redis_client.hset(key, mapping=fields)
+    await redis_client.expire(key, JOB_STATUS_TTL_SECONDS)
+
+
+async def queue_job(redis_client, job: Dict, detail: Optional[str] = None):
+    """Mark a new job queued, remember it for its spool file and push it onto its lane."""
+    await set_job_status(redis_client, job, "queued", detail)
+    await redis_client.set(spool_job_key(job["path"]), job["id"], ex=JOB_STATUS_TTL_SECONDS)
+    await redis_client.rpush(lane_key(job["lane"]), encode_job(job))
+
+
+# KEYS[1] is the lane to move the job to, KEYS[2..] the lanes it may still wait in.
+# The job (found by ARGV[1], its id) is taken out of its lane and appended to the
+# target one with ARGV[2] as its lane, in one step; 0 when it is no longer queued.
+PROMOTE_SCRIPT = """
+for i = 2, #KEYS do
+  for _, raw in ipairs(redis.call('LRANGE', KEYS[i], 0, -1)) do
+    local ok, job = pcall(cjson.decode, raw)
+    if ok and type(job) == 'table' and job['id'] == ARGV[1] then
+      redis.call('LREM', KEYS[i], 1, raw)
+      job['lane'] = ARGV[2]
+      redis.call('RPUSH', KEYS[1], cjson.encode(job))
+      return 1
+    end
+  end
+end
+return 0
+"""
+
+
+async def promote_job(redis_client, job_id: str, lane: str) -> bool:
+    """
+    Move a still-queued job to a higher-priority lane (never to a lower one).
+    Returns whether it moved; a claimed or finished job stays where it is.
+    """
+    lower = list(LANES)[list(LANES).index(lane) + 1:]
+    if not lower:
+        return False
+    moved = await redis_client.eval(PROMOTE_SCRIPT, 1 + len(lower), lane_key(lane), *(lane_key(l) for l in lower), job_id, lane)
+    if moved:
+        key = f"{JOB_STATUS_PREFIX}{job_id}"
+        await redis_client.hset(key, mapping={"lane": lane, "updated_at": time.time()})
+        await redis_client.expire(key, JOB_STATUS_TTL_SECONDS)
+    return bool(moved)
+
+
+async def record_lag(redis_client, job: Dict, wait_seconds: float, total_seconds: float):
+    """Accumulate time-in-queue and enqueue-to-done for the job's lane."""
+    key = f"{LAG_KEY_PREFIX}{job.get('lane') or DEFAULT_LANE}"
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.hincrby(key, "jobs", 1)
+        pipe.hincrbyfloat(key, "wait_seconds_total", wait_seconds)
+        pipe.hincrbyfloat(key, "total_seconds_total", total_seconds)
+        pipe.hset(key, mapping={"last_wait_seconds": wait_seconds, "last_total_seconds": total_seconds})
+        await pipe.execute()
+
+
+async def lane_stats(redis_client) -> Dict[str, Dict]:
+    """Depth, oldest-item age and accumulated lag for every lane."""
+    stats = {}
+    now = time.time()
+    for lane in LANES:
+        depth = await redis_client.llen(lane_key(lane))
+        oldest = await redis_client.lindex(lane_key(lane), 0)
+        oldest_age = None
+        if oldest is not None:
+            enqueued_at = decode_job(oldest, lane).get("enqueued_at")
+            if enqueued_at:
+                oldest_age = now - float(enqueued_at)
+        lag = await redis_client.hgetall(f"{LAG_KEY_PREFIX}{lane}")
+        jobs = int(lag.get("jobs", 0))
+        stats[lane] = {
+            "weight": LANES[lane],
+            "depth": depth,
+            "oldest_age_seconds": oldest_age,
+            "jobs_done": jobs,
+            "avg_wait_seconds": float(lag.get("wait_seconds_total", 0)) / jobs if jobs else None,
+            "avg_total_seconds": float(lag.get("total_seconds_total", 0)) / jobs if jobs else None,
+            "last_wait_seconds": float(lag["last_wait_seconds"]) if "last_wait_seconds" in lag else None,
+            "last_total_seconds": float(lag["last_total_seconds"]) if "last_total_seconds" in lag else None,
+        }
+    return stats
@@ -1,6 +1,4 @@
 import os
-import uuid
-import shutil
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Query, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
@@ -9,7 +7,22 @@ import redis.asyncio as redis
 from typing import Optional
 from openai import OpenAI
 from preprocessing.database.pg import get_db_connection
+from preprocessing.database.vectors import SEARCH_STRATEGIES, SEARCH_STRATEGY, Vector, execute_nearest
+from preprocessing.ingest_cache import default_embedding_cache
+from preprocessing.rate_limit import RateLimiter, estimate_tokens, usage_report
 from rq import Queue, Worker
+from app.queues import (
+    DEFAULT_LANE,
+    JOB_STATUS_PREFIX,
+    LANES,
+    lane_key,
+    lane_stats,
+    make_job,
+    promote_job,
+    queue_job,
+    spool_job_key,
+)
+from app.spool import recover_spool, spool_upload
 
 EMBEDDING_MODEL = "text-embedding-ada-002"
 CHAT_MODEL = os.getenv("CHAT_MODEL", "gpt-4o")
@@ -57,19 +70,27 @@ def create_openai_client() -> OpenAI:
 
 
 client = create_openai_client()
+embedding_cache = default_embedding_cache()
+# search traffic may use the capacity batch ingestion leaves in reserve
+rate_limiter = RateLimiter("server", priority="interactive")
+CHAT_OUTPUT_TOKENS = 1000
+
+
+redis_memory = redis.from_url(os.getenv("REDIS_URL"), decode_responses=True)
+redis_file_queue = redis.Redis(host="redis", port=6379, db=1, decode_responses=True)
 
 
 @asynccontextmanager
 async def lifespan(_: FastAPI):
+    # Spooled uploads outlive the server; reconcile them with the queues instead of deleting them.
     try:
-        yield
-    finally:
-        clear_uploaded_files_dir()
+        await recover_spool(redis_file_queue)
+    except Exception as error:
+        print(f"[ERROR] Spool recovery failed: {error}")
+    yield
 
 
 app = FastAPI(lifespan=lifespan)
-redis_memory = redis.from_url(os.getenv("REDIS_URL"), decode_responses=True)
-redis_file_queue = redis.Redis(host="redis", port=6379, db=1)
 
 
 app.add_middleware(
@@ -83,6 +104,8 @@ app.add_middleware(
 
 class EmbedRequest(BaseModel):
     text: str
+    # "hnsw" or "binary"; defaults to SEARCH_STRATEGY
+    strategy: Optional[str] = None
 
 
 class EmbedResponse(BaseModel):
@@ -108,6 +131,17 @@ class UploadFileResponse(BaseModel):
     content_type : Optional[str] = None
     size_bytes : int
     status: str
+    job_id: Optional[str] = None
+    # the lane the job is in; for a duplicate, the existing job's (promoted if it was still queued lower)
+    priority: Optional[str] = None
+
+class JobStatusResponse(BaseModel):
+    job_id: str
+    status: str
+    filename: Optional[str] = None
+    lane: Optional[str] = None
+    detail: Optional[str] = None
+    updated_at: Optional[float] = None
 
 class UploadCounterResetResponse(BaseModel):
     key: str
@@ -116,40 +150,50 @@ class UploadCounterResetResponse(BaseModel):
 
 VALID_PROM_UPLOAD_EXTENSIONS = [".pdf", ".docx"]
 
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-UPLOAD_DIR = os.path.abspath(os.path.join(BASE_DIR, "..", "uploaded_files"))
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-
-def clear_uploaded_files_dir() -> None:
-    if os.path.isdir(UPLOAD_DIR):
-        shutil.rmtree(UPLOAD_DIR, ignore_errors=True)
-
 
 
 @app.post("/upload/prom", response_model=UploadFileResponse)
 async def upload_file(
     file: UploadFile = File(...),
-    path: str = Form(...)
+    path: str = Form(...),
+    priority: str = Form(DEFAULT_LANE)
 ) -> UploadFileResponse:
+    if priority not in LANES:
+        raise HTTPException(status_code=400, detail=f"priority must be one of {list(LANES)}")
     safe_filename = os.path.basename(file.filename or "upload.bin")
-    stem, ext = os.path.splitext(safe_filename)
-    unique_suffix = uuid.uuid4().hex[:8]
-    stored_filename = f"{stem}__{unique_suffix}{ext}"
-    filepath = os.path.join(UPLOAD_DIR, stored_filename)
     #maybe use aiofiles and turn this blocking operation into async
-    total_file_bytes = 0
-    with open(filepath, "wb") as f:
-        while chunk := await file.read(1024 * 1024):
-            f.write(chunk)
-            total_file_bytes += len(chunk)
-    await redis_file_queue.rpush("pending_files", filepath)
+    filepath, total_file_bytes, already_spooled = await spool_upload(file, safe_filename)
+    if already_spooled:
+        # identical content is already waiting in the spool: report the job processing it,
+        # moved up to the requested lane if it is still queued in a lower one
+        job_id = await redis_file_queue.get(spool_job_key(filepath))
+        lane = None
+        if job_id:
+            if await promote_job(redis_file_queue, job_id, priority):
+                lane = priority
+            else:
+                lane = await redis_file_queue.hget(f"{JOB_STATUS_PREFIX}{job_id}", "lane")
+        return UploadFileResponse(
+            filename=file.filename,
+            path = path,
+            content_type = file.content_type,
+            size_bytes = total_file_bytes,
+            status = "duplicate",
+            job_id = job_id,
+            priority = lane or None
+        )
+
+    job = make_job(filepath, safe_filename, priority)
+    await queue_job(redis_file_queue, job)
 
     return UploadFileResponse(
         filename=file.filename,
         path = path,
         content_type = file.content_type,
         size_bytes = total_file_bytes,
-        status = "queued"
+        status = "queued",
+        job_id = job["id"],
+        priority = priority
     )
 
 @app.post("/upload/emails", response_model=UploadFileResponse)
@@ -170,8 +214,34 @@ async def upload_email(
 
 @app.get("/upload/show-list")
 async def show_list():
-    data_items = await redis_file_queue.lrange("pending_files", 0, -1)
-    return data_items
+    return {lane: await redis_file_queue.lrange(lane_key(lane), 0, -1) for lane in LANES}
+
+
+@app.get("/upload/queue-stats")
+async def queue_stats():
+    """Per-lane depth, age of the oldest queued job and average queue lag."""
+    return await lane_stats(redis_file_queue)
+
+
+@app.get("/upstream/usage")
+def upstream_usage(hours: int = Query(1, ge=1, le=168)):
+    """Requests and tokens granted per consumer against the shared API key."""
+    return usage_report(hours)
+
+
+@app.get("/upload/status/{job_id}", response_model=JobStatusResponse)
+async def upload_status(job_id: str) -> JobStatusResponse:
+    fields = await redis_file_queue.hgetall(f"{JOB_STATUS_PREFIX}{job_id}")
+    if not fields:
+        raise HTTPException(status_code=404, detail="Unknown job id")
+    return JobStatusResponse(
+        job_id=job_id,
+        status=fields.get("status", "unknown"),
+        filename=fields.get("filename"),
+        lane=fields.get("lane"),
+        detail=fields.get("detail"),
+        updated_at=float(fields["updated_at"]) if "updated_at" in fields else None,
+    )
 
 @app.post("/upload/reset-counter", response_model=UploadCounterResetResponse)
 async def reset_upload_counter() -> UploadCounterResetResponse:
@@ -181,13 +251,29 @@ async def reset_upload_counter() -> UploadCounterResetResponse:
     return UploadCounterResetResponse(key=key, value=0)
 
 
+def search_strategy(request: EmbedRequest) -> str:
+    strategy = (request.strategy or SEARCH_STRATEGY).lower()
+    if strategy not in SEARCH_STRATEGIES:
+        raise HTTPException(status_code=400, detail=f"strategy must be one of {list(SEARCH_STRATEGIES)}")
+    return strategy
+
+
 def embed_query(text: str) -> list[float]:
+    if embedding_cache is not None:
+        cached = embedding_cache.get(EMBEDDING_MODEL, text)
+        if cached is not None:
+            return cached
+    rate_limiter.acquire_sync(estimate_tokens(text))
     response = client.embeddings.create(model=EMBEDDING_MODEL, input=text)
-    return response.data[0].embedding
+    embedding = response.data[0].embedding
+    if embedding_cache is not None:
+        embedding_cache.put(EMBEDDING_MODEL, text, embedding)
+    return embedding
 
 
 def chat_completion(system_prompt: str, user_payload: str) -> str:
     """Send a system + user message to the LLM and return the response text."""
+    rate_limiter.acquire_sync(estimate_tokens(system_prompt) + estimate_tokens(user_payload) + CHAT_OUTPUT_TOKENS)
     print(f"[DEBUG] Sending to chat completion (model={CHAT_MODEL})...")
     completion = client.chat.completions.create(
         model=CHAT_MODEL,
@@ -210,24 +296,17 @@ def search_emails(request: EmbedRequest) -> SearchResponse:
     query = request.text.strip()
     if not query:
         raise HTTPException(status_code=400, detail="Text is required")
+    strategy = search_strategy(request)
 
-    query_embedding = embed_query(query)
+    query_embedding = Vector(embed_query(query))
 
     con = None
     try:
         con = get_db_connection()
         cursor = con.cursor()
-        cursor.execute(
-            """
-            SELECT
-                email_id,
-                llm_context,
-                1 - (embedding <=> %s::vector) AS similarity
-            FROM email_embeddings
-            ORDER BY embedding <=> %s::vector
-            LIMIT 5
-            """,
-            (query_embedding, query_embedding),
+        execute_nearest(
+            cursor, "email_embeddings", "embedding", "email_id", query_embedding, 5, strategy,
+            texts=("email_texts", "email_id", "llm_context"),
         )
         rows = cursor.fetchall()
     except Exception as error:
@@ -237,7 +316,7 @@ def search_emails(request: EmbedRequest) -> SearchResponse:
             con.close()
 
     results = [
-        SearchResult(id=row[0], title=row[1] or "No context available", similarity=float(row[2]))
+        SearchResult(id=row[0], title=row[1] or "No context available", similarity=1 - float(row[2]))
         for row in rows
     ]
     return SearchResponse(results=results)
@@ -249,24 +328,16 @@ def search_proms(request: EmbedRequest) -> SearchResponse:
     query = request.text.strip()
     if not query:
         raise HTTPException(status_code=400, detail="Text is required")
+    strategy = search_strategy(request)
 
-    query_embedding = embed_query(query)
+    query_embedding = Vector(embed_query(query))
 
     con = None
     try:
         con = get_db_connection()
         cursor = con.cursor()
-        cursor.execute(
-            """
-            SELECT
-                prom_id,
-                request_title,
-                1 - (request_embedding <=> %s::vector) AS similarity
-            FROM prom_embeddings
-            ORDER BY request_embedding <=> %s::vector
-            LIMIT 5
-            """,
-            (query_embedding, query_embedding),
+        execute_nearest(
+            cursor, "prom_embeddings", "request_embedding", "prom_id, request_title", query_embedding, 5, strategy,
         )
         rows = cursor.fetchall()
     except Exception as error:
@@ -276,7 +347,7 @@ def search_proms(request: EmbedRequest) -> SearchResponse:
             con.close()
 
     results = [
-        SearchResult(id=row[0], title=row[1] or "Untitled Request", similarity=float(row[2]))
+        SearchResult(id=row[0], title=row[1] or "Untitled Request", similarity=1 - float(row[2]))
         for row in rows
     ]
     return SearchResponse(results=results)
@@ -288,10 +359,11 @@ def embed_emails(request: EmbedRequest) -> EmbedResponse:
     print(f"[DEBUG][emails] Received query: '{query}'")
     if not query:
         raise HTTPException(status_code=400, detail="Text is required")
+    strategy = search_strategy(request)
 
     try:
         print("[DEBUG][emails] Embedding query...")
-        query_embedding = embed_query(query)
+        query_embedding = Vector(embed_query(query))
         print(f"[DEBUG][emails] Embedding succeeded, dim={len(query_embedding)}")
     except Exception as error:
         print(f"[ERROR][emails] Embedding failed: {error}")
@@ -302,23 +374,16 @@ def embed_emails(request: EmbedRequest) -> EmbedResponse:
         print("[DEBUG][emails] Connecting to database...")
         con = get_db_connection()
         cursor = con.cursor()
-        cursor.execute(
-            """
-            SELECT
-                date,
-                requestor,
-                filename,
-                prom_approval,
-                prom_considerations,
-                chemicals,
-                processes,
-                raw_thread,
-                1 - (embedding <=> %s::vector) AS similarity
-            FROM email_embeddings
-            ORDER BY embedding <=> %s::vector
-            LIMIT 1
-            """,
-            (query_embedding, query_embedding),
+        execute_nearest(
+            cursor,
+            "email_embeddings",
+            "embedding",
+            "email_id, date, requestor, filename, prom_approval, prom_considerations, chemicals, processes",
+            query_embedding,
+            1,
+            strategy,
+            # the raw thread is read for the chosen row only
+            texts=("email_texts", "email_id", "raw_thread"),
         )
         row = cursor.fetchone()
         print(f"[DEBUG][emails] DB query done. Row found: {row is not None}")
@@ -333,9 +398,10 @@ def embed_emails(request: EmbedRequest) -> EmbedResponse:
         return EmbedResponse(text="No relevant emails found.")
 
     (
-        date, requestor, filename, prom_approval, prom_considerations,
-        chemicals, processes, raw_thread, similarity,
+        _, date, requestor, filename, prom_approval, prom_considerations,
+        chemicals, processes, raw_thread, distance,
     ) = row
+    similarity = 1 - distance
 
     print(f"[DEBUG][emails] Best match: date={date}, requestor={requestor}, similarity={similarity:.4f}")
 
@@ -365,10 +431,11 @@ def embed_proms(request: EmbedRequest) -> EmbedResponse:
     print(f"[DEBUG][proms] Received query: '{query}'")
     if not query:
         raise HTTPException(status_code=400, detail="Text is required")
+    strategy = search_strategy(request)
 
     try:
         print("[DEBUG][proms] Embedding query...")
-        query_embedding = embed_query(query)
+        query_embedding = Vector(embed_query(query))
         print(f"[DEBUG][proms] Embedding succeeded, dim={len(query_embedding)}")
     except Exception as error:
         print(f"[ERROR][proms] Embedding failed: {error}")
@@ -379,20 +446,14 @@ def embed_proms(request: EmbedRequest) -> EmbedResponse:
         print("[DEBUG][proms] Connecting to database...")
         con = get_db_connection()
         cursor = con.cursor()
-        cursor.execute(
-            """
-            SELECT
-                request_title,
-                chemicals_and_processes,
-                request_reason,
-                process_flow,
-                amount_and_form,
-                1 - (request_embedding <=> %s::vector) AS similarity
-            FROM prom_embeddings
-            ORDER BY request_embedding <=> %s::vector
-            LIMIT 1
-            """,
-            (query_embedding, query_embedding),
+        execute_nearest(
+            cursor,
+            "prom_embeddings",
+            "request_embedding",
+            "request_title, chemicals_and_processes, request_reason, process_flow, amount_and_form",
+            query_embedding,
+            1,
+            strategy,
         )
         row = cursor.fetchone()
         print(f"[DEBUG][proms] DB query done. Row found: {row is not None}")
@@ -408,8 +469,9 @@ def embed_proms(request: EmbedRequest) -> EmbedResponse:
 
     (
         request_title, chemicals_and_processes, request_reason,
-        process_flow, amount_and_form, similarity,
+        process_flow, amount_and_form, distance,
     ) = row
+    similarity = 1 - distance
 
     print(f"[DEBUG][proms] Best match: title={request_title}, similarity={similarity:.4f}")
 
@@ -0,0 +1,216 @@
+"""
+Durable, content-addressed spool for uploaded PROM files.
+
+Uploads are written to <SPOOL_DIR>/<sha256><ext> (plus a small .meta.json
+sidecar with the original filename) and fsynced before they are queued.
+Files are only removed by the worker after a successful insert; files that
+fail extraction are moved to <SPOOL_DIR>/failed for inspection.
+
+Workers claim jobs by moving them atomically from their lane to a
+per-worker processing list (pending_files:processing:<pid>), so a job is
+always in exactly one list. recover_spool() reconciles the spool with Redis
+on startup: processing lists of workers without a live heartbeat are put
+back, spool files that no queue references are re-enqueued, and queued jobs
+whose file is gone are dropped. A job whose worker died MAX_JOB_ATTEMPTS
+times is quarantined instead of being requeued again.
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.queues import (
+    LANES,
+    PROCESSING_PREFIX,
+    QUEUE_PREFIX,
+    WORKER_HEARTBEAT_PREFIX,
+    decode_job,
+    encode_job,
+    lane_key,
+    make_job,
+    processing_key,
+    queue_job,
+    set_job_status,
+)
+
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+SPOOL_DIR = os.path.abspath(os.getenv("UPLOAD_SPOOL_DIR", os.path.join(ROOT_DIR, "app", "spool")))
+TMP_DIR = os.path.join(SPOOL_DIR, "tmp")
+FAILED_DIR = os.path.join(SPOOL_DIR, "failed")
+
+RECOVERY_LOCK_KEY = "spool_recovery_lock"
+RECOVERY_LOCK_SECONDS = 60
+RECOVERY_LANE = "bulk"
+STALE_TMP_SECONDS = 3600
+# a job that was in flight when its worker died this many times is quarantined
+MAX_JOB_ATTEMPTS = int(os.getenv("MAX_JOB_ATTEMPTS", "3"))
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def ensure_spool_dirs():
+    for directory in (SPOOL_DIR, TMP_DIR, FAILED_DIR):
+        os.makedirs(directory, exist_ok=True)
+
+
+def _meta_path(path: str) -> str:
+    return f"{path}.meta.json"
+
+
+async def spool_upload(upload, filename: str) -> Tuple[str, int, bool]:
+    """
+    Stream an UploadFile into the spool under its content hash.
+    Returns (spool path, size in bytes, whether that content was already spooled).
+    """
+    ensure_spool_dirs()
+    _, ext = os.path.splitext(filename)
+    tmp_path = os.path.join(TMP_DIR, uuid.uuid4().hex)
+    digest = hashlib.sha256()
+    size = 0
+    with open(tmp_path, "wb") as f:
+        while chunk := await upload.read(CHUNK_SIZE):
+            f.write(chunk)
+            digest.update(chunk)
+            size += len(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+
+    path = os.path.join(SPOOL_DIR, f"{digest.hexdigest()}{ext.lower()}")
+    if os.path.exists(path):
+        os.remove(tmp_path)
+        return path, size, True
+
+    with open(_meta_path(path), "w") as f:
+        json.dump({"filename": filename, "uploaded_at": time.time()}, f)
+    os.replace(tmp_path, path)
+    return path, size, False
+
+
+def original_filename(path: str) -> str:
+    try:
+        with open(_meta_path(path)) as f:
+            return json.load(f)["filename"]
+    except (OSError, ValueError, KeyError):
+        return os.path.basename(path)
+
+
+def release_spooled_file(path: str):
+    """Garbage-collect a spooled file once its form is in the database."""
+    for candidate in (path, _meta_path(path)):
+        try:
+            os.remove(candidate)
+        except FileNotFoundError:
+            pass
+
+
+def quarantine_spooled_file(path: str):
+    """Move a file that could not be processed out of the live spool."""
+    os.makedirs(FAILED_DIR, exist_ok=True)
+    for candidate in (path, _meta_path(path)):
+        if os.path.exists(candidate):
+            shutil.move(candidate, os.path.join(FAILED_DIR, os.path.basename(candidate)))
+
+
+def spooled_files() -> List[str]:
+    if not os.path.isdir(SPOOL_DIR):
+        return []
+    files = []
+    for name in os.listdir(SPOOL_DIR):
+        path = os.path.join(SPOOL_DIR, name)
+        if os.path.isfile(path) and not name.endswith(".meta.json"):
+            files.append(path)
+    return files
+
+
+async def requeue_processing(redis_client, worker_id: str) -> int:
+    """
+    Put a dead worker's claimed jobs back at the head of their lanes, in
+    their original order, with attempts incremented. Jobs whose spool file
+    is gone were already finished; jobs that reach MAX_JOB_ATTEMPTS are
+    quarantined. Each job is popped before it is pushed, so concurrent
+    callers never requeue the same job twice.
+    """
+    key = processing_key(worker_id)
+    requeued = failed = 0
+    while (raw := await redis_client.rpop(key)) is not None:
+        job = decode_job(raw, RECOVERY_LANE)
+        if not job.get("path") or not os.path.exists(job["path"]):
+            continue
+        job["attempts"] = int(job.get("attempts") or 0) + 1
+        if job["attempts"] >= MAX_JOB_ATTEMPTS:
+            quarantine_spooled_file(job["path"])
+            await set_job_status(redis_client, job, "failed", f"worker died {job['attempts']} times while processing it")
+            failed += 1
+            continue
+        lane = job.get("lane") if job.get("lane") in LANES else RECOVERY_LANE
+        await redis_client.lpush(lane_key(lane), encode_job(job))
+        await set_job_status(redis_client, job, "queued", f"requeued after worker exit (attempt {job['attempts'] + 1})")
+        requeued += 1
+    await redis_client.delete(f"{WORKER_HEARTBEAT_PREFIX}{worker_id}")
+    if requeued or failed:
+        print(f"[spool] worker {worker_id}: requeued {requeued} job(s), quarantined {failed}")
+    return requeued
+
+
+async def _queued_paths(redis_client) -> Set[str]:
+    paths = set()
+    for key in [lane_key(lane) for lane in LANES] + [QUEUE_PREFIX]:
+        for raw in await redis_client.lrange(key, 0, -1):
+            paths.add(decode_job(raw).get("path"))
+    return paths
+
+
+async def _drop_missing(redis_client) -> int:
+    dropped = 0
+    for key in [lane_key(lane) for lane in LANES] + [QUEUE_PREFIX]:
+        for raw in await redis_client.lrange(key, 0, -1):
+            job = decode_job(raw)
+            if job.get("path") and not os.path.exists(job["path"]):
+                dropped += await redis_client.lrem(key, 0, raw)
+                await set_job_status(redis_client, job, "failed", "spool file missing")
+    return dropped
+
+
+async def recover_spool(redis_client) -> Optional[Dict[str, int]]:
+    """
+    Reconcile the spool directory with the queues. Safe to call from every
+    process on startup; a short Redis lock makes concurrent calls no-ops.
+    """
+    ensure_spool_dirs()
+    if not await redis_client.set(RECOVERY_LOCK_KEY, os.getpid(), nx=True, ex=RECOVERY_LOCK_SECONDS):
+        return None
+    try:
+        # partial uploads left behind by a crashed server
+        for name in os.listdir(TMP_DIR):
+            tmp_path = os.path.join(TMP_DIR, name)
+            if time.time() - os.path.getmtime(tmp_path) > STALE_TMP_SECONDS:
+                os.remove(tmp_path)
+
+        requeued = 0
+        inflight_paths = set()
+        async for key in redis_client.scan_iter(match=f"{PROCESSING_PREFIX}*"):
+            worker_id = key[len(PROCESSING_PREFIX):]
+            if await redis_client.exists(f"{WORKER_HEARTBEAT_PREFIX}{worker_id}"):
+                inflight_paths.update(decode_job(raw).get("path") for raw in await redis_client.lrange(key, 0, -1))
+            else:
+                requeued += await requeue_processing(redis_client, worker_id)
+
+        dropped = await _drop_missing(redis_client)
+
+        referenced = await _queued_paths(redis_client) | inflight_paths
+        orphaned = 0
+        for path in spooled_files():
+            if path in referenced:
+                continue
+            await queue_job(redis_client, make_job(path, original_filename(path), RECOVERY_LANE), "recovered from spool")
+            orphaned += 1
+
+        summary = {"requeued_inflight": requeued, "dropped_missing": dropped, "enqueued_orphans": orphaned}
+        print(f"[spool] recovery: {summary}")
+        return summary
+    finally:
+        await redis_client.delete(RECOVERY_LOCK_KEY)
@@ -0,0 +1,262 @@
+"""
+Pre-forking supervisor for the PROM upload workers.
+
+The extraction stack (pypdfium2, docx2txt, regex, openai) is imported once
+here and shared with every forked worker copy-on-write. The number of workers
+follows the total depth of the pending_files lanes, dead workers are replaced, and
+per-worker throughput / memory is printed periodically. On SIGTERM workers
+finish their in-flight batch before exiting.
+
+Run from the project root:
+    PYTHONPATH=/app:/app/preprocessing python -m app.supervisor
+"""
+import asyncio
+import gc
+import math
+import os
+import signal
+import time
+import traceback
+from typing import Dict, Optional, Set
+
+import redis
+import redis.asyncio as aioredis
+
+# Preload: importing the worker pulls in the whole extraction stack.
+from app import worker
+from app.queues import QUEUE_PREFIX, WORKER_STATS_PREFIX, lane_keys
+from app.spool import recover_spool, requeue_processing
+
+
+MIN_WORKERS = int(os.getenv("MIN_WORKERS", "1"))
+MAX_WORKERS = int(os.getenv("MAX_WORKERS", "8"))
+FILES_PER_WORKER = int(os.getenv("FILES_PER_WORKER", str(worker.MAX_FILES)))
+
+POLL_INTERVAL_SECONDS = 2
+SCALE_DOWN_GRACE_SECONDS = 30
+STATS_INTERVAL_SECONDS = 30
+SHUTDOWN_TIMEOUT_SECONDS = 120
+
+# a worker that dies sooner than this after starting (e.g. the DB is down) counts
+# as a crash; consecutive crashes delay the next spawn exponentially
+HEALTHY_UPTIME_SECONDS = 60
+RESTART_BACKOFF_BASE_SECONDS = 2
+RESTART_BACKOFF_MAX_SECONDS = 300
+
+redis_file_queue = redis.Redis(host="redis", port=6379, db=1, decode_responses=True)
+
+
+def desired_worker_count(queue_depth: int) -> int:
+    wanted = math.ceil(queue_depth / FILES_PER_WORKER)
+    return max(MIN_WORKERS, min(MAX_WORKERS, wanted))
+
+
+def queue_depth() -> int:
+    # the bare pending_files list from before lanes existed counts until workers drain it
+    return sum(redis_file_queue.llen(key) for key in lane_keys() + [QUEUE_PREFIX])
+
+
+async def _with_async_redis(fn, *args):
+    client = aioredis.Redis(host="redis", port=6379, db=1, decode_responses=True)
+    try:
+        return await fn(client, *args)
+    finally:
+        await client.aclose()
+
+
+def read_proc_memory_kb(pid: int) -> Dict[str, int]:
+    """RSS and the part of it still shared with the parent (Linux only)."""
+    memory = {"rss_kb": 0, "shared_kb": 0}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key == "Rss":
+                    memory["rss_kb"] = int(rest.split()[0])
+                elif key in ("Shared_Clean", "Shared_Dirty"):
+                    memory["shared_kb"] += int(rest.split()[0])
+    except OSError:
+        pass
+    return memory
+
+
+class Supervisor:
+    def __init__(self):
+        self.workers: Set[int] = set()
+        self.retiring: Set[int] = set()
+        self.started_at: Dict[int, float] = {}
+        self.restarts = 0
+        self.crash_streak = 0
+        self.respawn_at = 0.0
+        self.stopping = False
+        self.scale_down_since: Optional[float] = None
+        self.last_stats = time.monotonic()
+
+    def spawn_worker(self) -> int:
+        pid = os.fork()
+        if pid == 0:
+            # child: drop the supervisor's handlers; the worker installs its own drain handlers
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            exit_code = 0
+            try:
+                worker.run_worker()
+            except SystemExit as e:
+                exit_code = e.code if isinstance(e.code, int) else 1
+            except BaseException:
+                traceback.print_exc()
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+        self.workers.add(pid)
+        self.started_at[pid] = time.monotonic()
+        print(f"[supervisor] started worker {pid} ({len(self.workers)} running)")
+        return pid
+
+    def retire_worker(self, pid: int):
+        self.retiring.add(pid)
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+        print(f"[supervisor] retiring worker {pid}")
+
+    def reap(self):
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            self.workers.discard(pid)
+            uptime = time.monotonic() - self.started_at.pop(pid, time.monotonic())
+            try:
+                redis_file_queue.delete(f"{WORKER_STATS_PREFIX}{pid}")
+            except redis.RedisError:
+                pass
+            # a worker that exits without emptying its processing list died mid-batch
+            self.requeue_claims(pid)
+            if pid in self.retiring:
+                self.retiring.discard(pid)
+                continue
+            if not self.stopping:
+                self.restarts += 1
+                self.crash_streak = self.crash_streak + 1 if uptime < HEALTHY_UPTIME_SECONDS else 0
+                backoff = 0.0
+                if self.crash_streak:
+                    backoff = min(RESTART_BACKOFF_MAX_SECONDS, RESTART_BACKOFF_BASE_SECONDS * 2 ** (self.crash_streak - 1))
+                self.respawn_at = time.monotonic() + backoff
+                print(f"[supervisor] worker {pid} died (status {status}) after {uptime:.0f}s, restarting in {backoff:.0f}s")
+
+    def requeue_claims(self, pid: int):
+        try:
+            asyncio.run(_with_async_redis(requeue_processing, str(pid)))
+        except redis.RedisError as e:
+            print(f"[supervisor] could not requeue batch of worker {pid}: {e}")
+
+    def scale(self):
+        # the newest worker has stayed up: whatever made workers crash is over
+        if self.crash_streak and self.started_at and time.monotonic() - max(self.started_at.values()) >= HEALTHY_UPTIME_SECONDS:
+            self.crash_streak = 0
+        active = len(self.workers) - len(self.retiring)
+        target = desired_worker_count(queue_depth())
+
+        if target > active:
+            self.scale_down_since = None
+            if time.monotonic() < self.respawn_at:
+                return
+            for _ in range(target - active):
+                self.spawn_worker()
+            return
+
+        if target < active:
+            now = time.monotonic()
+            if self.scale_down_since is None:
+                self.scale_down_since = now
+            if now - self.scale_down_since >= SCALE_DOWN_GRACE_SECONDS:
+                newest_first = sorted(self.workers - self.retiring, reverse=True)
+                for pid in newest_first[: active - target]:
+                    self.retire_worker(pid)
+                self.scale_down_since = None
+        else:
+            self.scale_down_since = None
+
+    def print_stats(self):
+        print(f"[supervisor] queue={queue_depth()} workers={len(self.workers)} restarts={self.restarts}")
+        for pid in sorted(self.workers):
+            stats = redis_file_queue.hgetall(f"{WORKER_STATS_PREFIX}{pid}")
+            files = int(stats.get("files", 0))
+            busy = float(stats.get("busy_seconds", 0.0))
+            uptime = time.time() - float(stats.get("started_at", time.time()))
+            memory = read_proc_memory_kb(pid)
+            print(
+                f"  pid={pid} files={files} batches={stats.get('batches', 0)} "
+                f"problematic={stats.get('problematic', 0)} "
+                f"files/s(busy)={files / busy if busy else 0.0:.2f} "
+                f"busy={busy / uptime * 100 if uptime > 0 else 0.0:.0f}% "
+                f"rss={memory['rss_kb'] / 1024:.0f}MB shared={memory['shared_kb'] / 1024:.0f}MB"
+            )
+
+    def handle_stop(self, signum, _frame):
+        print(f"[supervisor] received signal {signum}, stopping workers")
+        self.stopping = True
+
+    def shutdown(self):
+        for pid in list(self.workers):
+            self.retire_worker(pid)
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT_SECONDS
+        while self.workers and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.2)
+        for pid in list(self.workers):
+            print(f"[supervisor] worker {pid} did not exit in time, killing")
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+            self.workers.discard(pid)
+            try:
+                redis_file_queue.delete(f"{WORKER_STATS_PREFIX}{pid}")
+            except redis.RedisError:
+                pass
+            self.requeue_claims(pid)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.handle_stop)
+        signal.signal(signal.SIGINT, self.handle_stop)
+        # schema changes lock prom_embeddings: once here, not in every forked worker
+        try:
+            worker.migrate()
+        except Exception as e:
+            print(f"[supervisor] prom table migration failed: {e}")
+
+        # keep the preloaded heap out of the collector so children don't dirty it
+        gc.collect()
+        gc.freeze()
+
+        try:
+            asyncio.run(_with_async_redis(recover_spool))
+        except redis.RedisError as e:
+            print(f"[supervisor] spool recovery skipped: {e}")
+
+        for _ in range(MIN_WORKERS):
+            self.spawn_worker()
+
+        while not self.stopping:
+            self.reap()
+            try:
+                self.scale()
+                if time.monotonic() - self.last_stats >= STATS_INTERVAL_SECONDS:
+                    self.print_stats()
+                    self.last_stats = time.monotonic()
+            except redis.RedisError as e:
+                print(f"[supervisor] redis unavailable: {e}")
+            time.sleep(POLL_INTERVAL_SECONDS)
+
+        self.shutdown()
+
+
+if __name__ == "__main__":
+    Supervisor().run()
@@ -1,69 +1,291 @@
 import asyncio
+import redis as sync_redis
 import redis.asyncio as redis
-from typing import List
+from dataclasses import replace
+from typing import Dict, List
 import os
+import signal
 import sys
+import threading
+import time
 
 ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 PREPROCESSING_DIR = os.path.join(ROOT_DIR, "preprocessing")
 if PREPROCESSING_DIR not in sys.path:
     sys.path.append(PREPROCESSING_DIR)
 
-from preprocessing.database.pg import get_db_connection
+from preprocessing.database.pg import get_db_connection, init_prom_table
 from preprocessing.test import fork_then_extract
-from preprocessing.prom_pipeline import filter_duplicates, run_prom_pipeline
+from preprocessing.prom_pipeline import filter_duplicates, rate_limiter, run_prom_pipeline
+from app.queues import (
+    HEARTBEAT_INTERVAL_SECONDS,
+    HEARTBEAT_TTL_SECONDS,
+    LANES,
+    QUEUE_PREFIX,
+    WORKER_HEARTBEAT_PREFIX,
+    WORKER_STATS_PREFIX,
+    WeightedLanePicker,
+    decode_job,
+    lane_key,
+    lane_keys,
+    processing_key,
+    record_lag,
+    set_job_status,
+)
+from app.spool import quarantine_spooled_file, release_spooled_file
 
 
 redis_file_queue = redis.Redis(host="redis", port=6379, db=1, decode_responses=True)
 
-QUEUE_NAME = "pending_files"
+# upstream usage from the embedding calls is tallied under "worker", not "prom_pipeline"
+rate_limiter.consumer = os.getenv("RATE_LIMIT_CONSUMER", "worker")
+
 MAX_FILES = 20
+# how long collect_batch waits for a first job before the loop re-checks for a stop request
+DEQUEUE_WAIT_SECONDS = 5
+DEQUEUE_POLL_SECONDS = 0.5
+
+lane_picker = WeightedLanePicker()
+
+# KEYS[1] is this worker's processing list, KEYS[2..] the lanes to try in order.
+# The head job of the first non-empty lane moves to the processing list in one
+# step, so it is never outside a list. With ARGV[1] == "1" a lane whose head job
+# already crashed a worker (attempts > 0) is passed over: such jobs run alone.
+CLAIM_SCRIPT = """
+for i = 2, #KEYS do
+  local raw = redis.call('LINDEX', KEYS[i], 0)
+  if raw then
+    local ok, job = pcall(cjson.decode, raw)
+    local retried = ok and type(job) == 'table' and (tonumber(job['attempts']) or 0) > 0
+    if not (retried and ARGV[1] == '1') then
+      redis.call('LMOVE', KEYS[i], KEYS[1], 'LEFT', 'RIGHT')
+      return {KEYS[i], raw}
+    end
+  end
+end
+return nil
+"""
 
 
 
-def prom_extraction(batch: List[str]):
+def prom_extraction(batch: List[Dict]):
+    """
+    Extract a PromForm from every job's file.
+    Returns (job, form) pairs to embed, in-batch duplicate jobs, and (job, reason) failures.
+    """
     problematic_files = []
-    results = []
-    for filepath in batch:
-        prom_form = fork_then_extract(filepath)
+    extracted = []
+    for job in batch:
+        if not os.path.exists(job["path"]):
+            problematic_files.append((job, f"spool file missing | {job['path']}"))
+            continue
+        try:
+            prom_form = fork_then_extract(job["path"])
+        except Exception as e:
+            prom_form = f"extraction raised {type(e).__name__}: {e} | {job['filename']}"
         if isinstance(prom_form, str) or prom_form is None:
-            problematic_files.append(prom_form)
-        else:
-            results.append(prom_form)
-    results = filter_duplicates(results)
-    return results, problematic_files
+            problematic_files.append((job, prom_form or "extraction returned nothing"))
+            continue
+        # spool files are named by content hash; keep the uploaded name in the DB
+        prom_form = replace(prom_form, filename=job["filename"])
+        if prom_form.date is None or prom_form.requestor is None or prom_form.request_title is None:
+            problematic_files.append((job, f"missing date, requestor or title | {prom_form.filename}"))
+            continue
+        extracted.append((job, prom_form))
+    unique_ids = {id(prom_form) for prom_form in filter_duplicates([form for _, form in extracted])}
+    results = [(job, form) for job, form in extracted if id(form) in unique_ids]
+    duplicates = [job for job, form in extracted if id(form) not in unique_ids]
+    return results, duplicates, problematic_files
+
+
+async def finish_job(job: Dict, status: str, detail: str = None):
+    """
+    Record the outcome, then move the spooled file away; the file is only
+    deleted once the form is in the DB. A job whose file is gone counts as
+    finished when a dead worker's claims are requeued.
+    """
+    await set_job_status(redis_file_queue, job, status, detail)
+    if status == "failed":
+        if os.path.exists(job["path"]):
+            quarantine_spooled_file(job["path"])
+    else:
+        release_spooled_file(job["path"])
+
 
+async def process_batch(job_batch: List[Dict], con):
+    dequeued_at = time.time()
+    for job in job_batch:
+        await set_job_status(redis_file_queue, job, "processing")
 
-async def process_batch(file_batch: List[str]):
-    results, problematic_files = prom_extraction(file_batch)
+    results, duplicates, problematic_files = prom_extraction(job_batch)
     if results:
-        await run_prom_pipeline(results, con)
+        outcomes = await run_prom_pipeline([form for _, form in results], con)
+        for (job, _), outcome in zip(results, outcomes):
+            if outcome in ("inserted", "duplicate"):
+                await finish_job(job, outcome)
+            else:
+                problematic_files.append((job, outcome))
+    for job in duplicates:
+        await finish_job(job, "duplicate")
+    for job, reason in problematic_files:
+        await finish_job(job, "failed", reason)
+
+    done_at = time.time()
+    for job in job_batch:
+        enqueued_at = job.get("enqueued_at")
+        if enqueued_at:
+            await record_lag(redis_file_queue, job, dequeued_at - enqueued_at, done_at - enqueued_at)
     return problematic_files
 
 
-async def collect_batch():
-    _, first_item = await redis_file_queue.blpop(QUEUE_NAME, timeout=0)
-    batch = [first_item]
+async def claim(worker_id: str, keys: List[str], skip_retried: bool):
+    """Atomically move the head job of the first eligible key onto this worker's processing list."""
+    return await redis_file_queue.eval(CLAIM_SCRIPT, len(keys) + 1, processing_key(worker_id), *keys, int(skip_retried))
+
+
+async def collect_batch(worker_id: str):
+    """
+    Wait for a job on any lane (highest priority first), then fill the batch
+    with a weighted-fair pick across the lanes that still have jobs. Every
+    job is claimed onto pending_files:processing:<worker_id> as it is taken.
+    A job that was requeued after a worker crash is processed on its own, so
+    one poison file cannot take a whole batch down with it again.
+    """
+    # the bare pending_files list from before lanes existed is drained last, as bulk
+    deadline = time.monotonic() + DEQUEUE_WAIT_SECONDS
+    while (item := await claim(worker_id, lane_keys() + [QUEUE_PREFIX], skip_retried=False)) is None:
+        if time.monotonic() >= deadline:
+            return []
+        await asyncio.sleep(DEQUEUE_POLL_SECONDS)
+    key, raw = item
+    first_lane = key.split(":", 1)[1] if ":" in key else "bulk"
+    batch = [decode_job(raw, first_lane)]
+    if batch[0].get("attempts"):
+        return batch
+    available = set(LANES)
     while len(batch) < MAX_FILES:
-        item = await redis_file_queue.lpop(QUEUE_NAME)
-        if item is None:
+        lane = lane_picker.next([lane for lane in LANES if lane in available])
+        if lane is None:
             break
-        batch.append(item)
+        item = await claim(worker_id, [lane_key(lane)], skip_retried=True)
+        if item is None:
+            available.discard(lane)
+            continue
+        batch.append(decode_job(item[1], lane))
     return batch
 
-async def worker():
-    while True:
-        batch = await collect_batch()
+
+class Heartbeat:
+    """
+    Keeps worker_heartbeat:<id> alive from a daemon thread with its own
+    synchronous Redis client, so the key stays fresh while the event loop is
+    blocked in extraction or a batch outlasts the TTL. Spool recovery treats
+    a worker whose heartbeat expired as dead.
+    """
+
+    def __init__(self, worker_id: str, interval: float = HEARTBEAT_INTERVAL_SECONDS, ttl: int = HEARTBEAT_TTL_SECONDS):
+        self.key = f"{WORKER_HEARTBEAT_PREFIX}{worker_id}"
+        self.interval = interval
+        self.ttl = ttl
+        self._client = sync_redis.Redis(host="redis", port=6379, db=1, decode_responses=True)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="heartbeat", daemon=True)
+
+    def beat(self):
+        try:
+            self._client.set(self.key, time.time(), ex=self.ttl)
+        except sync_redis.RedisError as e:
+            print(f"[worker] heartbeat failed: {e}")
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.beat()
+
+    def start(self):
+        self.beat()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        try:
+            self._client.delete(self.key)
+        except sync_redis.RedisError:
+            pass
+
+
+async def record_stats(files: int = 0, problematic: int = 0, busy_seconds: float = 0.0):
+    """Bump this worker's counters; the hash does not expire (Heartbeat carries liveness)."""
+    key = f"{WORKER_STATS_PREFIX}{os.getpid()}"
+    async with redis_file_queue.pipeline(transaction=False) as pipe:
+        pipe.hsetnx(key, "started_at", time.time())
+        pipe.hset(key, "last_seen", time.time())
+        if files:
+            pipe.hincrby(key, "batches", 1)
+            pipe.hincrby(key, "files", files)
+            pipe.hincrby(key, "problematic", problematic)
+            pipe.hincrbyfloat(key, "busy_seconds", busy_seconds)
+        await pipe.execute()
+
+
+async def worker(con):
+    """
+    Consume batches until SIGTERM/SIGINT. A stop request is only checked
+    between batches, so the batch in flight is always finished first.
+    """
+    worker_id = str(os.getpid())
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stopping.set)
+
+    heartbeat = Heartbeat(worker_id).start()
+    try:
+        await drain(con, worker_id, stopping)
+    finally:
+        heartbeat.stop()
+    print(f"[worker {worker_id}] drained, exiting")
+
+
+async def drain(con, worker_id: str, stopping: asyncio.Event):
+    """The batch loop of worker(); returns once stopping is set."""
+    while not stopping.is_set():
+        await record_stats()
+        batch = await collect_batch(worker_id)
         if not batch:
             continue
-        await process_batch(batch)
+        start = time.perf_counter()
+        # an exception here kills the worker; the supervisor requeues the claimed
+        # jobs with attempts + 1 and quarantines them after MAX_JOB_ATTEMPTS
+        problematic_files = await process_batch(batch, con)
+        await redis_file_queue.delete(processing_key(worker_id))
+        await record_stats(len(batch), len(problematic_files), time.perf_counter() - start)
 
 
-if __name__ == "__main__":
-    try: 
+def migrate():
+    """
+    Add the columns/indexes the pre-embedding duplicate lookup relies on.
+    Takes ACCESS EXCLUSIVE locks, so it runs once per deploy (the supervisor
+    calls it before forking), never per worker.
+    """
+    init_prom_table()
+
+
+def run_worker():
+    """Open this process's DB connection and consume the queue forever."""
+    try:
         con = get_db_connection()
     except Exception as e:
         print("Could not establish connection")
         print(e)
         raise SystemExit(1)
-    asyncio.run(worker())
+    try:
+        asyncio.run(worker(con))
+    finally:
+        con.close()
+
+
+if __name__ == "__main__":
+    migrate()
+    run_worker()
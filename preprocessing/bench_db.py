@@ -0,0 +1,327 @@
+"""
+Database benchmarks for email_embeddings.
+
+Inserts: backfills N synthetic rows (random 1536-dim embeddings, ~2 KB of
+text each) into a scratch copy of email_embeddings, once through the per-row
+path that Email.insert_email uses (one INSERT and one commit per row) and once
+through insert_rows (multi-row INSERT, batched commits). A tenth of the rows
+repeat an earlier conflict key so ON CONFLICT DO NOTHING is exercised on both
+paths; the per-row outcomes of the two paths are compared at the end.
+
+Storage: copies the stored email embeddings into scratch vector(1536) and
+halfvec(1536) tables with HNSW indexes, plus a binary_quantize bit(1536) HNSW
+index on the vector copy for the two-stage "binary" search strategy, replays a
+sample of stored embeddings as queries and reports table/index size, latency
+and recall@k of each against an exact full-precision scan.
+
+Search I/O: EXPLAIN (ANALYZE, BUFFERS) of the endpoints' top-5 list and top-1
+answer queries, with heap and TOAST sizes of the tables. Run it before and
+after `python -m database.pg split-texts` to compare the inline layout with
+the narrow vector table plus text side table.
+
+CLI:
+    python preprocessing/bench_db.py [n_rows] [batch_size] [commit_every]
+    python preprocessing/bench_db.py storage [n_queries] [k] [binary_candidates]
+    python preprocessing/bench_db.py search-io [n_queries]
+"""
+import json
+import random
+import statistics
+import sys
+import time
+from dataclasses import replace
+from typing import Dict, List, Optional, Tuple
+
+from psycopg2.extensions import AsIs
+
+from database.pg import get_db_connection, init_email_table
+from database.vectors import (
+    BINARY_CANDIDATES,
+    EMBEDDING_DIM,
+    SEARCH_STRATEGY,
+    VECTOR_STORAGE,
+    Vector,
+    binary_index_name,
+    create_binary_index,
+    nearest_sql,
+    vector_literal,
+)
+from models.insert import COMMIT_EVERY_BATCHES, EMAIL_TABLE, INSERT_BATCH_SIZE, insert_rows
+
+
+BENCH_TABLE = "bench_email_embeddings"
+BENCH_TEXT_TABLE = "bench_email_texts"
+BENCH_SPEC = replace(EMAIL_TABLE, table=BENCH_TABLE, text_table=BENCH_TEXT_TABLE)
+STORAGE_TYPES = ["vector", "halfvec"]
+
+
+def synthetic_rows(n_rows: int, seed: int = 0) -> Tuple[List[tuple], List[tuple]]:
+    """(rows, text_rows) in EMAIL_COLUMNS / EMAIL_TEXT_COLUMNS order."""
+    rng = random.Random(seed)
+    filler = "lorem ipsum dolor sit amet " * 80
+    rows, text_rows = [], []
+    for i in range(n_rows):
+        # every tenth row reuses an earlier row's conflict key
+        key_id = rng.randrange(i) if i and i % 10 == 0 else i
+        rows.append((
+            f"2024-01-{key_id % 28 + 1:02d}",
+            f"archive-{key_id // 1000}.mbox",
+            f"requestor{key_id}@example.edu",
+            rng.choice(["approved", "rejected", "hard_to_tell"]),
+            filler[:200],
+            f"chemical-{key_id}",
+            f"process-{key_id}",
+            Vector(rng.uniform(-1, 1) for _ in range(EMBEDDING_DIM)),
+        ))
+        text_rows.append((filler[:400], filler, filler[:300]))
+    return rows, text_rows
+
+
+def reset_bench_table(con):
+    cursor = con.cursor()
+    cursor.execute(f"DROP TABLE IF EXISTS {BENCH_TEXT_TABLE}")
+    cursor.execute(f"DROP TABLE IF EXISTS {BENCH_TABLE}")
+    cursor.execute(f"CREATE TABLE {BENCH_TABLE} (LIKE email_embeddings INCLUDING ALL)")
+    cursor.execute(f"CREATE TABLE {BENCH_TEXT_TABLE} (LIKE email_texts INCLUDING ALL)")
+    con.commit()
+
+
+def per_row_insert(con, rows: List[tuple], text_rows: List[tuple]) -> List[str]:
+    """The single-row path: one INSERT per table and one commit per row."""
+    outcomes = []
+    for row, text_row in zip(rows, text_rows):
+        outcomes += insert_rows(con, BENCH_SPEC, [row], [text_row], batch_size=1, commit_every=1)
+    return outcomes
+
+
+def timed(label: str, insert, con, rows: List[tuple], text_rows: List[tuple]) -> List[str]:
+    reset_bench_table(con)
+    start = time.perf_counter()
+    outcomes = insert(con, rows, text_rows)
+    elapsed = time.perf_counter() - start
+    print(
+        f"{label:>10}: {elapsed:8.2f}s  {len(rows) / elapsed:8.0f} rows/s  "
+        f"inserted={outcomes.count('inserted')} duplicate={outcomes.count('duplicate')}"
+    )
+    return outcomes
+
+
+def sample_queries(con, n_queries: int) -> List[List[float]]:
+    cursor = con.cursor()
+    cursor.execute("SELECT embedding::text FROM email_embeddings ORDER BY random() LIMIT %s", (n_queries,))
+    return [json.loads(text) for (text,) in cursor.fetchall()]
+
+
+def build_storage_table(con, storage: str) -> str:
+    table = f"bench_{storage}_embeddings"
+    cursor = con.cursor()
+    cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    cursor.execute(
+        f"CREATE TABLE {table} AS "
+        f"SELECT email_id, embedding::{storage}({EMBEDDING_DIM}) AS embedding FROM email_embeddings"
+    )
+    cursor.execute(f"CREATE INDEX {table}_hnsw ON {table} USING hnsw (embedding {storage}_cosine_ops)")
+    cursor.execute(f"ANALYZE {table}")
+    con.commit()
+    return table
+
+
+def relation_sizes(con, table: str, index: Optional[str] = None) -> Dict[str, str]:
+    cursor = con.cursor()
+    cursor.execute("SELECT pg_size_pretty(pg_table_size(%s))", (table,))
+    sizes = {"table": cursor.fetchone()[0], "index": "-"}
+    if index is not None:
+        cursor.execute("SELECT pg_size_pretty(pg_relation_size(%s::regclass))", (index,))
+        sizes["index"] = cursor.fetchone()[0]
+    return sizes
+
+
+def timed_queries(con, sql: str, queries: List[List[float]], storage: str, params: Optional[dict] = None):
+    """(ids per query, latencies in ms); sql takes %(query)s, cast to storage, plus params."""
+    cursor = con.cursor()
+    results, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        cursor.execute(sql, {"query": AsIs(f"'{vector_literal(query)}'::{storage}"), **(params or {})})
+        results.append([row[0] for row in cursor.fetchall()])
+        latencies.append((time.perf_counter() - start) * 1000)
+    return results, latencies
+
+
+def recall_at_k(results: List[List[int]], truth: List[List[int]]) -> float:
+    hits = sum(len(set(found) & set(expected)) for found, expected in zip(results, truth))
+    return hits / max(1, sum(len(expected) for expected in truth))
+
+
+def report(label: str, results, latencies, truth, sizes: Dict[str, str]):
+    latencies = sorted(latencies)
+    print(
+        f"{label:>16}: recall@k={recall_at_k(results, truth):.3f}  "
+        f"p50={statistics.median(latencies):7.2f}ms  p95={latencies[int(len(latencies) * 0.95)]:7.2f}ms  "
+        f"table={sizes['table']} index={sizes['index']}"
+    )
+
+
+def bench_storage(con, n_queries: int, k: int, candidates: int = BINARY_CANDIDATES):
+    queries = sample_queries(con, n_queries)
+    if not queries:
+        print("email_embeddings is empty; run the email pipeline first")
+        return
+    tables = {storage: build_storage_table(con, storage) for storage in STORAGE_TYPES}
+    cursor = con.cursor()
+    try:
+        # exact ground truth: full precision, no index
+        cursor.execute("SET enable_indexscan = off")
+        truth, latencies = timed_queries(
+            con, f"SELECT email_id FROM {tables['vector']} ORDER BY embedding <=> %(query)s LIMIT {k}", queries, "vector"
+        )
+        cursor.execute("SET enable_indexscan = on")
+        report("exact scan", truth, latencies, truth, relation_sizes(con, tables["vector"]))
+        for storage, table in tables.items():
+            results, latencies = timed_queries(
+                con, f"SELECT email_id FROM {table} ORDER BY embedding <=> %(query)s LIMIT {k}", queries, storage
+            )
+            report(f"hnsw {storage}", results, latencies, truth, relation_sizes(con, table, f"{table}_hnsw"))
+
+        table = tables["vector"]
+        create_binary_index(cursor, table, "embedding")
+        cursor.execute(f"ANALYZE {table}")
+        con.commit()
+        cursor.execute("SET hnsw.ef_search = %s", (candidates,))
+        sql = nearest_sql(table, "embedding", "email_id", k, "binary")
+        results, latencies = timed_queries(con, sql, queries, "vector", {"candidates": candidates})
+        cursor.execute("RESET hnsw.ef_search")
+        report(
+            f"binary+rerank {candidates}", results, latencies, truth,
+            relation_sizes(con, table, binary_index_name(table, "embedding")),
+        )
+    finally:
+        con.rollback()
+        for table in tables.values():
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+        con.commit()
+
+
+def text_columns_split(con) -> bool:
+    cursor = con.cursor()
+    cursor.execute(
+        "SELECT count(*) FROM information_schema.columns "
+        "WHERE table_name = 'email_embeddings' AND column_name = 'raw_thread'"
+    )
+    return cursor.fetchone()[0] == 0
+
+
+def heap_and_toast(con, table: str) -> Dict[str, str]:
+    cursor = con.cursor()
+    cursor.execute(
+        "SELECT pg_size_pretty(pg_relation_size(oid)), "
+        "pg_size_pretty(CASE WHEN reltoastrelid = 0 THEN 0 ELSE pg_relation_size(reltoastrelid) END) "
+        "FROM pg_class WHERE relname = %s",
+        (table,),
+    )
+    heap, toast = cursor.fetchone()
+    return {"heap": heap, "toast": toast}
+
+
+def explain_buffers(con, sql: str, query: List[float]) -> Dict[str, float]:
+    """Shared buffers touched (hit + read) and execution time of one query."""
+    cursor = con.cursor()
+    cursor.execute(
+        "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql,
+        {"query": AsIs(f"'{vector_literal(query)}'::{VECTOR_STORAGE}"), "candidates": BINARY_CANDIDATES},
+    )
+    plan = cursor.fetchone()[0]
+    plan = plan[0] if isinstance(plan, list) else json.loads(plan)[0]
+    top = plan["Plan"]
+    return {
+        "hit": top.get("Shared Hit Blocks", 0),
+        "read": top.get("Shared Read Blocks", 0),
+        "ms": plan.get("Execution Time", 0.0),
+    }
+
+
+def bench_search_io(con, n_queries: int):
+    """
+    Buffers per search for the top-5 list and the top-1 answer query, in the
+    layout the database currently has; run before and after split_text_columns.
+    """
+    queries = sample_queries(con, n_queries)
+    if not queries:
+        print("email_embeddings is empty; run the email pipeline first")
+        return
+    if text_columns_split(con):
+        layout = "split"
+        searches = {
+            "top-5 list": nearest_sql(
+                "email_embeddings", "embedding", "email_id", 5, texts=("email_texts", "email_id", "llm_context"),
+            ),
+            "top-1 answer": nearest_sql(
+                "email_embeddings", "embedding", "email_id, prom_considerations, chemicals, processes", 1,
+                texts=("email_texts", "email_id", "raw_thread"),
+            ),
+        }
+    else:
+        layout = "inline"
+        searches = {
+            "top-5 list": nearest_sql("email_embeddings", "embedding", "email_id, llm_context", 5),
+            "top-1 answer": nearest_sql(
+                "email_embeddings", "embedding", "email_id, prom_considerations, chemicals, processes, raw_thread", 1,
+            ),
+        }
+    if SEARCH_STRATEGY == "binary":
+        con.cursor().execute("SET hnsw.ef_search = %s", (BINARY_CANDIDATES,))
+    print(f"layout={layout} email_embeddings {heap_and_toast(con, 'email_embeddings')}")
+    if layout == "split":
+        print(f"email_texts {heap_and_toast(con, 'email_texts')}")
+    for label, sql in searches.items():
+        runs = [explain_buffers(con, sql, query) for query in queries]
+        print(
+            f"{label:>13}: buffers/search hit={statistics.mean(r['hit'] for r in runs):8.1f} "
+            f"read={statistics.mean(r['read'] for r in runs):8.1f}  "
+            f"exec p50={statistics.median(r['ms'] for r in runs):7.2f}ms"
+        )
+    con.rollback()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "search-io":
+        con = get_db_connection()
+        try:
+            bench_search_io(con, int(sys.argv[2]) if len(sys.argv) > 2 else 100)
+        finally:
+            con.close()
+        raise SystemExit(0)
+
+    if len(sys.argv) > 1 and sys.argv[1] == "storage":
+        n_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+        k = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+        candidates = int(sys.argv[4]) if len(sys.argv) > 4 else BINARY_CANDIDATES
+        con = get_db_connection()
+        try:
+            bench_storage(con, n_queries, k, candidates)
+        finally:
+            con.close()
+        raise SystemExit(0)
+
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else INSERT_BATCH_SIZE
+    commit_every = int(sys.argv[3]) if len(sys.argv) > 3 else COMMIT_EVERY_BATCHES
+
+    con = init_email_table(con=get_db_connection(), drop_table=False)
+    rows, text_rows = synthetic_rows(n_rows)
+    print(f"{n_rows} rows, batch_size={batch_size}, commit_every={commit_every} batches")
+    try:
+        per_row = timed("per-row", per_row_insert, con, rows, text_rows)
+        batched = timed(
+            "batched",
+            lambda c, r, t: insert_rows(c, BENCH_SPEC, r, t, batch_size, commit_every),
+            con,
+            rows,
+            text_rows,
+        )
+        print(f"per-row outcomes match: {per_row == batched}")
+    finally:
+        con.cursor().execute(f"DROP TABLE IF EXISTS {BENCH_TEXT_TABLE}")
+        con.cursor().execute(f"DROP TABLE IF EXISTS {BENCH_TABLE}")
+        con.commit()
+        con.close()
@@ -0,0 +1,174 @@
+"""
+Benchmark for mbox parsing and threading.
+
+Writes a synthetic pipermail-style archive (n_messages messages in threads of
+1-8, interleaved by date; some replies carry only In-Reply-To and some
+threads lost their first message) and times:
+
+- indexing with the memory-mapped MboxReader against the old line-by-line
+  text-mode parser (parse_mbox_threads_textio), which must agree exactly;
+- reading the messages of the threads back, through one reader against
+  get_email_by_msgid reopening the file per message;
+- the one-pass JWZ threading in build_threads against the original
+  legacy_threads. The legacy threader is quadratic, so on large archives it
+  is timed on legacy_roots sampled roots and extrapolated to all of them.
+
+Also checks, on a small archive without orphans, that both threaders produce
+the same threads, and reports how many messages legacy threading drops
+(replies to missing roots) on the full archive.
+
+CLI:
+    python preprocessing/bench_email_parsing.py [n_messages] [legacy_roots]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from mbox_reader import MboxReader
+from order_emails import (
+    build_threads,
+    get_email_by_msgid,
+    join_emails_by_root,
+    legacy_threads,
+    parent_emails,
+    parse_mbox_threads,
+    parse_mbox_threads_textio,
+)
+
+
+SEED = 7
+ORPHAN_RATE = 0.05
+REPLY_TO_ONLY_RATE = 0.1
+
+
+def write_synthetic_mbox(path: str, n_messages: int, orphan_rate: float = ORPHAN_RATE, reply_to_only_rate: float = REPLY_TO_ONLY_RATE):
+    rng = random.Random(SEED)
+    start = datetime(2019, 1, 1)
+    messages = []
+    thread_no = 0
+    while len(messages) < n_messages:
+        thread_no += 1
+        size = min(rng.randint(1, 8), n_messages - len(messages))
+        sent = start + timedelta(minutes=rng.randrange(0, 60 * 24 * 365 * 3))
+        orphaned = size > 1 and rng.random() < orphan_rate
+        ids = [f"t{thread_no}.m{i}@synthetic.example" for i in range(size)]
+        for i, msgid in enumerate(ids):
+            if i == 0 and orphaned:
+                continue
+            sent += timedelta(minutes=rng.randrange(5, 600))
+            parent = ids[rng.randrange(0, i)] if i else None
+            chain = ids[:ids.index(parent) + 1] if parent else []
+            sender = f"user{rng.randrange(500)}"
+            headers = [
+                f"From {sender} at stanford.edu  {sent.strftime('%a %b %d %H:%M:%S %Y')}",
+                f"From: {sender} at stanford.edu (User {sender[4:]})",
+                f"Date: {sent.strftime('%a, %d %b %Y %H:%M:%S')} -0700",
+                f"Subject: {'Re: ' if parent else ''}PROM request {thread_no}",
+            ]
+            if parent:
+                headers.append(f"In-Reply-To: <{parent}>")
+                if rng.random() >= reply_to_only_rate:
+                    headers.append(f"References: <{chain[0]}>")
+                    headers.extend(f"\t<{ref}>" for ref in chain[1:])
+            headers.append(f"Message-ID: <{msgid}>")
+            body = f"Message {i} of thread {thread_no}.\n> quoted line\n<not-a-reference@example>\n"
+            messages.append((sent, "\n".join(headers) + "\n\n" + body + "\n"))
+    messages.sort(key=lambda m: m[0])
+    with open(path, "w") as f:
+        for _, text in messages:
+            f.write(text)
+
+
+def legacy_sample(msg_refs: Dict[str, List[str]], legacy_roots: int) -> Dict[str, float]:
+    """Time join_emails_by_root on a sample of roots and extrapolate to all of them."""
+    roots = parent_emails(msg_refs)
+    sample = random.Random(SEED).sample(roots, min(legacy_roots, len(roots)))
+    start = time.perf_counter()
+    for root in sample:
+        join_emails_by_root(msg_refs, root)
+    elapsed = time.perf_counter() - start
+    return {"roots": len(roots), "sampled": len(sample), "seconds": elapsed * len(roots) / max(1, len(sample))}
+
+
+def compare(n_messages: int, legacy_roots: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "synthetic.txt")
+        write_synthetic_mbox(path, n_messages)
+        size_mb = os.path.getsize(path) / 1e6
+
+        start = time.perf_counter()
+        textio_index = parse_mbox_threads_textio(path)
+        textio_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        reader = MboxReader(path)
+        msg_refs, msg_start, msg_end, msg_order = reader.index()
+        parse_s = time.perf_counter() - start
+        same_index = textio_index == (msg_refs, msg_start, msg_end, msg_order)
+
+        start = time.perf_counter()
+        reader_texts = [reader.get_email(msgid) for msgid in msg_order]
+        reader_read_s = time.perf_counter() - start
+        start = time.perf_counter()
+        reopen_texts = [get_email_by_msgid(path, msg_start, msg_end, msgid) for msgid in msg_order]
+        reopen_read_s = time.perf_counter() - start
+        same_texts = reader_texts == reopen_texts
+        del reader_texts, reopen_texts
+        reader.close()
+
+        start = time.perf_counter()
+        threads = build_threads(msg_refs, msg_order)
+        jwz_s = time.perf_counter() - start
+
+        if legacy_roots <= 0 or len(parent_emails(msg_refs)) <= legacy_roots:
+            start = time.perf_counter()
+            legacy = legacy_threads(msg_refs, msg_order)
+            legacy_s = {"roots": len(legacy), "sampled": len(legacy), "seconds": time.perf_counter() - start}
+            legacy_kept = sum(len(t) for t in legacy.values())
+        else:
+            legacy_s = legacy_sample(msg_refs, legacy_roots)
+            roots = set(parent_emails(msg_refs))
+            # a reply is kept by legacy threading only if some root is among its references
+            legacy_kept = sum(1 for msgid, refs in msg_refs.items() if msgid in roots or roots.intersection(refs))
+
+        print(f"{len(msg_order)} messages, {size_mb:.1f} MB")
+        print(
+            f"  index: MboxReader {parse_s:.2f}s ({len(msg_order) / parse_s:,.0f} msgs/s) vs "
+            f"text-mode lines {textio_s:.2f}s ({textio_s / parse_s:.1f}x); {'identical' if same_index else 'DIFFERENT'}"
+        )
+        print(
+            f"  read every message: MboxReader.get_email {reader_read_s:.2f}s vs get_email_by_msgid "
+            f"{reopen_read_s:.2f}s ({reopen_read_s / reader_read_s:.1f}x); {'identical' if same_texts else 'DIFFERENT'}"
+        )
+        print(f"  build_threads (jwz): {jwz_s:.3f}s, {len(threads)} threads, {sum(len(t) for t in threads.values())} messages")
+        extrapolated = " (extrapolated)" if legacy_s["sampled"] < legacy_s["roots"] else ""
+        print(
+            f"  legacy_threads: {legacy_s['seconds']:.2f}s{extrapolated} over {legacy_s['roots']} roots, "
+            f"{legacy_kept} messages threaded ({len(msg_refs) - legacy_kept} dropped)"
+        )
+        print(f"  threading speedup: {legacy_s['seconds'] / max(jwz_s, 1e-9):,.0f}x")
+
+
+def check_agreement(n_messages: int = 2000):
+    """Without orphans or In-Reply-To-only replies the two threaders must agree exactly."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "agreement.txt")
+        write_synthetic_mbox(path, n_messages, orphan_rate=0.0, reply_to_only_rate=0.0)
+        msg_refs, _, _, msg_order = parse_mbox_threads(path)
+        jwz = build_threads(msg_refs, msg_order)
+        legacy = legacy_threads(msg_refs, msg_order)
+        same = jwz == legacy
+        print(f"agreement on {len(msg_order)} messages without orphans: {'identical' if same else 'DIFFERENT'} ({len(jwz)} threads)")
+        return same
+
+
+if __name__ == "__main__":
+    n_messages = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    legacy_roots = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    if not check_agreement():
+        raise SystemExit(1)
+    compare(n_messages, legacy_roots)
@@ -0,0 +1,162 @@
+"""
+Benchmark for the email extraction request layout.
+
+Replays a fixed set of threads (the first N threads in the extraction
+journal, in key order) through each prompt layout, streaming every response
+to time the first token and reading the provider's usage block for prompt,
+cached prompt and completion tokens. Calls are sequential so the provider's prompt cache sees
+one warm prefix per layout.
+
+The "packing" mode compares one-thread-per-call against packed requests over
+the short threads only: wall time, threads/min, tokens per thread and how
+many packed items came back unusable.
+
+CLI:
+    python preprocessing/bench_extraction.py [n_threads] [rounds] [layouts|packing]
+"""
+import asyncio
+import statistics
+import sys
+import time
+from typing import Dict, List
+
+from embed_emails import (
+    EXTRACTION_MODEL,
+    EXTRACTION_OUTPUT_TOKENS,
+    build_extraction_messages,
+    build_packed_messages,
+    client,
+    parse_packed_response,
+)
+from extraction_packer import PACK_MAX_THREAD_TOKENS, PACK_MAX_THREADS, PACK_TOKEN_BUDGET
+from ingest_cache import ExtractionCache, content_key
+from rate_limit import RateLimiter, estimate_tokens
+
+
+LAYOUTS = ["inline", "split", "prefill"]
+
+rate_limiter = RateLimiter("bench_extraction")
+
+
+def load_threads(n_threads: int) -> List[str]:
+    threads = {thread for thread, _ in ExtractionCache().decisions()}
+    return sorted(threads, key=content_key)[:n_threads]
+
+
+async def timed_extraction(messages: List[dict], n_threads: int = 1) -> Dict[str, float]:
+    await rate_limiter.acquire(
+        sum(estimate_tokens(m["content"]) for m in messages) + EXTRACTION_OUTPUT_TOKENS * n_threads
+    )
+    start = time.perf_counter()
+    first_token = None
+    usage = None
+    parts = []
+    stream = await client.chat.completions.create(
+        model=EXTRACTION_MODEL,
+        messages=messages,
+        temperature=0.0,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            if first_token is None:
+                first_token = time.perf_counter() - start
+            parts.append(chunk.choices[0].delta.content)
+        if chunk.usage is not None:
+            usage = chunk.usage
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "ttft": first_token if first_token is not None else time.perf_counter() - start,
+        "total": time.perf_counter() - start,
+        "prompt_tokens": usage.prompt_tokens if usage else 0,
+        "cached_tokens": (getattr(details, "cached_tokens", 0) or 0) if details else 0,
+        "completion_tokens": usage.completion_tokens if usage else 0,
+        "content": "".join(parts),
+    }
+
+
+def summarize(layout: str, runs: List[Dict[str, float]]):
+    ttfts = sorted(run["ttft"] for run in runs)
+    totals = sorted(run["total"] for run in runs)
+    prompt = sum(run["prompt_tokens"] for run in runs)
+    cached = sum(run["cached_tokens"] for run in runs)
+    p90 = ttfts[min(len(ttfts) - 1, int(len(ttfts) * 0.9))]
+    print(
+        f"{layout:8s} calls={len(runs):4d} "
+        f"ttft_p50={statistics.median(ttfts):.3f}s ttft_p90={p90:.3f}s total_p50={statistics.median(totals):.3f}s "
+        f"prompt_tokens={prompt} cached={cached} ({cached / max(prompt, 1):.0%}) "
+        f"uncached_input={prompt - cached} completion={sum(run['completion_tokens'] for run in runs)}"
+    )
+
+
+def pack(threads: List[str]) -> List[List[str]]:
+    """Greedy packing with the same budget as ThreadPacker."""
+    packs, current, tokens = [], [], 0
+    for thread in threads:
+        cost = estimate_tokens(thread)
+        if current and (tokens + cost > PACK_TOKEN_BUDGET or len(current) >= PACK_MAX_THREADS):
+            packs.append(current)
+            current, tokens = [], 0
+        current.append(thread)
+        tokens += cost
+    if current:
+        packs.append(current)
+    return packs
+
+
+def summarize_throughput(mode: str, n_threads: int, runs: List[Dict[str, float]], elapsed: float, unusable: int = 0):
+    prompt = sum(run["prompt_tokens"] for run in runs)
+    completion = sum(run["completion_tokens"] for run in runs)
+    print(
+        f"{mode:8s} threads={n_threads:4d} calls={len(runs):4d} wall={elapsed:.1f}s "
+        f"threads_per_min={n_threads * 60 / max(elapsed, 1e-9):.1f} "
+        f"prompt_per_thread={prompt / n_threads:.0f} completion_per_thread={completion / n_threads:.0f} "
+        f"unusable_items={unusable}"
+    )
+
+
+async def compare_packing(threads: List[str], rounds: int):
+    short = [thread for thread in threads if estimate_tokens(thread) <= PACK_MAX_THREAD_TOKENS]
+    if len(short) < 2:
+        print(f"fewer than two threads under {PACK_MAX_THREAD_TOKENS} tokens; nothing to pack")
+        return
+    print(f"{len(short)} short threads x {rounds} rounds, budget={PACK_TOKEN_BUDGET} tokens/{PACK_MAX_THREADS} threads")
+
+    runs, start = [], time.perf_counter()
+    for _ in range(rounds):
+        for thread in short:
+            runs.append(await timed_extraction(build_extraction_messages(thread)))
+    summarize_throughput("single", len(short) * rounds, runs, time.perf_counter() - start)
+
+    runs, unusable, start = [], 0, time.perf_counter()
+    for _ in range(rounds):
+        for group in pack(short):
+            run = await timed_extraction(build_packed_messages(group), len(group))
+            unusable += sum(result is None for result in parse_packed_response(run["content"], group))
+            runs.append(run)
+    summarize_throughput("packed", len(short) * rounds, runs, time.perf_counter() - start, unusable)
+
+
+async def main(n_threads: int, rounds: int, mode: str):
+    threads = load_threads(n_threads)
+    if not threads:
+        print("no threads in the extraction journal; run the email pipeline first")
+        return
+    print(f"{len(threads)} threads x {rounds} rounds, model={EXTRACTION_MODEL}")
+    if mode == "packing":
+        await compare_packing(threads, rounds)
+        return
+    for layout in LAYOUTS:
+        runs = []
+        for _ in range(rounds):
+            for thread in threads:
+                runs.append(await timed_extraction(build_extraction_messages(thread, layout)))
+        summarize(layout, runs)
+
+
+if __name__ == "__main__":
+    n_threads = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    mode = sys.argv[3] if len(sys.argv) > 3 else "layouts"
+    asyncio.run(main(n_threads, rounds, mode))
@@ -0,0 +1,215 @@
+"""
+Adaptive (AIMD) concurrency limits for upstream LLM and embedding calls.
+
+Every call goes through AdaptiveLimiter.call(). The in-flight limit grows by
+roughly one per round trip while requests succeed within the latency target,
+and is cut multiplicatively on 429 / 5xx / timeouts. A Retry-After header
+pauses the whole limiter, and retryable failures are retried with backoff
+instead of aborting the run.
+
+Limiters are shared by name (get_limiter("llm"), get_limiter("embeddings")),
+so every pipeline in a process backs off together.
+"""
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from typing import Dict, Optional
+
+import openai
+
+
+MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "6"))
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 30.0
+THROUGHPUT_WINDOW_SECONDS = 60.0
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+# starting points only; the limiters settle at whatever upstream sustains
+DEFAULT_LIMITS = {
+    "llm": {
+        "initial": int(os.getenv("LLM_INITIAL_CONCURRENCY", "5")),
+        "max_limit": int(os.getenv("LLM_MAX_CONCURRENCY", "48")),
+        "target_latency": float(os.getenv("LLM_TARGET_LATENCY_SECONDS", "30")),
+    },
+    "embeddings": {
+        "initial": int(os.getenv("EMBEDDING_INITIAL_CONCURRENCY", "20")),
+        "max_limit": int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "64")),
+        "target_latency": float(os.getenv("EMBEDDING_TARGET_LATENCY_SECONDS", "5")),
+    },
+}
+
+
+def classify_failure(error: Exception) -> Optional[str]:
+    """"throttled", "server_error", "timeout", or None when the error is not retryable."""
+    if isinstance(error, openai.RateLimitError):
+        return "throttled"
+    if isinstance(error, (openai.APITimeoutError, asyncio.TimeoutError)):
+        return "timeout"
+    if isinstance(error, openai.APIConnectionError):
+        return "server_error"
+    status = getattr(error, "status_code", None)
+    if status == 429:
+        return "throttled"
+    if status in RETRYABLE_STATUS:
+        return "server_error"
+    return None
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        return None
+    return None
+
+
+class AdaptiveLimiter:
+    def __init__(
+        self,
+        name: str,
+        initial: int,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        target_latency: Optional[float] = None,
+        decrease_factor: float = 0.5,
+    ):
+        self.name = name
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.latency_ewma: Optional[float] = None
+        self.successes = 0
+        self.throttled = 0
+        self.errors = 0
+        self._last_decrease = 0.0
+        self._completed = deque()
+        self._cond: Optional[asyncio.Condition] = None
+        self._loop = None
+
+    def _condition(self) -> asyncio.Condition:
+        # pipelines call asyncio.run() more than once; conditions are per event loop
+        loop = asyncio.get_running_loop()
+        if self._cond is None or self._loop is not loop:
+            self._cond = asyncio.Condition()
+            self._loop = loop
+            self.in_flight = 0
+        return self._cond
+
+    async def acquire(self):
+        cond = self._condition()
+        async with cond:
+            while True:
+                pause = self.blocked_until - time.monotonic()
+                if pause > 0:
+                    try:
+                        await asyncio.wait_for(cond.wait(), pause)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                if self.in_flight < int(self.limit):
+                    break
+                await cond.wait()
+            self.in_flight += 1
+
+    async def release(self, latency: float, failure: Optional[str] = None, retry_after: Optional[float] = None):
+        cond = self._condition()
+        async with cond:
+            saturated = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            now = time.monotonic()
+            if failure is None:
+                self.successes += 1
+                self._completed.append(now)
+                self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+                healthy = self.target_latency is None or latency <= self.target_latency
+                # additive increase: about +1 per limit's worth of successes, only while the limit is actually binding
+                if healthy and saturated:
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            elif failure == "cancelled":
+                # the caller gave up; says nothing about upstream
+                pass
+            elif failure == "error":
+                # not an upstream capacity signal (bad request, auth...): no limit change
+                self.errors += 1
+            else:
+                if failure == "throttled":
+                    self.throttled += 1
+                else:
+                    self.errors += 1
+                # multiplicative decrease, at most once per round trip so a burst of 429s counts once
+                if now - self._last_decrease > (self.latency_ewma or 1.0):
+                    self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                    self._last_decrease = now
+                    print(f"[{self.name}] {failure}: concurrency limit -> {int(self.limit)}")
+                if retry_after:
+                    self.blocked_until = max(self.blocked_until, now + retry_after)
+            cond.notify_all()
+
+    async def call(self, fn, *args, admit=None, **kwargs):
+        """
+        await fn(*args, **kwargs) under the limit, retrying throttling/5xx/timeouts.
+        admit() (e.g. a rate limiter grant) is awaited before each attempt takes
+        a slot, so waiting on it never holds one.
+        """
+        for attempt in range(MAX_RETRIES + 1):
+            if admit is not None:
+                await admit()
+            await self.acquire()
+            start = time.monotonic()
+            # anything not caught below (cancellation, shutdown) still frees the slot
+            failure, retry_after = "cancelled", None
+            try:
+                result = await fn(*args, **kwargs)
+                failure = None
+            except Exception as error:
+                retryable = classify_failure(error)
+                failure = retryable or "error"
+                retry_after = retry_after_seconds(error)
+                if retryable is None or attempt == MAX_RETRIES:
+                    raise
+            finally:
+                await self.release(time.monotonic() - start, failure, retry_after)
+            if failure is None:
+                return result
+            if retry_after is None:
+                backoff = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt)
+                await asyncio.sleep(backoff * random.uniform(0.5, 1.0))
+
+    def throughput_per_minute(self) -> float:
+        cutoff = time.monotonic() - THROUGHPUT_WINDOW_SECONDS
+        while self._completed and self._completed[0] < cutoff:
+            self._completed.popleft()
+        return len(self._completed) * 60.0 / THROUGHPUT_WINDOW_SECONDS
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "per_minute": self.throughput_per_minute(),
+            "latency_ewma": round(self.latency_ewma, 3) if self.latency_ewma is not None else None,
+            "successes": self.successes,
+            "throttled": self.throttled,
+            "errors": self.errors,
+        }
+
+
+_limiters: Dict[str, AdaptiveLimiter] = {}
+
+
+def get_limiter(name: str) -> AdaptiveLimiter:
+    """Process-wide limiter per upstream ("llm" or "embeddings")."""
+    if name not in _limiters:
+        _limiters[name] = AdaptiveLimiter(name, **DEFAULT_LIMITS[name])
+    return _limiters[name]
@@ -0,0 +1,278 @@
+"""
+Full-rebuild load path: binary COPY into a staging table, deferred indexes,
+atomic swap.
+
+A backfill never touches the live table until the very end:
+
+1. rows are streamed with COPY ... (FORMAT binary) into an UNLOGGED staging
+   table with no constraints or indexes;
+2. finish() builds <table>_new and its text side table from the normal
+   schema, fills it with a single INSERT ... SELECT ... ON CONFLICT DO NOTHING
+   (the same dedupe as the incremental path; ids are assigned in staging so
+   the text rows of the survivors follow in one more INSERT ... SELECT),
+   builds the HNSW indexes (and a bit index wherever the live table has one,
+   or for every vector column under SEARCH_STRATEGY=binary) with a raised
+   maintenance_work_mem and runs ANALYZE;
+3. the live tables are swapped for the new ones by renames inside one
+   transaction, so the search endpoints see either the old corpus or the new
+   one, never a half-loaded one. finish(in_swap=...) runs extra statements
+   (e.g. the email manifest rewrite) in that same transaction.
+
+Vectors go over the wire in pgvector's binary format (int16 dim, int16 unused,
+dim big-endian float32s, or float16s for halfvec storage), not as text.
+"""
+import io
+import os
+import struct
+from dataclasses import dataclass
+from typing import Callable, Iterable, List, Optional, Sequence, Tuple
+
+from database.pg import (
+    EMAIL_TABLE_SQL,
+    EMAIL_TEXTS_SQL,
+    PROM_TABLE_SQL,
+    PROM_TEXTS_SQL,
+    init_email_table,
+    init_prom_table,
+)
+from database.vectors import (
+    COSINE_OPS,
+    SEARCH_STRATEGY,
+    VECTOR_STORAGE,
+    VECTOR_TYPE,
+    binary_index_name,
+    create_binary_index,
+    hnsw_index_name,
+)
+from models.insert import EMAIL_TABLE, PROM_TABLE, TableSpec
+
+
+BACKFILL_MAINTENANCE_WORK_MEM = os.getenv("BACKFILL_MAINTENANCE_WORK_MEM", "2GB")
+BACKFILL_PARALLEL_WORKERS = int(os.getenv("BACKFILL_PARALLEL_WORKERS", "4"))
+# rows per COPY statement; bounds the client-side buffer (~6 KB of vector per row)
+BACKFILL_COPY_ROWS = int(os.getenv("BACKFILL_COPY_ROWS", "5000"))
+
+PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+PGCOPY_TRAILER = struct.pack("!h", -1)
+INT8_OID = 20
+
+
+@dataclass(frozen=True)
+class BackfillTarget:
+    spec: TableSpec
+    table_sql: str
+    text_table_sql: str
+    vector_columns: Tuple[str, ...]
+    # creates/migrates the live tables and their secondary (non-HNSW) indexes
+    init_tables: Callable
+
+
+EMAIL_TARGET = BackfillTarget(EMAIL_TABLE, EMAIL_TABLE_SQL, EMAIL_TEXTS_SQL, ("embedding",), init_email_table)
+PROM_TARGET = BackfillTarget(PROM_TABLE, PROM_TABLE_SQL, PROM_TEXTS_SQL, ("request_embedding", "process_embedding"), init_prom_table)
+
+
+def encode_vector(values: Sequence[float]) -> bytes:
+    """pgvector binary send format for the VECTOR_STORAGE type."""
+    code = "e" if VECTOR_STORAGE == "halfvec" else "f"
+    return struct.pack(f"!hh{len(values)}{code}", len(values), 0, *values)
+
+
+def encode_int8_array(values: Sequence[int]) -> bytes:
+    """Postgres array send format for a one-dimensional BIGINT[] without NULLs."""
+    header = struct.pack("!iiiii", 1, 0, INT8_OID, len(values), 1)
+    return header + b"".join(struct.pack("!iq", 8, v) for v in values)
+
+
+def encode_field(value) -> bytes:
+    if value is None:
+        return struct.pack("!i", -1)
+    if isinstance(value, str):
+        data = value.encode("utf-8")
+    elif isinstance(value, int):
+        data = struct.pack("!i", value)
+    elif isinstance(value, (list, tuple)) and value and all(isinstance(v, int) for v in value):
+        # MinHash signatures / LSH buckets; embeddings are always floats
+        data = encode_int8_array(value)
+    elif isinstance(value, (list, tuple)):
+        data = encode_vector(value)
+    else:
+        raise TypeError(f"no binary COPY encoding for {type(value).__name__}")
+    return struct.pack("!i", len(data)) + data
+
+
+def pgcopy_buffer(rows: Iterable[tuple]) -> io.BytesIO:
+    """rows (text, INTEGER, BIGINT[], vector or None fields) as a complete PGCOPY binary stream."""
+    buffer = io.BytesIO()
+    buffer.write(PGCOPY_HEADER)
+    for row in rows:
+        buffer.write(struct.pack("!h", len(row)))
+        for value in row:
+            buffer.write(encode_field(value))
+    buffer.write(PGCOPY_TRAILER)
+    buffer.seek(0)
+    return buffer
+
+
+class Backfill:
+    """
+    start() creates the staging table, copy_rows() streams rows into it and
+    finish() dedupes, indexes and swaps. Works as a drop-in for BatchWriter
+    (add/close/stats), so run_pipeline can feed it directly; outcomes are only
+    known after finish(), so add() and close() report none.
+    """
+
+    def __init__(self, con, target: BackfillTarget = EMAIL_TARGET, copy_rows: int = BACKFILL_COPY_ROWS):
+        self.con = con
+        self.target = target
+        self.spec = target.spec
+        self.copy_batch = copy_rows
+        self.staging = f"{self.spec.table}_staging"
+        self.new_table = f"{self.spec.table}_new"
+        self.new_text_table = f"{self.spec.text_table}_new"
+        self.staged_columns = self.spec.columns + self.spec.text_columns
+        self._pending: List[tuple] = []
+        self.staged = 0
+        self.copies = 0
+        self.inserted = 0
+        self.duplicates = 0
+
+    def start(self):
+        # the live tables only lend their column types (migrated to the current
+        # columns first); the staging copy has no constraints
+        self.target.init_tables(con=self.con)
+        cursor = self.con.cursor()
+        spec = self.spec
+        cursor.execute(f"DROP TABLE IF EXISTS {self.staging}")
+        cursor.execute(
+            f"CREATE UNLOGGED TABLE {self.staging} AS "
+            f"SELECT {', '.join(self.staged_columns)} FROM {spec.table} JOIN {spec.text_table} USING ({spec.id_column}) "
+            f"WITH NO DATA"
+        )
+        # ids are handed out here so the text rows can follow their deduped survivors
+        cursor.execute(f"ALTER TABLE {self.staging} ADD COLUMN {spec.id_column} BIGSERIAL")
+        self.con.commit()
+        print(f"backfill: staging rows in {self.staging}")
+        return self
+
+    def copy_rows(self, rows: List[tuple]):
+        if not rows:
+            return
+        cursor = self.con.cursor()
+        cursor.copy_expert(
+            f"COPY {self.staging} ({', '.join(self.staged_columns)}) FROM STDIN WITH (FORMAT binary)",
+            pgcopy_buffer(rows),
+        )
+        self.con.commit()
+        self.staged += len(rows)
+        self.copies += 1
+
+    def add(self, obj, tag=None) -> list:
+        self._pending.append(obj.row() + obj.text_row())
+        if len(self._pending) >= self.copy_batch:
+            self.flush()
+        return []
+
+    def flush(self) -> list:
+        pending, self._pending = self._pending, []
+        self.copy_rows(pending)
+        return []
+
+    def close(self) -> list:
+        return self.flush()
+
+    def finish(self, in_swap: Optional[Callable] = None):
+        """
+        Dedupe into <table>_new, build indexes, ANALYZE and swap it in.
+        in_swap(cursor) runs inside the swap transaction, before it commits.
+        """
+        self.flush()
+        target, spec, cursor = self.target, self.spec, self.con.cursor()
+        id_column = spec.id_column
+        columns = ", ".join((id_column,) + spec.columns)
+        text_columns = ", ".join((id_column,) + spec.text_columns)
+
+        cursor.execute(f"DROP TABLE IF EXISTS {self.new_text_table}")
+        cursor.execute(f"DROP TABLE IF EXISTS {self.new_table}")
+        cursor.execute(target.table_sql.format(table=self.new_table, vector_type=VECTOR_TYPE))
+        cursor.execute(target.text_table_sql.format(table=self.new_text_table, parent=self.new_table))
+        cursor.execute(
+            f"INSERT INTO {self.new_table} ({columns}) SELECT {columns} FROM {self.staging} "
+            f"ORDER BY {id_column} ON CONFLICT ({', '.join(spec.conflict_key)}) DO NOTHING"
+        )
+        self.inserted = cursor.rowcount
+        self.duplicates = self.staged - self.inserted
+        cursor.execute(
+            f"INSERT INTO {self.new_text_table} ({text_columns}) "
+            f"SELECT {text_columns} FROM {self.staging} JOIN {self.new_table} USING ({id_column})"
+        )
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence(%s, %s), COALESCE(max({id_column}), 0) + 1, false) "
+            f"FROM {self.new_table}",
+            (self.new_table, id_column),
+        )
+        self.con.commit()
+        print(f"backfill: {self.inserted} rows deduped into {self.new_table} ({self.duplicates} duplicates)")
+
+        # requests can pick strategy=binary whatever SEARCH_STRATEGY says, so every
+        # bit index the live table has is rebuilt too
+        binary_columns = self.live_binary_columns(cursor)
+        # SET LOCAL keeps the raised memory to the index build transaction
+        cursor.execute("SET LOCAL maintenance_work_mem = %s", (BACKFILL_MAINTENANCE_WORK_MEM,))
+        cursor.execute("SET LOCAL max_parallel_maintenance_workers = %s", (BACKFILL_PARALLEL_WORKERS,))
+        for column in target.vector_columns:
+            cursor.execute(
+                f"CREATE INDEX {hnsw_index_name(self.new_table, column)} ON {self.new_table} "
+                f"USING hnsw ({column} {COSINE_OPS})"
+            )
+            if SEARCH_STRATEGY == "binary" or column in binary_columns:
+                create_binary_index(cursor, self.new_table, column)
+        self.con.commit()
+        cursor.execute(f"ANALYZE {self.new_table}")
+        cursor.execute(f"ANALYZE {self.new_text_table}")
+        self.con.commit()
+        print(f"backfill: HNSW indexes built and {self.new_table} analyzed")
+
+        self.swap(in_swap)
+        cursor.execute(f"DROP TABLE IF EXISTS {self.staging}")
+        self.con.commit()
+        # lookup indexes are cheap next to HNSW; rebuild them on the swapped-in table
+        self.target.init_tables(con=self.con)
+        return self.stats()
+
+    def live_binary_columns(self, cursor) -> Tuple[str, ...]:
+        """Vector columns of the live table that have a binary-quantized HNSW index."""
+        cursor.execute(
+            "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s",
+            (self.spec.table,),
+        )
+        indexes = {name for (name,) in cursor.fetchall()}
+        return tuple(c for c in self.target.vector_columns if binary_index_name(self.spec.table, c) in indexes)
+
+    def swap(self, in_swap: Optional[Callable] = None):
+        """Replace the live tables with the new ones in one transaction."""
+        table, text_table = self.spec.table, self.spec.text_table
+        cursor = self.con.cursor()
+        try:
+            cursor.execute(f"LOCK TABLE {table}, {text_table} IN ACCESS EXCLUSIVE MODE")
+            cursor.execute(f"DROP TABLE {text_table}")
+            cursor.execute(f"DROP TABLE {table}")
+            cursor.execute(f"ALTER TABLE {self.new_table} RENAME TO {table}")
+            cursor.execute(f"ALTER TABLE {self.new_text_table} RENAME TO {text_table}")
+            for column in self.target.vector_columns:
+                cursor.execute(
+                    f"ALTER INDEX {hnsw_index_name(self.new_table, column)} RENAME TO {hnsw_index_name(table, column)}"
+                )
+                cursor.execute(
+                    f"ALTER INDEX IF EXISTS {binary_index_name(self.new_table, column)} "
+                    f"RENAME TO {binary_index_name(table, column)}"
+                )
+            if in_swap is not None:
+                in_swap(cursor)
+            self.con.commit()
+        except Exception:
+            self.con.rollback()
+            raise
+        print(f"backfill: swapped {self.new_table} in as {table}")
+
+    def stats(self):
+        return {"staged": self.staged, "copies": self.copies, "inserted": self.inserted, "duplicates": self.duplicates}
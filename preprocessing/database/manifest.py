@@ -0,0 +1,188 @@
+"""
+Ingestion manifest for incremental email runs.
+
+email_archives remembers every mbox archive that was fully ingested (size,
+mtime, sha256); an archive whose size and mtime are unchanged is skipped
+without reading it, and one whose bytes hash the same is skipped after
+hashing. email_threads holds one content fingerprint per thread, keyed by the
+thread's root Message-ID, so inside a changed archive only new threads and
+threads whose text changed (e.g. ones that gained replies) go back to the LLM.
+The email_embeddings row of a changed thread is replaced, found through its
+thread_id column: replace_thread_rows() deletes it in the same transaction
+that inserts the new row, so a thread whose re-extraction fails, or whose new
+row duplicates another thread's, keeps its old row. A backfill rewrites the whole manifest inside its table swap
+(rewrite_manifest), so the manifest never describes rows that are not live.
+"""
+import hashlib
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from psycopg2.extras import execute_values
+
+from models.insert import COMMIT_EVERY_BATCHES, INSERT_BATCH_SIZE, insert_emails
+
+
+ARCHIVES_SQL = """
+    CREATE TABLE IF NOT EXISTS email_archives (
+        path TEXT PRIMARY KEY,
+        size_bytes BIGINT NOT NULL,
+        mtime DOUBLE PRECISION NOT NULL,
+        sha256 TEXT NOT NULL,
+        ingested_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+"""
+
+THREADS_SQL = """
+    CREATE TABLE IF NOT EXISTS email_threads (
+        thread_id TEXT PRIMARY KEY,
+        archive_path TEXT NOT NULL,
+        fingerprint TEXT NOT NULL,
+        message_count INTEGER,
+        status TEXT NOT NULL,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+"""
+
+HASH_CHUNK_BYTES = 1 << 20
+
+
+def init_manifest_tables(con, reset: bool = False):
+    cursor = con.cursor()
+    cursor.execute(ARCHIVES_SQL)
+    cursor.execute(THREADS_SQL)
+    if reset:
+        cursor.execute("TRUNCATE email_archives, email_threads")
+    con.commit()
+    return con
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def thread_fingerprint(thread: str) -> str:
+    return hashlib.sha256(thread.encode("utf-8", errors="replace")).hexdigest()
+
+
+def archive_state(path: str) -> Tuple[int, float, str]:
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime, file_sha256(path)
+
+
+def changed_archive(con, path: str) -> Optional[Tuple[int, float, str]]:
+    """(size, mtime, sha256) when path needs ingesting, None when the manifest says it is done."""
+    stat = os.stat(path)
+    cursor = con.cursor()
+    cursor.execute("SELECT size_bytes, mtime, sha256 FROM email_archives WHERE path = %s", (path,))
+    known = cursor.fetchone()
+    if known is not None and known[0] == stat.st_size and known[1] == stat.st_mtime:
+        return None
+    sha = file_sha256(path)
+    if known is not None and known[2] == sha:
+        # touched but not changed: remember the new mtime so the next run skips the hash too
+        record_archive(con, path, stat.st_size, stat.st_mtime, sha)
+        return None
+    return stat.st_size, stat.st_mtime, sha
+
+
+UPSERT_ARCHIVES_SQL = """
+    INSERT INTO email_archives (path, size_bytes, mtime, sha256) VALUES %s
+    ON CONFLICT (path) DO UPDATE
+    SET size_bytes = EXCLUDED.size_bytes, mtime = EXCLUDED.mtime, sha256 = EXCLUDED.sha256, ingested_at = now()
+"""
+
+UPSERT_THREADS_SQL = """
+    INSERT INTO email_threads (thread_id, archive_path, fingerprint, message_count, status) VALUES %s
+    ON CONFLICT (thread_id) DO UPDATE
+    SET archive_path = EXCLUDED.archive_path, fingerprint = EXCLUDED.fingerprint,
+        message_count = EXCLUDED.message_count, status = EXCLUDED.status, updated_at = now()
+"""
+
+
+def record_archive(con, path: str, size: int, mtime: float, sha: str):
+    execute_values(con.cursor(), UPSERT_ARCHIVES_SQL, [(path, size, mtime, sha)])
+    con.commit()
+
+
+def changed_threads(con, fingerprints: Dict[str, str]) -> Dict[str, str]:
+    """thread_id -> "new" or "changed" for the threads not already ingested with the same fingerprint."""
+    if not fingerprints:
+        return {}
+    cursor = con.cursor()
+    cursor.execute(
+        "SELECT thread_id, fingerprint FROM email_threads WHERE thread_id = ANY(%s)",
+        (list(fingerprints),),
+    )
+    known = dict(cursor.fetchall())
+    changes = {}
+    for thread_id, fingerprint in fingerprints.items():
+        if thread_id not in known:
+            changes[thread_id] = "new"
+        elif known[thread_id] != fingerprint:
+            changes[thread_id] = "changed"
+    return changes
+
+
+def delete_thread_rows(con, thread_ids: Iterable[str]) -> int:
+    """Drop the email_embeddings rows (and their text, by cascade) of threads whose new version is off topic."""
+    thread_ids = list(thread_ids)
+    if not thread_ids:
+        return 0
+    cursor = con.cursor()
+    cursor.execute("DELETE FROM email_embeddings WHERE thread_id = ANY(%s)", (thread_ids,))
+    con.commit()
+    return cursor.rowcount
+
+
+def replace_thread_rows(con, emails: List, batch_size: int = INSERT_BATCH_SIZE, commit_every: int = COMMIT_EVERY_BATCHES) -> List[str]:
+    """
+    insert_emails for re-extracted threads: the old rows of these threads are
+    deleted in the transaction that inserts their replacements (use with
+    BatchWriter, which commits; a new thread has nothing to delete). A thread
+    whose replacement is a duplicate of another thread's row keeps its old row:
+    the batch is rolled back to a savepoint and redone without it.
+    """
+    cursor = con.cursor()
+    outcomes = {}
+    pending = list(emails)
+    while pending:
+        cursor.execute("SAVEPOINT replace_thread_rows")
+        thread_ids = [e.thread_id for e in pending if e.thread_id]
+        if thread_ids:
+            cursor.execute("DELETE FROM email_embeddings WHERE thread_id = ANY(%s)", (thread_ids,))
+        written = insert_emails(con, pending, batch_size, commit_every=0)
+        if "duplicate" not in written:
+            cursor.execute("RELEASE SAVEPOINT replace_thread_rows")
+            outcomes.update((id(e), outcome) for e, outcome in zip(pending, written))
+            break
+        # restoring the old rows can turn another replacement into a duplicate, hence the loop
+        cursor.execute("ROLLBACK TO SAVEPOINT replace_thread_rows")
+        outcomes.update((id(e), "duplicate") for e, outcome in zip(pending, written) if outcome == "duplicate")
+        pending = [e for e, outcome in zip(pending, written) if outcome != "duplicate"]
+    if commit_every:
+        con.commit()
+    return [outcomes[id(e)] for e in emails]
+
+
+def record_threads(con, rows: List[Tuple[str, str, str, int, str]]):
+    """Upsert (thread_id, archive_path, fingerprint, message_count, status) rows."""
+    if not rows:
+        return
+    execute_values(con.cursor(), UPSERT_THREADS_SQL, rows)
+    con.commit()
+
+
+def rewrite_manifest(cursor, thread_rows: List[Tuple[str, str, str, int, str]], archive_rows: List[Tuple[str, int, float, str]]):
+    """
+    Replace the whole manifest without committing; a backfill runs this inside
+    its swap transaction so the manifest and the live table change together.
+    """
+    cursor.execute("TRUNCATE email_archives, email_threads")
+    if thread_rows:
+        execute_values(cursor, UPSERT_THREADS_SQL, thread_rows)
+    if archive_rows:
+        execute_values(cursor, UPSERT_ARCHIVES_SQL, archive_rows)
@@ -1,9 +1,84 @@
+import hashlib
 import psycopg2
 import os
+import re
+import sys
+from typing import Optional, Sequence
 from dotenv import load_dotenv
+from psycopg2.extras import execute_values
+from .vectors import COSINE_OPS, VECTOR_TYPE, hnsw_index_name
 
 load_dotenv()
 
+# {table} is filled in so the backfill can build a fresh copy next to the live table;
+# {vector_type} follows VECTOR_STORAGE
+EMAIL_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        email_id SERIAL PRIMARY KEY,
+        date VARCHAR(20) NOT NULL,
+        requestor VARCHAR(100) NOT NULL,
+        filename VARCHAR(100) NOT NULL,
+        prom_approval VARCHAR(50),
+        prom_considerations TEXT NOT NULL,
+        chemicals TEXT NOT NULL,
+        processes TEXT NOT NULL,
+        thread_id TEXT,
+        embedding {vector_type} NOT NULL,
+        UNIQUE (date, filename, requestor, chemicals, processes)
+    )
+"""
+
+# bulky text lives beside the vector tables so ANN scans stay on narrow rows
+EMAIL_TEXTS_SQL = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        email_id INTEGER PRIMARY KEY REFERENCES {parent} (email_id) ON DELETE CASCADE,
+        llm_context TEXT NOT NULL,
+        raw_thread TEXT NOT NULL,
+        embedded_string TEXT NOT NULL
+    )
+"""
+
+PROM_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS {table} (
+    prom_id SERIAL PRIMARY KEY,
+    date VARCHAR(20) NOT NULL,
+    filename TEXT NOT NULL,
+    requestor VARCHAR(100) NOT NULL,
+    request_title TEXT,
+    chemicals_and_processes TEXT,
+    request_reason TEXT,
+    process_flow TEXT,
+    amount_and_form TEXT,
+    staff_considerations TEXT,
+    content_hash TEXT,
+    near_duplicate_of INTEGER,
+    request_embedding {vector_type},
+    process_embedding {vector_type},
+    UNIQUE (date, requestor, request_title)
+    )
+"""
+
+PROM_TEXTS_SQL = """
+    CREATE TABLE IF NOT EXISTS {table} (
+    prom_id INTEGER PRIMARY KEY REFERENCES {parent} (prom_id) ON DELETE CASCADE,
+    raw_prom TEXT,
+    embedded_string TEXT,
+    minhash BIGINT[],
+    lsh_bands BIGINT[]
+    )
+"""
+
+# columns moved out by move_text_columns(), per (table, text table, id column)
+TEXT_SPLITS = [
+    ("email_embeddings", "email_texts", "email_id", EMAIL_TEXTS_SQL, ("llm_context", "raw_thread", "embedded_string")),
+    ("prom_embeddings", "prom_texts", "prom_id", PROM_TEXTS_SQL, ("raw_prom", "embedded_string")),
+]
+
+# form text that makes two uploads the same request, whatever their file name; the
+# date is included so a re-dated resubmission is stored (and linked by near_dup.py)
+PROM_CONTENT_FIELDS = ("date", "requestor", "request_title", "chemicals_and_processes", "request_reason", "process_flow", "amount_and_form", "staff_considerations")
+WHITESPACE_RE = re.compile(r"\s+")
+
 def get_db_connection():
     return psycopg2.connect(
         host=os.getenv("DB_HOST"),
@@ -25,25 +100,15 @@ def init_email_table(con = None, drop_table: bool = False):
     cursor.execute("CREATE EXTENSION IF NOT EXISTS vector")
 
     if drop_table:
+        cursor.execute("DROP TABLE IF EXISTS email_texts")
         cursor.execute("DROP TABLE IF EXISTS email_embeddings")
 
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS email_embeddings (
-        email_id SERIAL PRIMARY KEY,
-        date VARCHAR(20) NOT NULL,
-        requestor VARCHAR(100) NOT NULL,
-        filename VARCHAR(100) NOT NULL,
-        prom_approval VARCHAR(50),
-        prom_considerations TEXT NOT NULL,
-        chemicals TEXT NOT NULL,
-        processes TEXT NOT NULL,
-        llm_context TEXT NOT NULL,
-        raw_thread TEXT NOT NULL,
-        embedded_string TEXT NOT NULL,
-        embedding vector(1536) NOT NULL,
-        UNIQUE (date, filename, requestor, chemicals, processes)
-    )
-    """)
+    cursor.execute(EMAIL_TABLE_SQL.format(table="email_embeddings", vector_type=VECTOR_TYPE))
+    # tables created before the thread manifest existed
+    cursor.execute("ALTER TABLE email_embeddings ADD COLUMN IF NOT EXISTS thread_id TEXT")
+    # inserts and the backfill only write the text columns to email_texts
+    move_text_columns(cursor, "email_embeddings")
+    cursor.execute(EMAIL_TEXTS_SQL.format(table="email_texts", parent="email_embeddings"))
     #using HNSW when we create third DB table
     print("successfully initiated database")
     con.commit()
@@ -62,28 +127,29 @@ def init_prom_table(con = None, drop_table: bool = False):
     cursor = con.cursor()
     cursor.execute("CREATE EXTENSION IF NOT EXISTS vector")
     if drop_table:
+        cursor.execute("DROP TABLE IF EXISTS prom_texts")
         cursor.execute("DROP TABLE IF EXISTS prom_embeddings")
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS prom_embeddings (
-    prom_id SERIAL PRIMARY KEY,
-    date VARCHAR(20) NOT NULL,
-    filename TEXT NOT NULL,
-    requestor VARCHAR(100) NOT NULL,
-    request_title TEXT,
-    chemicals_and_processes TEXT,
-    request_reason TEXT,
-    process_flow TEXT,
-    amount_and_form TEXT,
-    staff_considerations TEXT,
-    raw_prom TEXT,
-    embedded_string TEXT,
-    request_embedding vector(1536),
-    process_embedding vector(1536),
-    UNIQUE (date, requestor, request_title)
+    cursor.execute(PROM_TABLE_SQL.format(table="prom_embeddings", vector_type=VECTOR_TYPE))
+    # tables created before the pre-embedding duplicate lookup existed
+    cursor.execute("ALTER TABLE prom_embeddings ADD COLUMN IF NOT EXISTS content_hash TEXT")
+    # the two sides of models.insert.find_existing_proms
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS prom_embeddings_normalized_key_idx "
+        "ON prom_embeddings (lower(btrim(date)), lower(btrim(requestor)), lower(btrim(request_title)))"
     )
-    """)
-    print("FINISHED INITIATING TABLE")
+    cursor.execute("CREATE INDEX IF NOT EXISTS prom_embeddings_content_hash_idx ON prom_embeddings (content_hash)")
+    cursor.execute("ALTER TABLE prom_embeddings ADD COLUMN IF NOT EXISTS near_duplicate_of INTEGER")
+    move_text_columns(cursor, "prom_embeddings")
+    cursor.execute(PROM_TEXTS_SQL.format(table="prom_texts", parent="prom_embeddings"))
+    cursor.execute("ALTER TABLE prom_texts ADD COLUMN IF NOT EXISTS minhash BIGINT[]")
+    cursor.execute("ALTER TABLE prom_texts ADD COLUMN IF NOT EXISTS lsh_bands BIGINT[]")
+    # LSH candidate lookup in near_dup.py is an array overlap (&&) on the band buckets
+    cursor.execute("CREATE INDEX IF NOT EXISTS prom_texts_lsh_bands_idx ON prom_texts USING gin (lsh_bands)")
     con.commit()
+    filled = fill_content_hashes(con)
+    if filled:
+        print(f"content_hash filled for {filled} stored PROM forms")
+    print("FINISHED INITIATING TABLE")
 
     if should_close:
         con.close()
@@ -93,6 +159,33 @@ def init_prom_table(con = None, drop_table: bool = False):
 
 
 
+def prom_content_hash(values: Sequence[Optional[str]]) -> str:
+    """sha256 of PROM_CONTENT_FIELDS values with case and whitespace normalized."""
+    parts = (WHITESPACE_RE.sub(" ", value or "").strip().lower() for value in values)
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def fill_content_hashes(con, batch_size: int = 500) -> int:
+    """Hash stored forms that predate the content_hash column; returns how many were filled."""
+    cursor = con.cursor()
+    cursor.execute(f"SELECT prom_id, {', '.join(PROM_CONTENT_FIELDS)} FROM prom_embeddings WHERE content_hash IS NULL")
+    rows = cursor.fetchall()
+    for start in range(0, len(rows), batch_size):
+        updates = [(prom_id, prom_content_hash(values)) for prom_id, *values in rows[start:start + batch_size]]
+        execute_values(
+            cursor,
+            """
+            UPDATE prom_embeddings AS p SET content_hash = v.content_hash
+            FROM (VALUES %s) AS v (prom_id, content_hash)
+            WHERE p.prom_id = v.prom_id
+            """,
+            updates,
+            page_size=len(updates),
+        )
+        con.commit()
+    return len(rows)
+
+
 def create_hnsw_idx(con=None):
     """Build HNSW index on prom_embeddings. Call AFTER bulk insert."""
     should_close = False
@@ -101,13 +194,78 @@ def create_hnsw_idx(con=None):
         should_close = True
     
     cursor = con.cursor()
-    cursor.execute("""
-    CREATE INDEX IF NOT EXISTS prom_emb_idx 
-    ON prom_embeddings USING hnsw(embedding vector_cosine_ops)
+    cursor.execute(f"""
+    CREATE INDEX IF NOT EXISTS {hnsw_index_name("prom_embeddings", "request_embedding")}
+    ON prom_embeddings USING hnsw(request_embedding {COSINE_OPS})
     """)
     con.commit()
     
     if should_close:
         con.close()
         return None
-    return con
\ No newline at end of file
+    return con
+
+
+def move_text_columns(cursor, table: str) -> bool:
+    """
+    Move the bulky text columns of a table created before the text side tables
+    existed into its side table, without committing. Returns False when the
+    table is already split. The heap only shrinks after a VACUUM FULL
+    (split_text_columns), which needs a long exclusive lock and is left manual.
+    """
+    table, text_table, id_column, text_sql, columns = next(split for split in TEXT_SPLITS if split[0] == table)
+    cursor.execute(
+        "SELECT count(*) FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = %s AND column_name = ANY(%s)",
+        (table, list(columns)),
+    )
+    present = cursor.fetchone()[0]
+    if present == 0:
+        return False
+    if present != len(columns):
+        raise RuntimeError(
+            f"{table} has only some of {', '.join(columns)}; finish moving them to {text_table} by hand"
+        )
+    cursor.execute(text_sql.format(table=text_table, parent=table))
+    cursor.execute(
+        f"INSERT INTO {text_table} ({id_column}, {', '.join(columns)}) "
+        f"SELECT {id_column}, {', '.join(columns)} FROM {table} ON CONFLICT ({id_column}) DO NOTHING"
+    )
+    print(f"copied {cursor.rowcount} rows into {text_table}")
+    for column in columns:
+        cursor.execute(f"ALTER TABLE {table} DROP COLUMN {column}")
+    print(f"moved {', '.join(columns)} out of {table}; run `python -m database.pg split-texts` to VACUUM FULL it")
+    return True
+
+
+def split_text_columns(con=None):
+    """
+    Migrate tables created before the text side tables existed (init_*_table
+    already does this on start) and VACUUM FULL every vector table so the heap
+    actually shrinks.
+    """
+    should_close = False
+    if con is None:
+        con = get_db_connection()
+        should_close = True
+    cursor = con.cursor()
+    for table, *_ in TEXT_SPLITS:
+        move_text_columns(cursor, table)
+        con.commit()
+        # VACUUM cannot run inside a transaction block
+        con.autocommit = True
+        cursor.execute(f"VACUUM FULL ANALYZE {table}")
+        con.autocommit = False
+        print(f"vacuumed {table}")
+
+    if should_close:
+        con.close()
+        return None
+    return con
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["split-texts"]:
+        print("usage: python -m database.pg split-texts   (from preprocessing/)")
+        raise SystemExit(1)
+    split_text_columns()
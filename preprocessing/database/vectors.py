@@ -0,0 +1,211 @@
+"""
+Embedding transport and storage type.
+
+psycopg2 only sends text parameters, and a plain Python list goes over as
+ARRAY[0.0123456789012345, ...] (~20 KB for 1536 dims) that the server parses
+as numeric[] before casting. Wrapping an embedding in Vector sends it instead
+as one compact '[...]'::vector literal with float32 precision (%.9g
+round-trips a float32 exactly), which vector_in parses directly. Queries
+reference it once as a named parameter.
+
+VECTOR_STORAGE=halfvec switches the column type, the literal's cast and the
+HNSW operator class to halfvec(1536), halving table and index size. Existing
+tables are converted in place with:
+
+    python -m database.vectors halfvec     (from preprocessing/)
+    python -m database.vectors vector      (back to full precision)
+
+SEARCH_STRATEGY=binary (or a request's "strategy") searches in two stages:
+an HNSW index over binary_quantize(embedding)::bit(1536) (one bit per
+dimension, ~1/32 of the vector index) picks BINARY_CANDIDATES rows by Hamming
+distance, and those are reranked by exact cosine distance on the stored
+vectors. The bit indexes are built with:
+
+    python -m database.vectors binary-index
+"""
+import os
+import sys
+from typing import Optional, Tuple
+
+from psycopg2.extensions import AsIs, register_adapter
+
+
+VECTOR_STORAGE = os.getenv("VECTOR_STORAGE", "vector").lower()
+if VECTOR_STORAGE not in ("vector", "halfvec"):
+    raise ValueError(f"VECTOR_STORAGE must be 'vector' or 'halfvec', not {VECTOR_STORAGE!r}")
+
+EMBEDDING_DIM = 1536
+VECTOR_TYPE = f"{VECTOR_STORAGE}({EMBEDDING_DIM})"
+COSINE_OPS = f"{VECTOR_STORAGE}_cosine_ops"
+
+SEARCH_STRATEGIES = ("hnsw", "binary")
+SEARCH_STRATEGY = os.getenv("SEARCH_STRATEGY", "hnsw").lower()
+if SEARCH_STRATEGY not in SEARCH_STRATEGIES:
+    raise ValueError(f"SEARCH_STRATEGY must be one of {SEARCH_STRATEGIES}, not {SEARCH_STRATEGY!r}")
+BINARY_CANDIDATES = int(os.getenv("BINARY_CANDIDATES", "300"))
+
+# every embedding column, by table
+VECTOR_COLUMNS = {
+    "email_embeddings": ("embedding",),
+    "prom_embeddings": ("request_embedding", "process_embedding"),
+}
+
+
+class Vector(list):
+    """An embedding that psycopg2 sends as a single float32 pgvector literal."""
+
+
+def vector_literal(values) -> str:
+    return "[" + ",".join("%.9g" % v for v in values) + "]"
+
+
+def _adapt_vector(vector: Vector) -> AsIs:
+    return AsIs(f"'{vector_literal(vector)}'::{VECTOR_STORAGE}")
+
+
+register_adapter(Vector, _adapt_vector)
+
+
+def as_vector(values):
+    return None if values is None else Vector(values)
+
+
+def hnsw_index_name(table: str, column: str) -> str:
+    return f"{table}_{column}_hnsw"
+
+
+def binary_index_name(table: str, column: str) -> str:
+    return f"{table}_{column}_bq_hnsw"
+
+
+def binary_expression(column: str) -> str:
+    return f"binary_quantize({column})::bit({EMBEDDING_DIM})"
+
+
+def create_binary_index(cursor, table: str, column: str):
+    cursor.execute(
+        f"CREATE INDEX IF NOT EXISTS {binary_index_name(table, column)} ON {table} "
+        f"USING hnsw (({binary_expression(column)}) bit_hamming_ops)"
+    )
+
+
+def nearest_sql(
+    table: str,
+    column: str,
+    columns: str,
+    limit: int,
+    strategy: str = SEARCH_STRATEGY,
+    texts: Optional[Tuple[str, str, str]] = None,
+) -> str:
+    """
+    SELECT columns plus the cosine distance to %(query)s as its last column,
+    nearest first. The query vector is referenced once; "binary" also takes
+    %(candidates)s, the number of Hamming-distance candidates to rerank.
+
+    texts=(text_table, id_column, text_columns) appends text_columns from the
+    side table, joined only to the final rows; columns must include id_column.
+    """
+    if texts is not None:
+        text_table, id_column, text_columns = texts
+        return f"""
+            SELECT {columns}, {text_columns}, distance
+            FROM ({nearest_sql(table, column, columns, limit, strategy)}) AS nearest
+            LEFT JOIN {text_table} USING ({id_column})
+            ORDER BY distance
+        """
+    if strategy == "hnsw":
+        return f"""
+            SELECT {columns}, {column} <=> %(query)s AS distance
+            FROM {table}
+            ORDER BY distance
+            LIMIT {int(limit)}
+        """
+    if strategy == "binary":
+        return f"""
+            WITH query AS (SELECT %(query)s AS embedding)
+            SELECT {columns}, distance
+            FROM (
+                SELECT {columns}, {column} <=> (SELECT embedding FROM query) AS distance
+                FROM {table}
+                ORDER BY {binary_expression(column)} <~> (SELECT {binary_expression("embedding")} FROM query)
+                LIMIT %(candidates)s
+            ) AS candidates
+            ORDER BY distance
+            LIMIT {int(limit)}
+        """
+    raise ValueError(f"unknown search strategy {strategy!r}; expected one of {SEARCH_STRATEGIES}")
+
+
+def execute_nearest(
+    cursor,
+    table: str,
+    column: str,
+    columns: str,
+    query: Vector,
+    limit: int,
+    strategy: str = SEARCH_STRATEGY,
+    texts: Optional[Tuple[str, str, str]] = None,
+):
+    """Run nearest_sql for query on cursor; fetch the rows from it."""
+    params = {"query": query}
+    if strategy == "binary":
+        # an HNSW scan yields at most ef_search rows, so it must cover the candidate pool
+        cursor.execute("SET LOCAL hnsw.ef_search = %s", (BINARY_CANDIDATES,))
+        params["candidates"] = BINARY_CANDIDATES
+    cursor.execute(nearest_sql(table, column, columns, limit, strategy, texts), params)
+
+
+def migrate_storage(con, storage: str):
+    """Convert every embedding column to storage(1536) and rebuild its HNSW index, in one transaction."""
+    if storage not in ("vector", "halfvec"):
+        raise ValueError(f"storage must be 'vector' or 'halfvec', not {storage!r}")
+    cursor = con.cursor()
+    try:
+        for table, columns in VECTOR_COLUMNS.items():
+            for column in columns:
+                cursor.execute(
+                    "SELECT indexname FROM pg_indexes WHERE tablename = %s AND indexdef ILIKE %s",
+                    (table, f"%USING hnsw ({column} %"),
+                )
+                for (index_name,) in cursor.fetchall():
+                    cursor.execute(f"DROP INDEX {index_name}")
+                cursor.execute(
+                    f"ALTER TABLE {table} ALTER COLUMN {column} TYPE {storage}({EMBEDDING_DIM}) "
+                    f"USING {column}::{storage}({EMBEDDING_DIM})"
+                )
+                cursor.execute(
+                    f"CREATE INDEX {hnsw_index_name(table, column)} ON {table} "
+                    f"USING hnsw ({column} {storage}_cosine_ops)"
+                )
+                print(f"{table}.{column} -> {storage}({EMBEDDING_DIM}) with HNSW {storage}_cosine_ops")
+            cursor.execute(f"ANALYZE {table}")
+        con.commit()
+    except Exception:
+        con.rollback()
+        raise
+
+
+def create_binary_indexes(con):
+    cursor = con.cursor()
+    for table, columns in VECTOR_COLUMNS.items():
+        for column in columns:
+            create_binary_index(cursor, table, column)
+            print(f"built {binary_index_name(table, column)}")
+    con.commit()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] not in ("vector", "halfvec", "binary-index"):
+        print(__doc__)
+        raise SystemExit(1)
+    from database.pg import get_db_connection
+
+    con = get_db_connection()
+    try:
+        if sys.argv[1] == "binary-index":
+            create_binary_indexes(con)
+        else:
+            migrate_storage(con, sys.argv[1])
+            print(f"done; set VECTOR_STORAGE={sys.argv[1]} for the server and pipelines")
+    finally:
+        con.close()
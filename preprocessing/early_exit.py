@@ -0,0 +1,82 @@
+"""
+Incremental detection of the extraction prompt's EARLY EXIT answer.
+
+The extraction output is streamed; EarlyExitDetector.feed() is given the text
+received so far and decides as soon as it can: True once prom_request is ""
+and (unless spans are prefilled) both chemical/process arrays are [], False
+as soon as any of them has content, None while undecided. Keys are matched
+wherever they appear, so field order in the model's output does not matter.
+"""
+import json
+import re
+import time
+from typing import Dict, Optional
+
+from rate_limit import estimate_tokens
+
+
+EARLY_EXIT_RESULT = {
+    "prom_request": "",
+    "prom_considerations": "",
+    "chemicals_mentioned": [],
+    "processes_mentioned": [],
+    "prom_approval": "",
+    "approval_evidence": "",
+    "llm_context": "",
+}
+EARLY_EXIT_JSON = json.dumps(EARLY_EXIT_RESULT)
+
+PROM_REQUEST_RE = re.compile(r'"prom_request"\s*:\s*"(.)', re.DOTALL)
+ARRAY_RE = {
+    field: re.compile(rf'"{field}"\s*:\s*\[\s*(\S)')
+    for field in ("chemicals_mentioned", "processes_mentioned")
+}
+
+
+class EarlyExitDetector:
+    def __init__(self, check_arrays: bool = True):
+        self.check_arrays = check_arrays
+
+    def feed(self, text: str) -> Optional[bool]:
+        match = PROM_REQUEST_RE.search(text)
+        if match is None:
+            return None
+        if match.group(1) != '"':
+            return False
+        if not self.check_arrays:
+            return True
+        for pattern in ARRAY_RE.values():
+            match = pattern.search(text)
+            if match is None:
+                return None
+            if match.group(1) != "]":
+                return False
+        return True
+
+
+class EarlyExitStats:
+    """
+    Aborted generations, with the completion tokens received and the seconds
+    from request to abort. What an aborted stream would still have produced is
+    unknown, so no savings are claimed.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.aborted = 0
+        self.tokens_received = 0
+        self.seconds_to_abort = 0.0
+
+    def record(self, received: str, started_at: float):
+        self.aborted += 1
+        self.tokens_received += estimate_tokens(received)
+        self.seconds_to_abort += time.monotonic() - started_at
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "aborted": self.aborted,
+            "avg_tokens_at_abort": round(self.tokens_received / self.aborted, 1) if self.aborted else 0.0,
+            "avg_seconds_to_abort": round(self.seconds_to_abort / self.aborted, 2) if self.aborted else 0.0,
+        }
@@ -1,11 +1,26 @@
+import argparse
 import psycopg2
 import time
-from order_emails import create_dict_of_threads, get_email_by_msgid
+from order_emails import create_dict_of_threads, format_identifier_line
+from mbox_reader import MboxReader
 from database.pg import get_db_connection, init_email_table
+from database.backfill import Backfill, EMAIL_TARGET
+from database.manifest import (
+    archive_state,
+    changed_archive,
+    changed_threads,
+    delete_thread_rows,
+    init_manifest_tables,
+    record_archive,
+    record_threads,
+    replace_thread_rows,
+    rewrite_manifest,
+    thread_fingerprint,
+)
 from filter_emails import extract_main_message
 from embed_emails import run_pipeline
 import asyncio
-from models.insert import Email
+from models.insert import BatchWriter, Email
 import os
 
 
@@ -23,35 +38,127 @@ BANNER = r"""
 #preprocessing email functions in embed_emails.py
 
 
+def build_thread_objects(file, dict_of_threads, thread_roots, reader: MboxReader):
+    """One Email per thread, keyed by its JWZ root Message-ID; only thread messages are decoded."""
+    email_objects = []
+    for keys, vals in dict_of_threads.items():
+        date, requestor = keys
+        for val in vals:
+            thread = ""
+            reviewer_replies = 0
+            for item in val:
+                email = reader.get_email(item)
+                if email:
+                    # mbox envelope line carries the sender; anyone but the requestor is a reviewer
+                    sender = format_identifier_line(email.split("\n", 1)[0])[1]
+                    if sender and sender != requestor:
+                        reviewer_replies += 1
+                processed_email = extract_main_message(email)
+                thread = thread + "\n" + processed_email
+            email_object = Email(
+                date=date,
+                filepath=file,
+                requestor=requestor,
+                raw_thread=thread,
+                thread_id=thread_roots.get(val[0], val[0]),
+                message_count=len(val),
+                reviewer_replies=reviewer_replies,
+            )
+            email_objects.append(email_object)
+    return email_objects
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract, embed and load email threads into email_embeddings")
+    parser.add_argument(
+        "dirs",
+        nargs="*",
+        default=["../files/emails/2019_emails"],
+        help="directories of .txt mbox archives (default: ../files/emails/2019_emails)",
+    )
+    parser.add_argument(
+        "--backfill",
+        action="store_true",
+        help="full rebuild: COPY into a staging table, build indexes afterwards and swap the table in atomically",
+    )
+    parser.add_argument(
+        "--drop",
+        action="store_true",
+        help="drop email_embeddings and forget the ingestion manifest before loading",
+    )
+    args = parser.parse_args()
 
-    emails_dir = "../files/emails/2019_emails"
-    emails_files = [os.path.join(emails_dir, f) for f in os.listdir(emails_dir) if f.endswith(".txt")]
+    emails_files = sorted(
+        os.path.join(emails_dir, f) for emails_dir in args.dirs for f in os.listdir(emails_dir) if f.endswith(".txt")
+    )
     print(f"Found {len(emails_files)} emails files")
     print(emails_files)
 
 
     con = get_db_connection()
-    init_email_table(con=con, drop_table=True)
+    backfill = None
+    if args.backfill:
+        # the live table keeps serving searches until the swap at the end; start()
+        # migrates it first (thread_id on tables older than the manifest), since
+        # the staging table copies its columns
+        backfill = Backfill(con, EMAIL_TARGET).start()
+        init_manifest_tables(con)
+    else:
+        init_email_table(con=con, drop_table=args.drop)
+        init_manifest_tables(con, reset=args.drop)
+    # every thread is re-extracted in a backfill; its rows only go live at the swap,
+    # so the manifest is rebuilt from scratch in the swap transaction
+    pending_threads, pending_archives = [], []
     for file in emails_files:
-        dict_of_threads, msg_start, msg_end, requestor_names = create_dict_of_threads(file)
-        if not dict_of_threads:
-            print(f"No threads found in {file}")
+        archive_path = os.path.abspath(file)
+        archive = archive_state(archive_path) if backfill is not None else changed_archive(con, archive_path)
+        if archive is None:
+            print(f"{file} unchanged since last ingest, skipping")
             continue
-        email_objects = []
-        for keys, vals in dict_of_threads.items():
-            date, requestor = keys
-            for val in vals:
-                thread = ""
-                for item in val:
-                    email = get_email_by_msgid(file, msg_start, msg_end, item)
-                    processed_email = extract_main_message(email)
-                    thread = thread + "\n" + processed_email
-                email_object = Email(date=date, filepath=file, requestor=requestor, raw_thread=thread)
-                email_objects.append(email_object)
+        with MboxReader(file) as reader:
+            dict_of_threads, msg_start, msg_end, requestor_names, thread_roots = create_dict_of_threads(file, reader=reader)
+            if not dict_of_threads:
+                print(f"No threads found in {file}")
+                continue
+            email_objects = build_thread_objects(file, dict_of_threads, thread_roots, reader)
+        fingerprints = {e.thread_id: thread_fingerprint(e.raw_thread) for e in email_objects}
+        writer = backfill
+        if backfill is None:
+            # unchanged threads never reach the LLM; a changed one's old row is
+            # deleted in the transaction that writes its replacement
+            changes = changed_threads(con, fingerprints)
+            email_objects = [e for e in email_objects if e.thread_id in changes]
+            print(
+                f"{file}: {list(changes.values()).count('new')} new and {list(changes.values()).count('changed')} "
+                f"changed threads of {len(fingerprints)}"
+            )
+            writer = BatchWriter(con, replace_thread_rows)
         print(f"created {len(email_objects)} email objects")
-        results = asyncio.run(run_pipeline(email_objects, con))
+        statuses = asyncio.run(run_pipeline(email_objects, con, writer=writer)) if email_objects else []
+        if backfill is None:
+            # a changed thread that is off topic now has no replacement; a failed one keeps its old row
+            stale = [e.thread_id for e, status in zip(email_objects, statuses) if status == "off_topic" and changes[e.thread_id] == "changed"]
+            if stale:
+                print(f"{file}: removed {delete_thread_rows(con, stale)} rows of threads now off topic")
+        # failed threads stay out of the manifest so the next run retries them
+        thread_rows = [
+            (e.thread_id, archive_path, fingerprints[e.thread_id], e.message_count, status)
+            for e, status in zip(email_objects, statuses)
+            if status != "failed"
+        ]
+        archive_row = (archive_path, *archive) if "failed" not in statuses else None
+        if backfill is None:
+            record_threads(con, thread_rows)
+            if archive_row:
+                record_archive(con, *archive_row)
+        else:
+            pending_threads.extend(thread_rows)
+            if archive_row:
+                pending_archives.append(archive_row)
         print("finished populating db")
+    if backfill is not None:
+        stats = backfill.finish(in_swap=lambda cursor: rewrite_manifest(cursor, pending_threads, pending_archives))
+        print(f"backfill complete: {stats}")
 
 
 #DONT FORGET TO ADD RATE LIMITING
\ No newline at end of file
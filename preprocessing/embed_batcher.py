@@ -0,0 +1,140 @@
+import asyncio
+import os
+from functools import partial
+from typing import Dict, List, Optional, Tuple
+
+from rate_limit import estimate_tokens
+
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+EMBED_BATCH_MAX_ITEMS = int(os.getenv("EMBED_BATCH_MAX_ITEMS", "128"))
+EMBED_BATCH_MAX_TOKENS = int(os.getenv("EMBED_BATCH_MAX_TOKENS", "100000"))
+EMBED_BATCH_MAX_WAIT_MS = float(os.getenv("EMBED_BATCH_MAX_WAIT_MS", "25"))
+
+
+class EmbeddingBatcher:
+    """
+    Micro-batches embedding requests from concurrent tasks.
+
+    Callers await embed(text) as if it were a single request. Texts are held
+    until max_items texts or max_tokens estimated tokens are waiting, or
+    max_wait_ms has passed since the first one arrived, and then go out as a
+    single embeddings.create(input=[...]) call. Each caller gets its own vector
+    back (or the request's exception).
+
+    With a cache, texts already embedded under this model are answered locally
+    and never enter a batch. With a limiter, each batch request is subject to
+    its adaptive concurrency limit and retried on throttling. With a
+    rate_limiter, every attempt first takes its share of the cluster-wide
+    requests/min and tokens/min buckets, before it takes a concurrency slot.
+    """
+
+    def __init__(
+        self,
+        client,
+        model: str = EMBEDDING_MODEL,
+        max_items: int = EMBED_BATCH_MAX_ITEMS,
+        max_tokens: int = EMBED_BATCH_MAX_TOKENS,
+        max_wait_ms: float = EMBED_BATCH_MAX_WAIT_MS,
+        cache=None,
+        limiter=None,
+        rate_limiter=None,
+    ):
+        self.client = client
+        self.cache = cache
+        self.limiter = limiter
+        self.rate_limiter = rate_limiter
+        self.model = model
+        self.max_items = max_items
+        self.max_tokens = max_tokens
+        self.max_wait = max_wait_ms / 1000
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._pending_tokens = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._in_flight = set()
+        self.requests = 0
+        self.texts = 0
+
+    async def embed(self, text: str) -> List[float]:
+        if self.cache is not None:
+            cached = self.cache.get(self.model, text)
+            if cached is not None:
+                return cached
+
+        loop = asyncio.get_running_loop()
+        tokens = estimate_tokens(text)
+        if self._pending and self._pending_tokens + tokens > self.max_tokens:
+            self._flush()
+
+        future = loop.create_future()
+        self._pending.append((text, future))
+        self._pending_tokens += tokens
+
+        if len(self._pending) >= self.max_items or self._pending_tokens >= self.max_tokens:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    async def embed_many(self, texts: List[str]) -> List[List[float]]:
+        return list(await asyncio.gather(*(self.embed(text) for text in texts)))
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending, self._pending_tokens = self._pending, [], 0
+        task = asyncio.get_running_loop().create_task(self._send(batch))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def _send(self, batch: List[Tuple[str, asyncio.Future]]):
+        self.requests += 1
+        self.texts += len(batch)
+        texts = [text for text, _ in batch]
+        tokens = sum(estimate_tokens(text) for text in texts)
+
+        admit = partial(self.rate_limiter.acquire, tokens) if self.rate_limiter is not None else None
+        create = self.client.embeddings.create
+        if self.limiter is not None:
+            create = partial(self.limiter.call, create, admit=admit)
+        elif admit is not None:
+            await admit()
+        try:
+            response = await create(model=self.model, input=texts)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        vectors = [None] * len(batch)
+        for item in response.data:
+            vectors[item.index] = item.embedding
+        if self.cache is not None:
+            self.cache.put_many(
+                self.model,
+                [(text, vector) for (text, _), vector in zip(batch, vectors) if vector is not None],
+            )
+        for (_, future), vector in zip(batch, vectors):
+            if future.done():
+                continue
+            if vector is None:
+                future.set_exception(RuntimeError("embedding missing from batch response"))
+            else:
+                future.set_result(vector)
+
+    def stats(self) -> Dict[str, float]:
+        stats = {
+            "requests": self.requests,
+            "texts": self.texts,
+            "texts_per_request": self.texts / self.requests if self.requests else 0.0,
+        }
+        if self.cache is not None:
+            stats["cache_hits"] = self.cache.hits
+        if self.rate_limiter is not None:
+            stats["rate_limit_wait_seconds"] = round(self.rate_limiter.waited_seconds, 1)
+        return stats
@@ -1,27 +1,66 @@
 import os
 import asyncio
+import hashlib
+import time
 from openai import AsyncOpenAI
-from typing import List
+from functools import partial
+from typing import List, Optional
 import json
-from models.insert import Email
+from models.insert import BatchWriter, Email, insert_emails
 from dataclasses import replace
+from embed_batcher import EmbeddingBatcher, EMBEDDING_MODEL
+from ingest_cache import default_embedding_cache, default_extraction_cache
+from concurrency import get_limiter
+from rate_limit import RateLimiter, estimate_tokens
+from prefilter import PREFILTER_AUDIT_FRACTION, PREFILTER_ENABLED, PrefilterModel
+from span_matcher import lexicon_matcher
+from filter_emails import extract_main_messages
+from extraction_packer import PACK_MAX_THREAD_TOKENS, ThreadPacker
+from early_exit import EARLY_EXIT_JSON, EarlyExitDetector, EarlyExitStats
+from model_router import ModelRouter
+from json_repair import TruncatedOutput, UnrepairableOutput, coerce_extraction, parse_json_lenient, repair_extraction
 
 
 
+# retries are handled by the adaptive limiters so they can see 429s
 client = AsyncOpenAI(
     api_key=os.environ.get("STANFORD_API_KEY"),
-    base_url="https://aiapi-prod.stanford.edu/v1"
+    base_url="https://aiapi-prod.stanford.edu/v1",
+    max_retries=0,
 )
 
 
-MAX_CONCURRENT_REQUESTS = 5
+# tier 0 of EXTRACTION_MODEL_TIERS; bigger tiers are chosen per thread by the router
+router = ModelRouter()
+EXTRACTION_MODEL = router.model(0)
+# reserved against the tokens/min bucket for the completion itself
+EXTRACTION_OUTPUT_TOKENS = 800
+
+llm_limiter = get_limiter("llm")
+rate_limiter = RateLimiter("email_pipeline")
+embedder = EmbeddingBatcher(
+    client,
+    model=EMBEDDING_MODEL,
+    cache=default_embedding_cache(),
+    limiter=get_limiter("embeddings"),
+    rate_limiter=rate_limiter,
+)
+
+
+# Chemicals/processes found by the local dictionary matcher are sent with the thread,
+# so the model only adds what the lexicon missed instead of re-emitting every span.
+PREFILL_SPANS = os.getenv("EXTRACTION_PREFILL", "on").lower() not in ("0", "off", "false")
+EXTRACTION_LAYOUT = "prefill" if PREFILL_SPANS else "split"
 
+# Bump when the message layout changes (the hash below only sees the text).
+PROMPT_TEMPLATE_VERSION = "v3-prefill" if PREFILL_SPANS else "v2-split"
 
-SYSTEM_PROMPT_TEMPLATE = """
+# Static instructions, byte-identical on every call so the provider can cache the prefix.
+EXTRACTION_INSTRUCTIONS = """
 You are an information extraction engine. Output MUST be valid JSON only. No markdown. No explanations. No extra keys.
 
 SCHEMA (must match exactly)
-{{
+{
   "prom_request": string,
   "prom_considerations": string,
   "chemicals_mentioned": [string],
@@ -29,10 +68,10 @@ SCHEMA (must match exactly)
   "prom_approval": "approved" | "rejected" | "hard_to_tell",
   "approval_evidence": string,
   "llm_context": string
-}}
+}
 
 RULES (CRITICAL)
-- EARLY EXIT: If EMAIL_THREAD is NOT about a PROM request (e.g., scheduling, administrative, general discussion, announcements, lab tours, nanofabrication interest or any topic unrelated to chemicals, materials, or the request of doing a certain nanofabrication process), return ONLY: {{"prom_request": "", "prom_considerations":"", "chemicals_mentioned":[], "processes_mentioned":[], "prom_considerations":"", "prom_approval":"", "approval_evidence": "", "llm_context": ""}}
+- EARLY EXIT: If EMAIL_THREAD is NOT about a PROM request (e.g., scheduling, administrative, general discussion, announcements, lab tours, nanofabrication interest or any topic unrelated to chemicals, materials, or the request of doing a certain nanofabrication process), return ONLY: {"prom_request": "", "prom_considerations":"", "chemicals_mentioned":[], "processes_mentioned":[], "prom_approval":"", "approval_evidence": "", "llm_context": ""}
 - Use ONLY the text in EMAIL_THREAD. Do NOT guess.
 - Do NOT include email headers/metadata inside any extracted strings (e.g., lines containing "From:", "To:", "Cc:", "Subject:", dates/timestamps).
 - Do NOT include quoted reply history (lines starting with ">").
@@ -91,52 +130,363 @@ FIELD DEFINITIONS
   Include: chemical properties, safety considerations, common use cases, process compatibility, typical equipment requirements, or known best practices.
   This should SUPPLEMENT (not repeat) the verbatim extractions.
   Aim for ~200 tokens. Be specific and technically relevant to semiconductor/nanofabrication contexts.
+"""
 
-EMAIL_THREAD:
-<<<THREAD
-{thread}
-THREAD>>>
+OUTPUT_INSTRUCTION = """OUTPUT
+Return exactly one JSON object matching SCHEMA. JSON only.
+"""
+
+SYSTEM_PROMPT = (
+    EXTRACTION_INSTRUCTIONS
+    + "\nEMAIL_THREAD is supplied in the next message, between <<<THREAD and THREAD>>>.\n\n"
+    + OUTPUT_INSTRUCTION
+)
+
+PREFILL_INSTRUCTION = """
+PREFILLED SPANS
+The next message also contains PREFILLED chemicals_mentioned and processes_mentioned, found in EMAIL_THREAD by a dictionary matcher.
+They are already verbatim and deduplicated. Do NOT output chemicals_mentioned or processes_mentioned.
+Instead output:
+  "extra_chemicals_mentioned": [string],
+  "extra_processes_mentioned": [string]
+holding ONLY verbatim mentions (same rules as above) that the PREFILLED lists missed. Usually these are [].
+Words that are also ordinary English or names (e.g. "develop", "strip", "gold", "resist", "He") are never PREFILLED:
+add them to extra_* only where EMAIL_THREAD uses them as a chemical or process.
+All other SCHEMA fields are required as defined above. For the EARLY EXIT case return the early-exit object with empty extra_* arrays.
+"""
+
+PREFILL_SYSTEM_PROMPT = (
+    EXTRACTION_INSTRUCTIONS
+    + PREFILL_INSTRUCTION
+    + "\nEMAIL_THREAD is supplied in the next message, between <<<THREAD and THREAD>>>.\n\n"
+    + OUTPUT_INSTRUCTION
+)
+
+THREAD_MESSAGE_TEMPLATE = "EMAIL_THREAD:\n<<<THREAD\n{thread}\nTHREAD>>>"
+PREFILLED_TEMPLATE = "\n\nPREFILLED:\n{prefilled}"
+
+# Stream single-thread extractions and stop generating once the early-exit answer is certain.
+EARLY_EXIT_ENABLED = os.getenv("EXTRACTION_EARLY_EXIT", "on").lower() not in ("0", "off", "false")
+early_exit_stats = EarlyExitStats()
+
+# Short threads are packed several to a request (see extraction_packer.py).
+PACKING_ENABLED = os.getenv("EXTRACTION_PACKING", "on").lower() not in ("0", "off", "false")
+
+PACK_INSTRUCTION = """
+MULTIPLE THREADS
+The next message contains several EMAIL_THREADs. Each starts with a THREAD_ID line, is delimited by <<<THREAD and THREAD>>>, and is followed by its own PREFILLED block when one is given.
+Apply every rule above to each thread independently. Never carry content from one thread into another.
 
 OUTPUT
-Return exactly one JSON object matching SCHEMA. JSON only.
+Return exactly one JSON array with one object per THREAD_ID, in the order given.
+Each object has "thread_id" (copied exactly) plus the fields defined above. JSON only.
 """
 
+PACKED_SYSTEM_PROMPT = EXTRACTION_INSTRUCTIONS + (PREFILL_INSTRUCTION if PREFILL_SPANS else "") + PACK_INSTRUCTION
+
+REQUIRED_FIELDS = ("prom_request", "prom_considerations", "prom_approval", "llm_context")
+
+# Any edit to the prompt yields a new version, so cached extractions from the old prompt are ignored.
+# Packed answers are journaled under the same version, so the pack prompt is hashed too
+# (whether or not packing is on, so toggling it keeps the journal).
+PROMPT_VERSION = (
+    PROMPT_TEMPLATE_VERSION
+    + "-"
+    + hashlib.sha256(
+        ((PREFILL_SYSTEM_PROMPT + PREFILLED_TEMPLATE) if PREFILL_SPANS else SYSTEM_PROMPT).encode("utf-8")
+        + THREAD_MESSAGE_TEMPLATE.encode("utf-8")
+        + PACKED_SYSTEM_PROMPT.encode("utf-8")
+    ).hexdigest()[:12]
+)
+
+
+def prefilled_spans(email_thread: str) -> dict:
+    """Lexicon spans of the thread's own text; quoted history and headers never prefill a span."""
+    spans = lexicon_matcher.spans(extract_main_messages(email_thread))
+    return {"chemicals_mentioned": spans["chemicals"], "processes_mentioned": spans["processes"]}
+
 
+def merge_prefilled(result: str, email_thread: str, prefilled: Optional[dict] = None) -> str:
+    """
+    Fold a prefill-layout answer back into the full SCHEMA: prefilled spans plus
+    the model's extra_* spans that really occur in the thread's own text
+    (extract_main_messages, as for the prefill). An early exit
+    (empty prom_request) keeps empty lists so the thread still counts as off topic.
+    Pass the prefilled_spans() sent with the request to avoid matching the thread again.
+    """
+    try:
+        json_object = parse_json_lenient(result)
+    except UnrepairableOutput:
+        return result
+    if not isinstance(json_object, dict):
+        return result
+    # a model that ignores the instruction and fills the full lists is handled the same way
+    extra_chemicals = (json_object.pop("extra_chemicals_mentioned", None) or []) + (json_object.get("chemicals_mentioned") or [])
+    extra_processes = (json_object.pop("extra_processes_mentioned", None) or []) + (json_object.get("processes_mentioned") or [])
+    if not json_object.get("prom_request"):
+        json_object["chemicals_mentioned"] = []
+        json_object["processes_mentioned"] = []
+        return json.dumps(json_object)
+    if prefilled is None:
+        prefilled = prefilled_spans(email_thread)
+    # the same cleaned text the prefilled spans were matched in
+    main_text = extract_main_messages(email_thread)
+    for field, extras in (("chemicals_mentioned", extra_chemicals), ("processes_mentioned", extra_processes)):
+        verbatim = [span for span in extras if isinstance(span, str) and span and span in main_text]
+        json_object[field] = list(dict.fromkeys(prefilled[field] + verbatim))
+    return json.dumps(json_object)
+
+
+def build_extraction_messages(email_thread: str, layout: str = EXTRACTION_LAYOUT, prefilled: Optional[dict] = None) -> List[dict]:
+    """
+    "prefill": fixed system prompt, thread plus locally matched spans (prefilled,
+    or computed here) in the user message.
+    "split": fixed system prompt, thread in its own user message.
+    "inline": the thread formatted into the middle of the system prompt, as before v2.
+    """
+    thread_block = THREAD_MESSAGE_TEMPLATE.format(thread=email_thread)
+    if layout == "prefill":
+        if prefilled is None:
+            prefilled = prefilled_spans(email_thread)
+        return [
+            {"role": "system", "content": PREFILL_SYSTEM_PROMPT},
+            {"role": "user", "content": thread_block + PREFILLED_TEMPLATE.format(prefilled=json.dumps(prefilled, ensure_ascii=False))},
+        ]
+    if layout == "inline":
+        return [{"role": "system", "content": f"{EXTRACTION_INSTRUCTIONS}\n{thread_block}\n\n{OUTPUT_INSTRUCTION}"}]
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": thread_block},
+    ]
+
+
+def build_packed_messages(threads: List[str], prefilled: Optional[List[dict]] = None) -> List[dict]:
+    blocks = []
+    for i, thread in enumerate(threads):
+        block = f"THREAD_ID: T{i + 1}\n" + THREAD_MESSAGE_TEMPLATE.format(thread=thread)
+        if PREFILL_SPANS:
+            spans = prefilled[i] if prefilled is not None else prefilled_spans(thread)
+            block += PREFILLED_TEMPLATE.format(prefilled=json.dumps(spans, ensure_ascii=False))
+        blocks.append(block)
+    return [
+        {"role": "system", "content": PACKED_SYSTEM_PROMPT},
+        {"role": "user", "content": "\n\n".join(blocks)},
+    ]
+
+
+def parse_packed_response(content: str, threads: List[str], prefilled: Optional[List[dict]] = None) -> List[Optional[str]]:
+    """
+    Split a packed answer into one single-thread JSON result per thread.
+    Items that are missing, duplicated or can't be repaired come back as None.
+    prefilled: the spans sent with each thread, as given to build_packed_messages.
+    """
+    results: List[Optional[str]] = [None] * len(threads)
+    try:
+        parsed = parse_json_lenient(content)
+    except UnrepairableOutput:
+        return results
+    if isinstance(parsed, dict):
+        parsed = parsed.get("results") or parsed.get("threads") or []
+    if not isinstance(parsed, list):
+        return results
+
+    ids = {f"T{i + 1}": i for i in range(len(threads))}
+    for item in parsed:
+        if not isinstance(item, dict):
+            continue
+        index = ids.get(str(item.pop("thread_id", "")))
+        if index is None or results[index] is not None:
+            continue
+        if any(field not in item for field in REQUIRED_FIELDS):
+            continue
+        if PREFILL_SPANS:
+            spans = prefilled[index] if prefilled is not None else None
+            item = json.loads(merge_prefilled(json.dumps(item), threads[index], spans))
+        try:
+            results[index] = json.dumps(coerce_extraction(item))
+        except UnrepairableOutput:
+            continue
+    return results
+
+
+extraction_cache = default_extraction_cache()
+prefilter = PrefilterModel.load() if PREFILTER_ENABLED else None
+
+
+def check_finish_reason(finish_reason: Optional[str]):
+    """A completion cut off at the token limit is never repaired into a result."""
+    if finish_reason == "length":
+        raise TruncatedOutput("completion stopped at the output token limit")
+
+
+async def stream_extraction(messages: List[dict], model: str = EXTRACTION_MODEL) -> str:
+    """
+    Stream the completion, watching for the EARLY EXIT shape. Once it is certain
+    the stream is closed (ending generation) and the canonical early-exit JSON is returned.
+    """
+    # with prefilled spans an empty prom_request alone marks the early exit
+    detector = EarlyExitDetector(check_arrays=not PREFILL_SPANS)
+    started_at = time.monotonic()
+    stream = await client.chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=0.0,
+        stream=True,
+    )
+    parts = []
+    decided = None
+    finish_reason = None
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].finish_reason:
+            finish_reason = chunk.choices[0].finish_reason
+        if not chunk.choices or not chunk.choices[0].delta.content:
+            continue
+        parts.append(chunk.choices[0].delta.content)
+        if decided is None:
+            decided = detector.feed("".join(parts))
+            if decided:
+                await stream.close()
+                early_exit_stats.record("".join(parts), started_at)
+                return EARLY_EXIT_JSON
+    check_finish_reason(finish_reason)
+    return "".join(parts)
+
+
+async def complete_extraction(messages: List[dict], model: str = EXTRACTION_MODEL) -> str:
+    """One extraction request; the caller holds the rate-limit grant and the concurrency slot."""
+    if EARLY_EXIT_ENABLED:
+        return await stream_extraction(messages, model)
+    response = await client.chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=0.0,
+    )
+    check_finish_reason(response.choices[0].finish_reason)
+    return response.choices[0].message.content
 
 
-async def extract_prom_json(email_thread: str) -> str:
+async def extract_prom_json(
+    email_thread: str,
+    model: str = EXTRACTION_MODEL,
+    prefilled: Optional[dict] = None,
+    limiter=llm_limiter,
+) -> str:
     """
     Async version - takes a raw email thread and returns the extracted PROM JSON.
     Does not block CPU while waiting for OpenAI response.
+    The lexicon spans are matched once (or passed in) for both the request and the merge.
     """
-    system_prompt = SYSTEM_PROMPT_TEMPLATE.format(thread=email_thread)
+    if PREFILL_SPANS and prefilled is None:
+        prefilled = prefilled_spans(email_thread)
+    messages = build_extraction_messages(email_thread, prefilled=prefilled)
+    prompt_tokens = sum(estimate_tokens(message["content"]) for message in messages)
+    content = await limiter.call(
+        complete_extraction,
+        messages,
+        model,
+        admit=partial(rate_limiter.acquire, prompt_tokens + EXTRACTION_OUTPUT_TOKENS),
+    )
+
+    if PREFILL_SPANS:
+        return merge_prefilled(content, email_thread, prefilled)
+    return content
+
 
+async def complete_packed(messages: List[dict]) -> Optional[str]:
+    """One packed request; None when the completion hit the output token limit."""
     response = await client.chat.completions.create(
-        model="gpt-4.omini",
-        messages=[
-            {"role": "system", "content": system_prompt}
-        ],
+        model=EXTRACTION_MODEL,
+        messages=messages,
         temperature=0.0,
     )
-
+    if response.choices[0].finish_reason == "length":
+        return None
     return response.choices[0].message.content
 
-async def embed_concat_json(concat_thread: str) -> List[float]:
-    """
-    Async version of embedding, comes post LLM JSON retrieval in the pipeline
-    """
 
-    response = await client.embeddings.create(
-        model = "text-embedding-ada-002",
-        input=concat_thread
+async def extract_packed(threads: List[str], limiter=llm_limiter) -> List[Optional[str]]:
+    """One request for several short threads; None for items that came back unusable."""
+    prefilled = [prefilled_spans(thread) for thread in threads] if PREFILL_SPANS else None
+    messages = build_packed_messages(threads, prefilled)
+    prompt_tokens = sum(estimate_tokens(message["content"]) for message in messages)
+    content = await limiter.call(
+        complete_packed,
+        messages,
+        admit=partial(rate_limiter.acquire, prompt_tokens + EXTRACTION_OUTPUT_TOKENS * len(threads)),
     )
+    if content is None:
+        # every thread falls back to its own request
+        return [None] * len(threads)
+    return parse_packed_response(content, threads, prefilled)
+
+
+packer = ThreadPacker(
+    send_pack=extract_packed,
+    send_single=extract_prom_json,
+) if PACKING_ENABLED else None
+
 
-    return response.data[0].embedding
+async def extract_thread(email_thread: str, llm_limiter, tier: int = 0, prefilled: Optional[dict] = None) -> str:
+    """Short tier-0 threads share packed requests; everything else gets its own call."""
+    if tier == 0 and packer is not None and estimate_tokens(email_thread) <= PACK_MAX_THREAD_TOKENS:
+        return await packer.extract(email_thread)
+    return await extract_prom_json(email_thread, router.model(tier), prefilled, llm_limiter)
+
+
+async def extract_routed(email_thread: str, tier: int, llm_limiter):
+    """
+    Extract with the routed tier and validate. An answer that can't be repaired, or
+    was cut off at the token limit, is retried one tier up, and once more on the
+    top tier before giving up.
+    Returns (raw result, validated dict or None, tier).
+    """
+    prefilled = prefilled_spans(email_thread) if PREFILL_SPANS else None
+    prompt_tokens = sum(estimate_tokens(message["content"]) for message in build_extraction_messages(email_thread, prefilled=prefilled))
+    retried_top = False
+    while True:
+        start = time.monotonic()
+        try:
+            # a truncated completion raises here, before anything is parsed
+            llm_result = await extract_thread(email_thread, llm_limiter, tier, prefilled)
+            router.record(tier, time.monotonic() - start, prompt_tokens, estimate_tokens(llm_result or ""))
+            return llm_result, validating_llm_response(llm_result), tier
+        except UnrepairableOutput as error:
+            next_tier = router.escalate(tier)
+            if next_tier is None:
+                if retried_top:
+                    raise
+                retried_top = True
+                print(f"unrepairable extraction from {router.model(tier)}, retrying: {error}")
+                next_tier = tier
+            else:
+                print(f"unrepairable extraction from {router.model(tier)}, escalating to {router.model(next_tier)}")
+            tier = next_tier
+
+
+def journaled_extraction(email_thread: str) -> Optional[str]:
+    """A journaled result from any tier, largest model first."""
+    if extraction_cache is None:
+        return None
+    for tier in reversed(range(len(router.tiers))):
+        result = extraction_cache.get(PROMPT_VERSION, router.model(tier), email_thread)
+        if result is not None:
+            return result
+    return None
+
+async def embed_concat_json(concat_thread: str) -> List[float]:
+    """
+    Async version of embedding, comes post LLM JSON retrieval in the pipeline.
+    Cached vectors are reused; misses are coalesced into batched requests.
+    """
+    return await embedder.embed(concat_thread)
 
 
 def validating_llm_response(result: str) -> dict | None:
-    """Parse LLM response, return dict matching Email dataclass attributes."""
-    json_object = json.loads(result)
+    """
+    Parse LLM response, return dict matching Email dataclass attributes.
+    Fenced, padded or slightly malformed JSON is repaired; raises UnrepairableOutput otherwise.
+    """
+    json_object = repair_extraction(result)
     chemicals_mentioned = json_object["chemicals_mentioned"]
     processes_mentioned = json_object["processes_mentioned"]
     
@@ -165,15 +515,42 @@ def validating_llm_response(result: str) -> dict | None:
 
 
         
-async def process_single(email_object: Email, llm_sem):
-    """Each thread flows through LLM → validate → embed → return updated Email."""
-    async with llm_sem:
-        llm_result = await extract_prom_json(email_object.raw_thread)
-    
-    if llm_result is None:
-        return None
-    
-    extracted = validating_llm_response(llm_result)
+async def process_single(email_object: Email, llm_limiter):
+    """
+    Each thread flows through LLM → validate → embed → return updated Email.
+    Validated extractions are journaled as they arrive, so a rerun skips the LLM for finished threads.
+    Threads the local pre-filter rejects never reach the LLM (and are not journaled),
+    except its audit sample (PREFILTER_AUDIT_FRACTION), journaled with its weight.
+    The model tier is picked per thread by the router.
+    """
+    thread = email_object.raw_thread
+    llm_result = journaled_extraction(thread)
+
+    if llm_result is not None:
+        extracted = validating_llm_response(llm_result)
+    else:
+        score = None
+        weight = 1.0
+        if prefilter is not None:
+            keep, score = prefilter.check(thread)
+            if not keep:
+                if not prefilter.audit(thread):
+                    return None
+                # journaled so the pre-filter's recall can be measured on what it skips
+                weight = 1 / PREFILTER_AUDIT_FRACTION
+
+        tier = router.route(estimate_tokens(thread), email_object.message_count, email_object.reviewer_replies, score)
+        try:
+            llm_result, extracted, tier = await extract_routed(thread, tier, llm_limiter)
+        except UnrepairableOutput as error:
+            # not journaled (nor fingerprinted), so the next run tries this thread again
+            print(f"giving up on thread from {email_object.requestor} ({email_object.date}): {error}")
+            raise
+        if extraction_cache is not None:
+            extraction_cache.put(
+                PROMPT_VERSION, router.model(tier), thread, llm_result,
+                decision="off_topic" if extracted is None else "prom", weight=weight,
+            )
     if extracted is None:
         return None
     
@@ -185,16 +562,51 @@ async def process_single(email_object: Email, llm_sem):
 
 
 
-async def run_pipeline(email_objects: List[Email], con):
-    llm_sem = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
-    inserted_counter = 0
-    tasks = [process_single(email_object, llm_sem) for email_object in email_objects]
+async def run_pipeline(email_objects: List[Email], con, writer=None) -> List[str]:
+    """
+    Extract, embed and write every thread. writer defaults to batched inserts
+    into email_embeddings; a database.backfill.Backfill stages rows for COPY instead.
+    Returns one status per input thread, in input order: "written", "off_topic"
+    (pre-filtered or no PROM found) or "failed".
+    """
+    early_exit_stats.reset()
+    writer = writer or BatchWriter(con, insert_emails)
+    statuses = ["failed"] * len(email_objects)
+
+    async def indexed(idx: int, email_object: Email):
+        return idx, await process_single(email_object, llm_limiter)
+
+    tasks = [indexed(idx, email_object) for idx, email_object in enumerate(email_objects)]
     for coro in asyncio.as_completed(tasks):
-        finished_email_object = await coro
+        # one failed thread must not take the rest of the batch down with it
+        try:
+            idx, finished_email_object = await coro
+        except Exception as e:
+            print(f"email extraction failed: {type(e).__name__}: {e}")
+            continue
         if finished_email_object:
             print(finished_email_object.embedded_string)
             print("*" * 100)
-            finished_email_object.insert_email(con)
-            inserted_counter += 1
-    print(f"inserted {inserted_counter} email objects")
-    return inserted_counter
\ No newline at end of file
+            statuses[idx] = "written"
+            for written_idx, outcome in writer.add(finished_email_object, tag=idx):
+                if outcome == "failed":
+                    statuses[written_idx] = "failed"
+        else:
+            statuses[idx] = "off_topic"
+    for written_idx, outcome in writer.close():
+        if outcome == "failed":
+            statuses[written_idx] = "failed"
+    print(f"wrote {statuses.count('written')} email objects, {statuses.count('failed')} failed")
+    print(f"writer: {writer.stats()}")
+    print(f"embedding batches: {embedder.stats()}")
+    print(f"llm limiter: {llm_limiter.stats()} | embedding limiter: {embedder.limiter.stats()}")
+    if extraction_cache is not None:
+        print(f"extractions reused from journal: {extraction_cache.hits}, new: {extraction_cache.misses}")
+    if prefilter is not None:
+        print(f"pre-filter: {prefilter.stats()}")
+    if packer is not None:
+        print(f"packed extraction: {packer.stats()}")
+    if EARLY_EXIT_ENABLED:
+        print(f"early-exit aborts: {early_exit_stats.stats()}")
+    print(f"model tiers: {router.stats()}")
+    return statuses
\ No newline at end of file
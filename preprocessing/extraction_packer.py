@@ -0,0 +1,110 @@
+import asyncio
+import os
+from typing import Dict, List, Optional, Tuple
+
+from rate_limit import estimate_tokens
+
+
+# threads at or under this many estimated tokens are packed; longer ones go alone
+PACK_MAX_THREAD_TOKENS = int(os.getenv("PACK_MAX_THREAD_TOKENS", "800"))
+PACK_TOKEN_BUDGET = int(os.getenv("PACK_TOKEN_BUDGET", "6000"))
+PACK_MAX_THREADS = int(os.getenv("PACK_MAX_THREADS", "8"))
+PACK_MAX_WAIT_MS = float(os.getenv("PACK_MAX_WAIT_MS", "50"))
+
+
+class ThreadPacker:
+    """
+    Packs short email threads into shared extraction requests.
+
+    Works like EmbeddingBatcher: callers await extract(thread) as if it were a
+    single call. Threads are held until max_threads threads or token_budget
+    estimated tokens are waiting, or max_wait_ms has passed, and then go out
+    together through send_pack(threads), which returns one result per thread
+    (None where that thread's item was missing or invalid). Those threads, and
+    every thread of a pack whose request failed outright, fall back to
+    send_single(thread).
+    """
+
+    def __init__(
+        self,
+        send_pack,
+        send_single,
+        token_budget: int = PACK_TOKEN_BUDGET,
+        max_threads: int = PACK_MAX_THREADS,
+        max_wait_ms: float = PACK_MAX_WAIT_MS,
+    ):
+        self.send_pack = send_pack
+        self.send_single = send_single
+        self.token_budget = token_budget
+        self.max_threads = max_threads
+        self.max_wait = max_wait_ms / 1000
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._pending_tokens = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._in_flight = set()
+        self.packs = 0
+        self.packed_threads = 0
+        self.fallbacks = 0
+
+    async def extract(self, thread: str) -> str:
+        loop = asyncio.get_running_loop()
+        tokens = estimate_tokens(thread)
+        if self._pending and self._pending_tokens + tokens > self.token_budget:
+            self._flush()
+
+        future = loop.create_future()
+        self._pending.append((thread, future))
+        self._pending_tokens += tokens
+
+        if len(self._pending) >= self.max_threads or self._pending_tokens >= self.token_budget:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        pack, self._pending, self._pending_tokens = self._pending, [], 0
+        task = asyncio.get_running_loop().create_task(self._send(pack))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def _send(self, pack: List[Tuple[str, asyncio.Future]]):
+        threads = [thread for thread, _ in pack]
+        if len(pack) == 1:
+            results = [None]
+        else:
+            self.packs += 1
+            try:
+                results = await self.send_pack(threads)
+            except Exception as e:
+                print(f"packed extraction of {len(pack)} threads failed, retrying one by one: {e}")
+                results = [None] * len(pack)
+
+        await asyncio.gather(*(self._resolve(thread, future, result) for (thread, future), result in zip(pack, results)))
+
+    async def _resolve(self, thread: str, future: asyncio.Future, result: Optional[str]):
+        if result is None:
+            self.fallbacks += 1
+            try:
+                result = await self.send_single(thread)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                return
+        else:
+            self.packed_threads += 1
+        if not future.done():
+            future.set_result(result)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "packs": self.packs,
+            "packed_threads": self.packed_threads,
+            "threads_per_pack": self.packed_threads / self.packs if self.packs else 0.0,
+            "fallbacks": self.fallbacks,
+        }
@@ -368,6 +368,23 @@ def extract_main_message(raw_email: str) -> str:
 
 
 
+def extract_main_messages(thread: str) -> str:
+    """
+    extract_main_message for every message of a thread, split on its mbox
+    envelope lines (text without any is one message). Quoted history of
+    earlier messages is dropped from each reply.
+    """
+    messages, current = [], []
+    for line in thread.splitlines():
+        if MBOX_ENVELOPE_RE.match(line) and current:
+            messages.append("\n".join(current))
+            current = []
+        current.append(line)
+    if current:
+        messages.append("\n".join(current))
+    return "\n".join(extract_main_message(message) for message in messages)
+
+
 if __name__ == "__main__":
     test_email = """From alex.xing at 10xgenomics.com  Wed Dec  4 22:58:44 2019
 From: alex.xing at 10xgenomics.com (Alex Xing)
@@ -0,0 +1,354 @@
+"""
+On-disk caches for the ingestion pipelines (SQLite, stdlib only).
+
+EmbeddingCache maps sha256(model, text) -> float32 vector, so re-running the
+email or PROM pipelines over an unchanged corpus makes no embedding calls.
+The file is shared by the server, the forked workers and ad-hoc pipeline runs
+(WAL mode, one connection per process) and is trimmed least-recently-used
+first once it grows past its size budget.
+
+ExtractionCache keeps validated LLM extraction JSON per (prompt version,
+model, thread text) and acts as the resume journal for email ingestion.
+
+CLI:
+    python preprocessing/ingest_cache.py embeddings stats
+    python preprocessing/ingest_cache.py embeddings export <file.sqlite3>
+    python preprocessing/ingest_cache.py embeddings import <file.sqlite3>
+    python preprocessing/ingest_cache.py embeddings prune [max_mb]
+    python preprocessing/ingest_cache.py extractions stats
+    python preprocessing/ingest_cache.py extractions export <file.sqlite3>
+    python preprocessing/ingest_cache.py extractions purge <current_prompt_version>
+"""
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+import time
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+CACHE_DIR = os.getenv("INGEST_CACHE_DIR", os.path.join(ROOT_DIR, ".cache"))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(CACHE_DIR, "embeddings.sqlite3"))
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_MB", "2048")) * 1024 * 1024
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE", "on").lower() not in ("0", "off", "false")
+EXTRACTION_CACHE_PATH = os.getenv("EXTRACTION_CACHE_PATH", os.path.join(CACHE_DIR, "extractions.sqlite3"))
+EXTRACTION_CACHE_ENABLED = os.getenv("EXTRACTION_CACHE", "on").lower() not in ("0", "off", "false")
+
+# how many writes between size checks
+EVICTION_CHECK_INTERVAL = 256
+# evict down to this fraction of the budget so we don't trim on every write
+EVICTION_TARGET_RATIO = 0.9
+
+
+def content_key(*parts: str) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+def pack_vector(vector: List[float]) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def unpack_vector(blob: bytes) -> List[float]:
+    vector = array("f")
+    vector.frombytes(blob)
+    return vector.tolist()
+
+
+class SQLiteStore:
+    """
+    One SQLite connection per process and thread: reopened after fork so
+    workers never share a handle, and per-thread for FastAPI's threadpool.
+    """
+
+    SCHEMA = ""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    @property
+    def con(self) -> sqlite3.Connection:
+        con = getattr(self._local, "con", None)
+        if con is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            con = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            con.executescript(self.SCHEMA)
+            self.migrate(con)
+            self._local.con = con
+            self._local.pid = os.getpid()
+        return con
+
+    def migrate(self, con: sqlite3.Connection):
+        """Bring a cache file written by an older version up to SCHEMA."""
+
+    def executemany(self, sql: str, rows: List[Tuple]):
+        """Run a write batch in one transaction instead of one per row."""
+        if not rows:
+            return
+        con = self.con
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            con.executemany(sql, rows)
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        con.execute("COMMIT")
+
+    def export_to(self, path: str):
+        """Write a consistent copy of the cache to another SQLite file."""
+        target = sqlite3.connect(path)
+        try:
+            self.con.backup(target)
+        finally:
+            target.close()
+
+    def close(self):
+        con = getattr(self._local, "con", None)
+        if con is not None and self._local.pid == os.getpid():
+            con.close()
+        self._local.con = None
+
+
+class EmbeddingCache(SQLiteStore):
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS embeddings (
+        key TEXT PRIMARY KEY,
+        model TEXT NOT NULL,
+        vector BLOB NOT NULL,
+        last_used REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS embeddings_last_used_idx ON embeddings (last_used);
+    """
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, max_bytes: int = EMBEDDING_CACHE_MAX_BYTES):
+        super().__init__(path)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._writes_since_check = 0
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        return self.get_many(model, [text]).get(text)
+
+    def get_many(self, model: str, texts: Iterable[str]) -> Dict[str, List[float]]:
+        keys = {content_key(model, text): text for text in texts}
+        found = {}
+        key_list = list(keys)
+        # stay under SQLite's bound-parameter limit
+        for start in range(0, len(key_list), 500):
+            chunk = key_list[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.con.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+            ).fetchall()
+            for key, blob in rows:
+                found[keys[key]] = unpack_vector(blob)
+            if rows:
+                self.con.execute(
+                    f"UPDATE embeddings SET last_used = ? WHERE key IN ({','.join('?' * len(rows))})",
+                    [time.time()] + [key for key, _ in rows],
+                )
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put(self, model: str, text: str, vector: List[float]):
+        self.put_many(model, [(text, vector)])
+
+    def put_many(self, model: str, items: Iterable[Tuple[str, List[float]]]):
+        now = time.time()
+        rows = [(content_key(model, text), model, pack_vector(vector), now) for text, vector in items]
+        self.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, model, vector, last_used) VALUES (?, ?, ?, ?)", rows
+        )
+        self._writes_since_check += len(rows)
+        if self._writes_since_check >= EVICTION_CHECK_INTERVAL:
+            self._writes_since_check = 0
+            self.evict()
+
+    def size_bytes(self) -> int:
+        return self.con.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+    def evict(self, max_bytes: Optional[int] = None) -> int:
+        """Drop least-recently-used vectors until the cache fits its budget."""
+        budget = self.max_bytes if max_bytes is None else max_bytes
+        excess = self.size_bytes() - budget
+        if excess <= 0:
+            return 0
+        to_free = excess + int(budget * (1 - EVICTION_TARGET_RATIO))
+        freed = 0
+        rows = self.con.execute("SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_used").fetchall()
+        doomed = []
+        for key, size in rows:
+            if freed >= to_free:
+                break
+            doomed.append((key,))
+            freed += size
+        self.executemany("DELETE FROM embeddings WHERE key = ?", doomed)
+        removed = len(doomed)
+        print(f"[cache] evicted {removed} embeddings ({freed / 1024 / 1024:.1f} MB)")
+        return removed
+
+    def import_from(self, path: str) -> int:
+        """Merge vectors from an exported cache file; existing keys win."""
+        before = self.con.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        self.con.execute("ATTACH DATABASE ? AS incoming", (path,))
+        try:
+            self.con.execute(
+                "INSERT OR IGNORE INTO embeddings (key, model, vector, last_used) "
+                "SELECT key, model, vector, last_used FROM incoming.embeddings"
+            )
+        finally:
+            self.con.execute("DETACH DATABASE incoming")
+        after = self.con.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return after - before
+
+    def stats(self) -> Dict[str, float]:
+        count = self.con.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return {
+            "entries": count,
+            "size_mb": round(self.size_bytes() / 1024 / 1024, 2),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def default_embedding_cache() -> Optional[EmbeddingCache]:
+    """The shared on-disk cache, or None when EMBEDDING_CACHE=off."""
+    if not EMBEDDING_CACHE_ENABLED:
+        return None
+    return EmbeddingCache()
+
+
+class ExtractionCache(SQLiteStore):
+    """
+    Validated LLM extraction results keyed by sha256(prompt_version, model, thread).
+
+    Each result is written as soon as it is validated, so the cache doubles as
+    the journal for an interrupted email run: a rerun only pays for threads
+    that never finished. Entries from an older prompt version are simply never
+    looked up again (purge_stale() reclaims them).
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS extractions (
+        key TEXT PRIMARY KEY,
+        prompt_version TEXT NOT NULL,
+        model TEXT NOT NULL,
+        decision TEXT NOT NULL,
+        result TEXT NOT NULL,
+        thread TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        weight REAL NOT NULL DEFAULT 1
+    );
+    CREATE INDEX IF NOT EXISTS extractions_version_idx ON extractions (prompt_version);
+    """
+
+    def migrate(self, con: sqlite3.Connection):
+        columns = {row[1] for row in con.execute("PRAGMA table_info(extractions)")}
+        if "weight" not in columns:
+            try:
+                con.execute("ALTER TABLE extractions ADD COLUMN weight REAL NOT NULL DEFAULT 1")
+            except sqlite3.OperationalError:
+                # another process added it first
+                pass
+
+    def __init__(self, path: str = EXTRACTION_CACHE_PATH):
+        super().__init__(path)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, prompt_version: str, model: str, thread: str) -> Optional[str]:
+        row = self.con.execute(
+            "SELECT result FROM extractions WHERE key = ?",
+            (content_key(prompt_version, model, thread),),
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def put(self, prompt_version: str, model: str, thread: str, result: str, decision: str, weight: float = 1.0):
+        """
+        decision is "prom" or "off_topic" (the validated outcome, kept for pre-filter
+        evaluation); weight is 1 / the chance the thread was sent to the LLM at all
+        (above 1 for pre-filter audit samples).
+        """
+        self.con.execute(
+            "INSERT OR REPLACE INTO extractions (key, prompt_version, model, decision, result, thread, created_at, weight) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (content_key(prompt_version, model, thread), prompt_version, model, decision, result, thread, time.time(), weight),
+        )
+
+    def decisions(self, prompt_version: Optional[str] = None) -> List[Tuple[str, str]]:
+        """(thread, decision) pairs, optionally for one prompt version only."""
+        if prompt_version is None:
+            return self.con.execute("SELECT thread, decision FROM extractions").fetchall()
+        return self.con.execute(
+            "SELECT thread, decision FROM extractions WHERE prompt_version = ?", (prompt_version,)
+        ).fetchall()
+
+    def weighted_decisions(self) -> List[Tuple[str, str, float]]:
+        """(thread, decision, weight) for every journaled extraction."""
+        return self.con.execute("SELECT thread, decision, weight FROM extractions").fetchall()
+
+    def purge_stale(self, prompt_version: str) -> int:
+        return self.con.execute(
+            "DELETE FROM extractions WHERE prompt_version != ?", (prompt_version,)
+        ).rowcount
+
+    def stats(self) -> Dict[str, object]:
+        by_version = self.con.execute(
+            "SELECT prompt_version, decision, COUNT(*) FROM extractions GROUP BY prompt_version, decision"
+        ).fetchall()
+        return {
+            "entries": sum(count for _, _, count in by_version),
+            "by_version": {f"{version}/{decision}": count for version, decision, count in by_version},
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def default_extraction_cache() -> Optional[ExtractionCache]:
+    """The shared extraction journal, or None when EXTRACTION_CACHE=off."""
+    if not EXTRACTION_CACHE_ENABLED:
+        return None
+    return ExtractionCache()
+
+
+if __name__ == "__main__":
+    store = sys.argv[1] if len(sys.argv) > 1 else "embeddings"
+    command = sys.argv[2] if len(sys.argv) > 2 else "stats"
+    args = sys.argv[3:]
+    cache = {"embeddings": EmbeddingCache, "extractions": ExtractionCache}.get(store)
+    if cache is None:
+        print(__doc__)
+        raise SystemExit(1)
+    cache = cache()
+    if command == "stats":
+        print(cache.stats())
+    elif command == "export":
+        cache.export_to(args[0])
+        print(f"exported to {args[0]}")
+    elif command == "import" and store == "embeddings":
+        print(f"imported {cache.import_from(args[0])} new embeddings")
+    elif command == "prune" and store == "embeddings":
+        max_bytes = int(args[0]) * 1024 * 1024 if args else None
+        cache.evict(max_bytes)
+        cache.con.execute("VACUUM")
+        print(cache.stats())
+    elif command == "purge" and store == "extractions":
+        print(f"removed {cache.purge_stale(args[0])} entries from other prompt versions")
+    else:
+        print(__doc__)
+        raise SystemExit(1)
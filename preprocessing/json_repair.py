@@ -0,0 +1,152 @@
+"""
+Tolerant parsing and schema repair for LLM extraction output.
+
+parse_json_lenient() accepts what models actually return: markdown fences,
+prose around the JSON, trailing commas, Python-style literals and duplicate
+keys (the non-empty value wins). coerce_extraction() then fits the result to
+the extraction SCHEMA, filling missing fields with empty defaults and
+normalising types. Output neither step can rescue raises UnrepairableOutput,
+and so does output cut off mid-object: closing it would turn a half-written
+list ("BO" for "BOE") into a confident answer, so a truncated answer is
+retried or escalated instead.
+"""
+import ast
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+from early_exit import EARLY_EXIT_RESULT
+
+
+STRING_FIELDS = ["prom_request", "prom_considerations", "prom_approval", "approval_evidence", "llm_context"]
+LIST_FIELDS = ["chemicals_mentioned", "processes_mentioned"]
+APPROVAL_VALUES = {"approved", "rejected", "hard_to_tell", ""}
+
+FENCE_RE = re.compile(r"```(?:json|JSON)?\s*(.*?)```", re.DOTALL)
+TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+
+
+class UnrepairableOutput(ValueError):
+    pass
+
+
+class TruncatedOutput(UnrepairableOutput):
+    """The output stops before its JSON closes."""
+
+
+def _prefer_non_empty(pairs):
+    """object_pairs_hook: on duplicate keys keep the first non-empty value."""
+    result = {}
+    for key, value in pairs:
+        if key not in result or (result[key] in ("", [], None) and value not in ("", [], None)):
+            result[key] = value
+    return result
+
+
+def _balanced_span(text: str, start: int) -> str:
+    """The {...} or [...] opening at text[start], string-aware; raises TruncatedOutput if it never closes."""
+    stack, in_string, escaped = [], False, False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+            if not stack:
+                return text[start:i + 1]
+    raise TruncatedOutput(f"model output is truncated: {text[start:start + 120]!r}")
+
+
+def _loads(candidate: str) -> Any:
+    try:
+        return json.loads(candidate, object_pairs_hook=_prefer_non_empty)
+    except json.JSONDecodeError:
+        pass
+    cleaned = TRAILING_COMMA_RE.sub(r"\1", candidate)
+    try:
+        return json.loads(cleaned, object_pairs_hook=_prefer_non_empty)
+    except json.JSONDecodeError:
+        pass
+    # single quotes / True / None: try it as a Python literal
+    pythonish = re.sub(r"\btrue\b", "True", re.sub(r"\bfalse\b", "False", re.sub(r"\bnull\b", "None", cleaned)))
+    try:
+        return ast.literal_eval(pythonish)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        raise UnrepairableOutput(f"could not parse model output: {candidate[:120]!r}")
+
+
+def parse_json_lenient(text: Optional[str]) -> Any:
+    if not text or not text.strip():
+        raise UnrepairableOutput("empty model output")
+    fenced = FENCE_RE.search(text)
+    if fenced:
+        text = fenced.group(1)
+    try:
+        return json.loads(text, object_pairs_hook=_prefer_non_empty)
+    except json.JSONDecodeError:
+        pass
+    starts = sorted(i for i in (text.find("{"), text.find("[")) if i >= 0)
+    if not starts:
+        raise UnrepairableOutput(f"no JSON in model output: {text[:120]!r}")
+    error = None
+    # prose before the JSON may contain a stray bracket pair, so try both openers;
+    # an opener that never closes holds everything after it, so a later opener
+    # would only find a fragment of the cut-off answer
+    for start in starts:
+        span = _balanced_span(text, start)
+        try:
+            return _loads(span)
+        except UnrepairableOutput as e:
+            error = e
+    raise error
+
+
+def _as_string(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        return "\n".join(str(v) for v in value if v is not None)
+    return str(value)
+
+
+def _as_string_list(value: Any) -> List[str]:
+    if value is None or value == "":
+        return []
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, list):
+        return list(dict.fromkeys(str(v) for v in value if v not in (None, "")))
+    raise UnrepairableOutput(f"expected a list of strings, got {type(value).__name__}")
+
+
+def coerce_extraction(obj: Any) -> Dict[str, Any]:
+    """Fit a parsed object to the extraction SCHEMA; extra keys are dropped."""
+    if isinstance(obj, list) and len(obj) == 1:
+        obj = obj[0]
+    if not isinstance(obj, dict):
+        raise UnrepairableOutput(f"expected a JSON object, got {type(obj).__name__}")
+    # defaulting these would silently turn a broken answer into an off-topic one
+    if "prom_request" not in obj and not all(field in obj for field in LIST_FIELDS):
+        raise UnrepairableOutput("prom_request and the chemical/process lists are all missing")
+    result = dict(EARLY_EXIT_RESULT)
+    for field in STRING_FIELDS:
+        result[field] = _as_string(obj.get(field))
+    for field in LIST_FIELDS:
+        result[field] = _as_string_list(obj.get(field))
+    approval = result["prom_approval"].strip().lower()
+    result["prom_approval"] = approval if approval in APPROVAL_VALUES else "hard_to_tell"
+    return result
+
+
+def repair_extraction(text: Optional[str]) -> Dict[str, Any]:
+    return coerce_extraction(parse_json_lenient(text))
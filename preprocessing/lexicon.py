@@ -0,0 +1,91 @@
+"""
+Curated vocabularies for the SNF PROM corpus.
+
+CHEMICAL_NAMES and PROCESSES are matched case-insensitively on word
+boundaries. CHEMICAL_FORMULAS are matched case-sensitively, since "Ti",
+"Au" or "HF" in lower case are ordinary English fragments.
+
+AMBIGUOUS_TERMS are lexicon entries that are just as often everyday words,
+names or abbreviations ("develop", "gold", "He", "SAM"). They still count
+as lexicon hits for the pre-filter, but only the LLM decides whether a
+thread uses them chemically: they are never prefilled as verbatim mentions.
+"""
+
+CHEMICAL_NAMES = [
+    # acids, bases, oxidizers
+    "hydrofluoric acid", "buffered oxide etch", "BOE", "piranha", "sulfuric acid", "hydrogen peroxide",
+    "hydrochloric acid", "nitric acid", "phosphoric acid", "acetic acid", "aqua regia", "potassium hydroxide",
+    "sodium hydroxide", "ammonium hydroxide", "TMAH", "tetramethylammonium hydroxide", "ceric ammonium nitrate",
+    "chromium etchant", "gold etchant", "aluminum etchant", "nanostrip", "RCA clean", "SC1", "SC2",
+    # solvents
+    "acetone", "isopropanol", "isopropyl alcohol", "IPA", "methanol", "ethanol", "toluene", "xylene",
+    "chlorobenzene", "anisole", "NMP", "N-methyl-2-pyrrolidone", "PGMEA", "DMSO", "dimethyl sulfoxide",
+    "chloroform", "dichloromethane", "hexane", "ethyl lactate", "Remover PG", "PRS-1000",
+    # resists and lithography chemistry
+    "photoresist", "resist", "SU-8", "PMMA", "ZEP", "HSQ", "HMDS", "LOR", "PMGI", "Shipley", "SPR 3612",
+    "SPR 220", "AZ 4620", "AZ 5214", "AZ 1518", "MEGAPOSIT", "MF-26A", "MF-319", "developer", "polyimide",
+    "BCB", "benzocyclobutene", "PDMS", "parylene", "epoxy", "adhesion promoter",
+    # gases and precursors
+    "silane", "disilane", "ammonia", "nitrous oxide", "sulfur hexafluoride", "xenon difluoride",
+    "trimethylaluminum", "TMA", "TEOS", "TDMAT", "TDMAH", "TEMAH", "diethylzinc", "DEZ", "borane",
+    "phosphine", "arsine", "diborane", "germane", "dichlorosilane", "tungsten hexafluoride", "ozone",
+    "argon", "nitrogen", "oxygen", "hydrogen", "helium", "chlorine", "boron trichloride",
+    "hydrogen bromide", "tetrafluoromethane", "fluoroform", "octafluorocyclobutane",
+    # materials
+    "gold", "platinum", "titanium", "chromium", "aluminum", "copper", "nickel", "tungsten", "molybdenum",
+    "tantalum", "palladium", "silver", "cobalt", "germanium", "indium", "gallium", "zinc oxide",
+    "indium tin oxide", "ITO", "silicon nitride", "silicon dioxide", "silicon carbide", "gallium arsenide",
+    "gallium nitride", "indium phosphide", "lithium niobate", "sapphire", "graphene", "carbon nanotubes",
+    "quantum dots", "nanoparticles", "perovskite", "hafnium oxide", "alumina", "aluminum oxide",
+    "titanium dioxide", "PZT", "polymer", "solder", "slurry", "metal salt", "powder",
+]
+
+CHEMICAL_FORMULAS = [
+    "HF", "H2SO4", "H2O2", "HCl", "HNO3", "H3PO4", "KOH", "NaOH", "NH4OH", "NH4F", "HBr", "HI",
+    "SF6", "CF4", "CHF3", "C4F8", "C4F6", "CH2F2", "NF3", "XeF2", "Cl2", "BCl3", "SiCl4", "O2", "N2", "N2O",
+    "NH3", "H2", "Ar", "He", "SiH4", "Si2H6", "GeH4", "B2H6", "PH3", "AsH3", "WF6", "TiCl4", "O3", "CH4",
+    "Au", "Pt", "Ti", "Cr", "Al", "Cu", "Ni", "Pd", "Ag", "Ta", "Mo", "Co", "Ge", "Zn",
+    "SiO2", "Si3N4", "SiN", "SiC", "Al2O3", "HfO2", "ZrO2", "TiO2", "TiN", "TaN", "ZnO", "MoS2", "WSe2",
+    "GaAs", "GaN", "InP", "InAs", "AlN", "LiNbO3", "ITO", "PZT",
+]
+
+PROCESSES = [
+    "ALD", "atomic layer deposition", "PECVD", "LPCVD", "CVD", "MOCVD", "chemical vapor deposition",
+    "RIE", "DRIE", "ICP", "reactive ion etch", "deep reactive ion etch", "wet etch", "dry etch", "plasma etch",
+    "vapor etch", "XeF2 etch", "HF vapor", "Bosch process", "lift-off", "liftoff",
+    "photolithography", "lithography", "e-beam lithography", "electron beam lithography", "EBL",
+    "nanoimprint", "exposure", "spin coat", "spin coating", "spin-coat", "soft bake", "hard bake", "bake",
+    "develop", "descum", "strip", "ashing", "plasma clean", "wet clean", "RCA clean", "solvent clean",
+    "anneal", "annealing", "RTA", "rapid thermal anneal", "oxidation", "diffusion", "doping",
+    "ion implantation", "sputter", "sputtering", "evaporation", "e-beam evaporation", "thermal evaporation",
+    "electroplating", "plating", "electroless plating", "CMP", "polishing", "dicing", "wafer bonding",
+    "wire bonding", "packaging", "metrology", "ellipsometry", "profilometry", "SEM", "AFM", "XRD",
+    "drop cast", "dip coating", "spray coating", "inkjet printing", "self-assembled monolayer", "SAM",
+    "sonication", "critical point drying", "release",
+]
+
+AMBIGUOUS_TERMS = {
+    # everyday English
+    "resist", "developer", "polymer", "powder", "metal salt", "solder", "slurry", "epoxy",
+    "gold", "silver", "copper", "nitrogen", "oxygen", "hydrogen", "argon", "helium", "ozone",
+    "develop", "exposure", "strip", "bake", "release", "packaging", "diffusion", "polishing", "plating",
+    # formulas and acronyms that collide with pronouns, greetings, names and abbreviations
+    "He", "Co", "HI", "Al", "Mo", "Ta", "SAM",
+}
+
+# phrases that show up in PROM requests and committee replies
+PROM_CUES = [
+    "PROM", "new chemical", "new material", "chemical request", "material request", "MSDS", "SDS",
+    "CAS", "safety data sheet", "storage group", "waste disposal", "dispose", "process flow",
+    "vendor", "manufacturer", "amount and form", "contamination", "compatible", "compatibility",
+    "approved", "approve", "approval", "rejected", "committee", "wet bench", "fume hood", "toxic",
+    "flammable", "corrosive", "hazard",
+]
+
+# scheduling, tours, announcements and other list traffic
+OFF_TOPIC_CUES = [
+    "tour", "lab tour", "schedule", "reschedule", "meeting", "agenda", "seminar", "workshop", "webinar",
+    "announcement", "newsletter", "reminder", "training", "orientation", "holiday", "lunch",
+    "out of office", "vacation", "unsubscribe", "mailing list", "calendar", "zoom", "conference room",
+    "badge", "key card", "parking", "survey",
+]
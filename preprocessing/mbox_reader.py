@@ -0,0 +1,169 @@
+"""
+Memory-mapped mbox reader.
+
+The archive is opened and mapped once. Message boundaries come from one
+bytes-level regex scan for envelope lines ("From " at a line start), and only
+each message's header block (up to the first blank line) is decoded to read
+its Message-ID, References and In-Reply-To. Message bodies stay in the map:
+message() hands out a memoryview slice without copying, and get_email()
+decodes just that slice, so only the messages a caller actually uses are ever
+decoded.
+
+Offsets are byte offsets into the file, the same values the text-mode
+parser's f.tell() produced, so msg_start / msg_end stay interchangeable with
+get_email_by_msgid().
+"""
+import mmap
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+
+FROM_LINE_RE = re.compile(rb"^From\s", re.MULTILINE)
+BLANK_LINE_RE = re.compile(rb"^[ \t\r\f\v]*$", re.MULTILINE)
+NEWLINE_RE = re.compile(r"\r\n|\r|\n")
+
+MSGID_RE = re.compile(r"^Message-ID:\s*<([^>]+)>", re.IGNORECASE)
+IN_REPLY_TO_RE = re.compile(r"^In-Reply-To:", re.IGNORECASE)
+ANGLE_RE = re.compile(r"<([^>]+)>")
+
+
+def header_ids(lines: List[str]) -> Tuple[Optional[str], List[str]]:
+    """
+    (Message-ID, references) from one message's header lines. References come
+    first, then In-Reply-To unless References already ends with it; folded
+    continuation lines (leading whitespace or a bare "<id>") extend whichever
+    of the two headers they follow.
+    """
+    msgid = None
+    refs: List[str] = []
+    reply_to: List[str] = []
+    continuing: Optional[List[str]] = None
+    for line in lines:
+        if not line:
+            continue
+        if line.startswith("References:"):
+            refs.extend(ANGLE_RE.findall(line))
+            continuing = refs
+            continue
+        if IN_REPLY_TO_RE.match(line):
+            reply_to = ANGLE_RE.findall(line)
+            continuing = reply_to
+            continue
+        if line[0] in " \t<" and continuing is not None and "https" not in line:
+            continuing.extend(ANGLE_RE.findall(line))
+            continue
+        continuing = None
+        m = MSGID_RE.match(line)
+        if m and msgid is None:
+            msgid = m.group(1)
+    for parent in reply_to[:1]:
+        if not refs or refs[-1] != parent:
+            refs.append(parent)
+    return msgid, refs
+
+
+def decode(data) -> str:
+    """bytes or memoryview -> str, with newlines normalized the way text-mode reads did."""
+    text = str(data, "utf-8", "replace")
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+
+class MboxReader:
+    """
+    One open, mapped mbox archive. index() returns the same
+    (msg_refs, msg_start, msg_end, msg_order) as the old line-by-line parser.
+    Use as a context manager; memoryviews from message() must be dropped
+    before close() can unmap the file (otherwise the map lives until they are).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        if os.fstat(self._file.fileno()).st_size:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            # an empty file cannot be mapped
+            self._map = b""
+        self.msg_refs: Dict[str, List[str]] = {}
+        self.msg_start: Dict[str, int] = {}
+        self.msg_end: Dict[str, int] = {}
+        self.msg_order: List[str] = []
+        self._indexed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            try:
+                self._map.close()
+            except BufferError:
+                # slices are still referenced; the map is released with them
+                pass
+        self._file.close()
+
+    def boundaries(self) -> List[int]:
+        """Start offset of every message; text before the first envelope line counts as one."""
+        starts = [m.start() for m in FROM_LINE_RE.finditer(self._map)]
+        if len(self._map) and (not starts or starts[0] != 0):
+            starts.insert(0, 0)
+        return starts
+
+    def index(self) -> Tuple[Dict[str, List[str]], Dict[str, int], Dict[str, int], List[str]]:
+        if not self._indexed:
+            data = self._map
+            starts = self.boundaries()
+            for start, end in zip(starts, starts[1:] + [len(data)]):
+                if FROM_LINE_RE.match(data, start):
+                    newline = data.find(b"\n", start, end)
+                    header_start = end if newline < 0 else newline + 1
+                else:
+                    header_start = start
+                blank = BLANK_LINE_RE.search(data, header_start, end)
+                header_end = end if blank is None else blank.start()
+                msgid, refs = header_ids(NEWLINE_RE.split(decode(data[header_start:header_end])))
+                if msgid is None:
+                    continue
+                self.msg_refs[msgid] = refs
+                self.msg_start[msgid] = start
+                self.msg_end[msgid] = end
+                self.msg_order.append(msgid)
+            self._indexed = True
+        return self.msg_refs, self.msg_start, self.msg_end, self.msg_order
+
+    def message(self, msgid: str) -> Optional[memoryview]:
+        """Zero-copy view of the raw message, envelope line included."""
+        msgid = msgid.strip()
+        if msgid.startswith("<") and msgid.endswith(">"):
+            msgid = msgid[1:-1]
+        self.index()
+        start = self.msg_start.get(msgid)
+        if start is None:
+            return None
+        return memoryview(self._map)[start:self.msg_end[msgid]]
+
+    def get_email(self, msgid: str) -> Optional[str]:
+        """The message as text; same result as get_email_by_msgid() without reopening the file."""
+        view = self.message(msgid)
+        if view is None:
+            return None
+        with view:
+            return decode(view)
+
+    def head_lines(self, msgid: str, n: int = 2) -> List[str]:
+        """The first n lines of a message, stripped, decoding nothing else."""
+        self.index()
+        pos, end = self.msg_start[msgid], self.msg_end[msgid]
+        lines = []
+        for _ in range(n):
+            newline = self._map.find(b"\n", pos, end)
+            stop = end if newline < 0 else newline + 1
+            lines.append(decode(self._map[pos:stop]).strip())
+            pos = stop
+        return lines
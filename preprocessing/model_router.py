@@ -0,0 +1,110 @@
+"""
+Per-thread model routing for email extraction.
+
+Tiers are ordered cheapest first and configured with EXTRACTION_MODEL_TIERS,
+e.g. "gpt-4.omini:0.15:0.60,gpt-4o:2.50:10.00" (model[:input $/1M tokens
+:output $/1M tokens]). Each thread scores one point per complexity signal
+(long thread, many messages, several reviewer replies, a pre-filter score
+in the ambiguous band while reviewers replied) and goes to the tier with that
+index, capped at the largest. A thread whose answer fails validation is
+escalated one tier up.
+
+Latency, estimated tokens/cost and escalations are tracked per tier.
+"""
+import os
+import statistics
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+
+@dataclass(frozen=True)
+class Tier:
+    model: str
+    input_price: float = 0.0
+    output_price: float = 0.0
+
+
+def parse_tiers(spec: str) -> List[Tier]:
+    tiers = []
+    for entry in spec.split(","):
+        parts = entry.strip().split(":")
+        if not parts[0]:
+            continue
+        prices = [float(p) for p in parts[1:3]]
+        prices += [0.0] * (2 - len(prices))
+        tiers.append(Tier(parts[0], prices[0], prices[1]))
+    return tiers
+
+
+EXTRACTION_MODEL_TIERS = parse_tiers(os.getenv("EXTRACTION_MODEL_TIERS", "gpt-4.omini:0.15:0.60,gpt-4o:2.50:10.00"))
+ROUTER_LARGE_MIN_TOKENS = int(os.getenv("ROUTER_LARGE_MIN_TOKENS", "4000"))
+ROUTER_LARGE_MIN_MESSAGES = int(os.getenv("ROUTER_LARGE_MIN_MESSAGES", "6"))
+ROUTER_LARGE_MIN_REPLIES = int(os.getenv("ROUTER_LARGE_MIN_REPLIES", "3"))
+ROUTER_AMBIGUOUS_SCORE = tuple(float(x) for x in os.getenv("ROUTER_AMBIGUOUS_SCORE", "0.2,0.6").split(","))
+
+
+class ModelRouter:
+    def __init__(self, tiers: List[Tier] = EXTRACTION_MODEL_TIERS):
+        if not tiers:
+            raise ValueError("EXTRACTION_MODEL_TIERS must name at least one model")
+        self.tiers = tiers
+        self.latencies: Dict[int, List[float]] = {i: [] for i in range(len(tiers))}
+        self.routed = [0] * len(tiers)
+        self.escalations = [0] * len(tiers)
+        self.prompt_tokens = [0] * len(tiers)
+        self.completion_tokens = [0] * len(tiers)
+
+    def route(
+        self,
+        tokens: int,
+        message_count: Optional[int] = None,
+        reviewer_replies: Optional[int] = None,
+        prefilter_score: Optional[float] = None,
+    ) -> int:
+        """Index of the tier for a thread with these features."""
+        points = 0
+        if tokens >= ROUTER_LARGE_MIN_TOKENS:
+            points += 1
+        if message_count is not None and message_count >= ROUTER_LARGE_MIN_MESSAGES:
+            points += 1
+        if reviewer_replies is not None and reviewer_replies >= ROUTER_LARGE_MIN_REPLIES:
+            points += 1
+        low, high = ROUTER_AMBIGUOUS_SCORE
+        if prefilter_score is not None and low <= prefilter_score <= high and reviewer_replies:
+            points += 1
+        tier = min(points, len(self.tiers) - 1)
+        self.routed[tier] += 1
+        return tier
+
+    def escalate(self, tier: int) -> Optional[int]:
+        """The next tier up after a validation failure, or None at the top."""
+        if tier + 1 >= len(self.tiers):
+            return None
+        self.escalations[tier] += 1
+        return tier + 1
+
+    def model(self, tier: int) -> str:
+        return self.tiers[tier].model
+
+    def record(self, tier: int, latency: float, prompt_tokens: int, completion_tokens: int):
+        self.latencies[tier].append(latency)
+        self.prompt_tokens[tier] += prompt_tokens
+        self.completion_tokens[tier] += completion_tokens
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        report = {}
+        for i, tier in enumerate(self.tiers):
+            latencies = sorted(self.latencies[i])
+            cost = (self.prompt_tokens[i] * tier.input_price + self.completion_tokens[i] * tier.output_price) / 1e6
+            report[tier.model] = {
+                "routed": self.routed[i],
+                "calls": len(latencies),
+                "escalated_up": self.escalations[i],
+                "p50": round(statistics.median(latencies), 3) if latencies else None,
+                "p90": round(latencies[int(len(latencies) * 0.9)], 3) if latencies else None,
+                "p99": round(latencies[int(len(latencies) * 0.99)], 3) if latencies else None,
+                "est_prompt_tokens": self.prompt_tokens[i],
+                "est_completion_tokens": self.completion_tokens[i],
+                "est_cost_usd": round(cost, 4),
+            }
+        return report
@@ -1,6 +1,210 @@
+import os
 from dataclasses import asdict, dataclass, replace
-from typing import Optional, List
+from typing import Optional, List, Tuple
 import psycopg2
+from psycopg2.extras import execute_values
+from database.pg import PROM_CONTENT_FIELDS, prom_content_hash
+from database.vectors import as_vector
+
+# rows per multi-row INSERT, and how many of those statements share one commit
+INSERT_BATCH_SIZE = int(os.getenv("DB_INSERT_BATCH_SIZE", "500"))
+COMMIT_EVERY_BATCHES = int(os.getenv("DB_COMMIT_EVERY_BATCHES", "4"))
+
+EMAIL_COLUMNS = ("date", "filename", "requestor", "prom_approval", "prom_considerations", "chemicals", "processes", "thread_id", "embedding")
+EMAIL_TEXT_COLUMNS = ("llm_context", "raw_thread", "embedded_string")
+EMAIL_CONFLICT_KEY = ("date", "filename", "requestor", "chemicals", "processes")
+PROM_COLUMNS = ("date", "filename", "requestor", "request_title", "chemicals_and_processes", "request_reason", "process_flow", "amount_and_form", "staff_considerations", "content_hash", "near_duplicate_of", "request_embedding", "process_embedding")
+PROM_TEXT_COLUMNS = ("raw_prom", "embedded_string", "minhash", "lsh_bands")
+PROM_CONFLICT_KEY = ("date", "requestor", "request_title")
+
+
+@dataclass(frozen=True)
+class TableSpec:
+    """A narrow vector table and the side table holding its bulky text, keyed by id_column."""
+    table: str
+    id_column: str
+    columns: Tuple[str, ...]
+    conflict_key: Tuple[str, ...]
+    text_table: str
+    text_columns: Tuple[str, ...]
+
+
+EMAIL_TABLE = TableSpec("email_embeddings", "email_id", EMAIL_COLUMNS, EMAIL_CONFLICT_KEY, "email_texts", EMAIL_TEXT_COLUMNS)
+PROM_TABLE = TableSpec("prom_embeddings", "prom_id", PROM_COLUMNS, PROM_CONFLICT_KEY, "prom_texts", PROM_TEXT_COLUMNS)
+
+
+def insert_rows(
+    con,
+    spec: TableSpec,
+    rows: List[tuple],
+    text_rows: List[tuple],
+    batch_size: int = INSERT_BATCH_SIZE,
+    commit_every: int = COMMIT_EVERY_BATCHES,
+) -> List[str]:
+    """
+    Multi-row INSERT ... ON CONFLICT DO NOTHING, batch_size rows per statement and
+    one commit per commit_every statements (and at the end); commit_every=0 leaves
+    committing to the caller. Returns "inserted" or "duplicate" per row, in order:
+    RETURNING gives back the id and conflict key of every row that went in, and
+    each returned key claims the first row carrying it. The text_rows of inserted
+    rows then go into the side table under those ids, in the same transaction.
+    """
+    key_positions = [spec.columns.index(c) for c in spec.conflict_key]
+    sql = (
+        f"INSERT INTO {spec.table} ({', '.join(spec.columns)}) VALUES %s "
+        f"ON CONFLICT ({', '.join(spec.conflict_key)}) DO NOTHING "
+        f"RETURNING {spec.id_column}, {', '.join(spec.conflict_key)}"
+    )
+    text_sql = f"INSERT INTO {spec.text_table} ({spec.id_column}, {', '.join(spec.text_columns)}) VALUES %s"
+    outcomes = []
+    cursor = con.cursor()
+    for batch_number, start in enumerate(range(0, len(rows), batch_size), start=1):
+        batch = rows[start:start + batch_size]
+        returned = execute_values(cursor, sql, batch, page_size=len(batch), fetch=True)
+        inserted_ids = {}
+        for row_id, *key in returned:
+            inserted_ids.setdefault(tuple(key), []).append(row_id)
+        texts = []
+        for row, text_row in zip(batch, text_rows[start:start + batch_size]):
+            ids = inserted_ids.get(tuple(row[i] for i in key_positions))
+            if ids:
+                texts.append((ids.pop(0),) + tuple(text_row))
+                outcomes.append("inserted")
+            else:
+                outcomes.append("duplicate")
+        if texts:
+            execute_values(cursor, text_sql, texts, page_size=len(texts))
+        if commit_every and batch_number % commit_every == 0:
+            con.commit()
+    if commit_every:
+        con.commit()
+    return outcomes
+
+
+def insert_emails(con, emails: List["Email"], batch_size: int = INSERT_BATCH_SIZE, commit_every: int = COMMIT_EVERY_BATCHES) -> List[str]:
+    return insert_rows(con, EMAIL_TABLE, [e.row() for e in emails], [e.text_row() for e in emails], batch_size, commit_every)
+
+
+def insert_proms(con, proms: List["PromForm"], batch_size: int = INSERT_BATCH_SIZE, commit_every: int = COMMIT_EVERY_BATCHES) -> List[str]:
+    return insert_rows(con, PROM_TABLE, [p.row() for p in proms], [p.text_row() for p in proms], batch_size, commit_every)
+
+
+def find_existing_proms(con, proms: List["PromForm"]) -> List[bool]:
+    """
+    Whether each form is already in prom_embeddings, by normalized (date,
+    requestor, request_title) or by content hash, in one round trip. Lets the
+    pipeline skip re-uploads before paying for their embeddings.
+    """
+    if not proms:
+        return []
+    values = [(idx, *(p.normalized_key() or (None, None, None)), p.content_hash()) for idx, p in enumerate(proms)]
+    cursor = con.cursor()
+    # two EXISTS rather than one OR so each side can use its own index
+    present = execute_values(
+        cursor,
+        f"""
+        SELECT v.idx FROM (VALUES %s) AS v (idx, date_key, requestor_key, title_key, content_hash)
+        WHERE EXISTS (
+            SELECT 1 FROM {PROM_TABLE.table} p
+            WHERE lower(btrim(p.date)) = v.date_key
+              AND lower(btrim(p.requestor)) = v.requestor_key
+              AND lower(btrim(p.request_title)) = v.title_key
+        )
+        OR EXISTS (SELECT 1 FROM {PROM_TABLE.table} p WHERE p.content_hash = v.content_hash)
+        """,
+        values,
+        page_size=len(values),
+        fetch=True,
+    )
+    found = {idx for (idx,) in present}
+    return [idx in found for idx in range(len(proms))]
+
+
+class BatchWriter:
+    """
+    Buffers objects for insert_emails / insert_proms while a pipeline is still
+    producing them. add() writes a batch once batch_size objects are waiting;
+    every commit_every written batches are committed, and close() writes and
+    commits the rest. Both return (tag, outcome) for the objects just committed.
+    A batch that fails rolls back everything since the last commit; those rows
+    are retried one per transaction and the ones that fail again come back
+    "failed" instead of aborting the run.
+    """
+
+    def __init__(self, con, insert, batch_size: int = INSERT_BATCH_SIZE, commit_every: int = COMMIT_EVERY_BATCHES):
+        self.con = con
+        self.insert = insert
+        self.batch_size = batch_size
+        self.commit_every = max(1, commit_every)
+        self._pending: List[Tuple[object, object]] = []
+        self._uncommitted: List[Tuple[object, object, str]] = []
+        self.batches = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.failed = 0
+
+    def add(self, obj, tag=None) -> List[Tuple[object, str]]:
+        self._pending.append((tag, obj))
+        if len(self._pending) >= self.batch_size:
+            return self.flush()
+        return []
+
+    def flush(self) -> List[Tuple[object, str]]:
+        if not self._pending:
+            return []
+        pending, self._pending = self._pending, []
+        try:
+            outcomes = self.insert(self.con, [obj for _, obj in pending], batch_size=self.batch_size, commit_every=0)
+        except Exception as e:
+            rows = [(tag, obj) for tag, obj, _ in self._uncommitted] + pending
+            self._uncommitted = []
+            self._rollback()
+            print(f"insert batch failed ({type(e).__name__}: {e}), retrying {len(rows)} rows one by one")
+            return self._insert_one_by_one(rows)
+        self.batches += 1
+        self._uncommitted.extend((tag, obj, outcome) for (tag, obj), outcome in zip(pending, outcomes))
+        if self.batches % self.commit_every == 0:
+            return self.commit()
+        return []
+
+    def commit(self) -> List[Tuple[object, str]]:
+        self.con.commit()
+        written, self._uncommitted = self._uncommitted, []
+        return self._record([(tag, outcome) for tag, _, outcome in written])
+
+    def close(self) -> List[Tuple[object, str]]:
+        written = self.flush()
+        return written + self.commit()
+
+    def _insert_one_by_one(self, rows: List[Tuple[object, object]]) -> List[Tuple[object, str]]:
+        written = []
+        for tag, obj in rows:
+            try:
+                outcome = self.insert(self.con, [obj], batch_size=1, commit_every=0)[0]
+                self.con.commit()
+            except Exception as e:
+                self._rollback()
+                print(f"insert failed: {type(e).__name__}: {e}")
+                outcome = "failed"
+            written.append((tag, outcome))
+        return self._record(written)
+
+    def _rollback(self):
+        try:
+            self.con.rollback()
+        except psycopg2.Error as e:
+            print(f"rollback failed: {e}")
+
+    def _record(self, written: List[Tuple[object, str]]) -> List[Tuple[object, str]]:
+        outcomes = [outcome for _, outcome in written]
+        self.inserted += outcomes.count("inserted")
+        self.duplicates += outcomes.count("duplicate")
+        self.failed += outcomes.count("failed")
+        return written
+
+    def stats(self):
+        return {"batches": self.batches, "inserted": self.inserted, "duplicates": self.duplicates, "failed": self.failed}
+
 
 @dataclass(frozen=True)
 class Email:
@@ -15,17 +219,23 @@ class Email:
     llm_context: Optional[str] = None
     embedded_string: Optional[str] = None
     embedding: Optional[list[float]] = None
+    # root Message-ID, the key of the thread manifest
+    thread_id: Optional[str] = None
+    # routing features, not stored
+    message_count: Optional[int] = None
+    reviewer_replies: Optional[int] = None
+
+
+    def row(self) -> tuple:
+        """Values in EMAIL_COLUMNS order."""
+        return (self.date, self.filepath, self.requestor, self.prom_approval, self.prom_considerations, self.chemicals, self.processes, self.thread_id, as_vector(self.embedding))
 
+    def text_row(self) -> tuple:
+        """Values in EMAIL_TEXT_COLUMNS order."""
+        return (self.llm_context, self.raw_thread, self.embedded_string)
 
     def insert_email(self, con):
-        cursor = con.cursor()
-        cursor.execute("""
-        INSERT INTO email_embeddings (date, filename, requestor, prom_approval, prom_considerations, chemicals, processes, llm_context, raw_thread, embedded_string, embedding)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        ON CONFLICT (date, filename, requestor, chemicals, processes) DO NOTHING
-        """, (self.date, self.filepath, self.requestor, self.prom_approval, self.prom_considerations, self.chemicals, self.processes, self.llm_context, self.raw_thread, self.embedded_string, self.embedding))
-        con.commit()
-        return cursor.rowcount
+        return insert_emails(con, [self], commit_every=1).count("inserted")
 
 @dataclass(frozen=True)
 class PromForm:
@@ -42,17 +252,32 @@ class PromForm:
     embedded_string: Optional[str] = None
     request_embedding: Optional[list[float]] = None
     process_embedding: Optional[list[float]] = None
+    # near_dup.py: prom_id of the stored form this one nearly copies, and its MinHash/LSH index entries
+    near_duplicate_of: Optional[int] = None
+    minhash: Optional[list[int]] = None
+    lsh_bands: Optional[list[int]] = None
+
 
+    def row(self) -> tuple:
+        """Values in PROM_COLUMNS order."""
+        return (self.date, self.filename, self.requestor, self.request_title, self.chemicals_and_processes, self.request_reason, self.process_flow, self.amount_and_form, self.staff_considerations, self.content_hash(), self.near_duplicate_of, as_vector(self.request_embedding), as_vector(self.process_embedding))
+
+    def text_row(self) -> tuple:
+        """Values in PROM_TEXT_COLUMNS order."""
+        return (self.raw_prom, self.embedded_string, self.minhash, self.lsh_bands)
+
+    def normalized_key(self) -> Optional[Tuple[str, str, str]]:
+        """(date, requestor, request_title) stripped and lowercased; None if any is missing."""
+        if self.date is None or self.requestor is None or self.request_title is None:
+            return None
+        return (self.date.strip().lower(), self.requestor.strip().lower(), self.request_title.strip().lower())
+
+    def content_hash(self) -> str:
+        """database.pg.prom_content_hash of PROM_CONTENT_FIELDS."""
+        return prom_content_hash([getattr(self, field) for field in PROM_CONTENT_FIELDS])
 
     def insert_prom(self, con):
-        cursor = con.cursor()
-        cursor.execute("""
-        INSERT INTO prom_embeddings (date, filename, requestor, request_title, chemicals_and_processes, request_reason, process_flow, amount_and_form, staff_considerations, raw_prom, embedded_string, request_embedding, process_embedding)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        ON CONFLICT (date, requestor, request_title) DO NOTHING
-        """, (self.date, self.filename, self.requestor, self.request_title, self.chemicals_and_processes, self.request_reason, self.process_flow, self.amount_and_form, self.staff_considerations, self.raw_prom, self.embedded_string, self.request_embedding, self.process_embedding))
-        con.commit()
-        return cursor.rowcount
+        return insert_proms(con, [self], commit_every=1).count("inserted")
 
     def is_empty(self) -> List[str]:
         return [field for field, value in asdict(self).items() if not value]
\ No newline at end of file
@@ -0,0 +1,221 @@
+"""
+Near-duplicate PROM detection with MinHash signatures and LSH banding.
+
+Researchers often resubmit a lightly edited copy of an earlier form (new
+date, fixed typo), which the exact key / content-hash lookup misses. Each
+form's text is cut into word shingles and summarised by a NUM_PERM-value
+MinHash signature; the signature is split into LSH_BANDS bands of
+LSH_ROWS values, and every band is hashed into one bucket id. Signatures and
+bucket ids live in prom_texts (minhash, lsh_bands) with a GIN index on
+lsh_bands, so candidates are the stored forms sharing any bucket (array
+overlap), and a candidate is a near-duplicate when its estimated Jaccard
+similarity reaches NEAR_DUP_THRESHOLD. With 16 bands of 8 rows a pair at 0.8
+similarity becomes a candidate ~95% of the time, a pair at 0.5 ~6%.
+
+A near-duplicate is still inserted, linked to the stored form through
+prom_embeddings.near_duplicate_of, and reuses that form's request/process
+embeddings whenever its build_embed_string output / process_flow is unchanged.
+
+CLI:
+    python preprocessing/near_dup.py index     # sign stored forms that have no signature yet
+"""
+import hashlib
+import json
+import os
+import random
+import re
+import struct
+import sys
+from dataclasses import dataclass, replace
+from typing import Dict, List, Optional
+
+from psycopg2.extras import execute_values
+
+
+NEAR_DUP_ENABLED = os.getenv("NEAR_DUP", "on").lower() not in ("0", "off", "false")
+NEAR_DUP_THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD", "0.8"))
+
+NUM_PERM = 128
+LSH_BANDS = 16
+LSH_ROWS = NUM_PERM // LSH_BANDS
+SHINGLE_WORDS = 3
+
+# the form body, without date/requestor, so a re-dated resubmission still matches
+SIGNED_FIELDS = ("request_title", "chemicals_and_processes", "request_reason", "process_flow", "amount_and_form", "staff_considerations")
+
+_MERSENNE_PRIME = (1 << 61) - 1
+# fixed seed: signatures are stored, so the permutations must never change
+_rng = random.Random(1)
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME)) for _ in range(NUM_PERM)]
+
+WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+@dataclass(frozen=True)
+class NearDuplicate:
+    """A stored form a new one nearly copies, with what is needed to reuse its embeddings."""
+    prom_id: int
+    similarity: float
+    embedded_string: Optional[str] = None
+    process_flow: Optional[str] = None
+    request_embedding: Optional[List[float]] = None
+    process_embedding: Optional[List[float]] = None
+
+
+def prom_text(prom_form) -> str:
+    """raw_prom when the extractor kept it, otherwise the cleaned form fields."""
+    if prom_form.raw_prom:
+        return prom_form.raw_prom
+    return "\n".join(getattr(prom_form, field) or "" for field in SIGNED_FIELDS)
+
+
+def shingles(text: str) -> set:
+    words = WORD_RE.findall(text.lower())
+    if len(words) < SHINGLE_WORDS:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+
+def _shingle_hash(shingle: str) -> int:
+    return int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def minhash_signature(text: str) -> Optional[List[int]]:
+    """NUM_PERM minimum hashes (all < 2**61, so they fit BIGINT); None for text without words."""
+    hashes = [_shingle_hash(s) for s in shingles(text)]
+    if not hashes:
+        return None
+    return [min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in _PERMUTATIONS]
+
+
+def lsh_bands(signature: List[int]) -> List[int]:
+    """One signed 64-bit bucket id per band; the band number is hashed in, so buckets never collide across bands."""
+    buckets = []
+    for band in range(LSH_BANDS):
+        rows = signature[band * LSH_ROWS:(band + 1) * LSH_ROWS]
+        digest = hashlib.blake2b(struct.pack(f"!H{LSH_ROWS}Q", band, *rows), digest_size=8).digest()
+        buckets.append(int.from_bytes(digest, "big", signed=True))
+    return buckets
+
+
+def estimated_jaccard(a: List[int], b: List[int]) -> float:
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+def with_signature(prom_form):
+    """The form with its minhash and lsh_bands filled in (left None for an empty form)."""
+    signature = minhash_signature(prom_text(prom_form))
+    if signature is None:
+        return prom_form
+    return replace(prom_form, minhash=signature, lsh_bands=lsh_bands(signature))
+
+
+def parse_vector(value) -> Optional[List[float]]:
+    """A vector/halfvec column as read back without a registered pgvector type: '[0.1,...]'."""
+    if value is None or isinstance(value, list):
+        return value
+    return json.loads(value)
+
+
+def find_near_duplicates(con, prom_forms: List, threshold: float = NEAR_DUP_THRESHOLD) -> List[Optional[NearDuplicate]]:
+    """
+    The most similar stored form at or above threshold for each signed form,
+    else None. One query collects every LSH candidate of the batch, one more
+    fetches the chosen forms' embeddings and embed inputs.
+    """
+    matches: List[Optional[NearDuplicate]] = [None] * len(prom_forms)
+    values = [(idx, p.lsh_bands) for idx, p in enumerate(prom_forms) if p.lsh_bands]
+    if not values:
+        return matches
+    cursor = con.cursor()
+    candidates = execute_values(
+        cursor,
+        """
+        SELECT v.idx, t.prom_id, t.minhash
+        FROM (VALUES %s) AS v (idx, bands)
+        JOIN prom_texts t ON t.lsh_bands && v.bands
+        """,
+        values,
+        template="(%s, %s::bigint[])",
+        page_size=len(values),
+        fetch=True,
+    )
+    best: Dict[int, tuple] = {}
+    for idx, prom_id, signature in candidates:
+        similarity = estimated_jaccard(prom_forms[idx].minhash, signature)
+        if similarity >= threshold and (idx not in best or similarity > best[idx][1]):
+            best[idx] = (prom_id, similarity)
+    if not best:
+        return matches
+    cursor.execute(
+        """
+        SELECT p.prom_id, t.embedded_string, p.process_flow, p.request_embedding, p.process_embedding
+        FROM prom_embeddings p JOIN prom_texts t USING (prom_id)
+        WHERE p.prom_id = ANY(%s)
+        """,
+        (list({prom_id for prom_id, _ in best.values()}),),
+    )
+    stored = {row[0]: row[1:] for row in cursor.fetchall()}
+    for idx, (prom_id, similarity) in best.items():
+        embedded_string, process_flow, request_embedding, process_embedding = stored.get(prom_id, (None,) * 4)
+        matches[idx] = NearDuplicate(
+            prom_id,
+            similarity,
+            embedded_string,
+            process_flow,
+            parse_vector(request_embedding),
+            parse_vector(process_embedding),
+        )
+    return matches
+
+
+def index_existing(con, batch_size: int = 500) -> int:
+    """Sign stored forms that predate near-duplicate detection; returns how many were signed."""
+    from models.insert import PromForm
+
+    cursor = con.cursor()
+    columns = ("raw_prom",) + SIGNED_FIELDS
+    cursor.execute(
+        f"""
+        SELECT prom_id, {', '.join(columns)}
+        FROM prom_embeddings p JOIN prom_texts t USING (prom_id)
+        WHERE t.minhash IS NULL
+        """
+    )
+    rows = cursor.fetchall()
+    signed = 0
+    for start in range(0, len(rows), batch_size):
+        updates = []
+        for prom_id, *fields in rows[start:start + batch_size]:
+            form = PromForm(date=None, filename=None, requestor=None, **dict(zip(columns, fields)))
+            signature = minhash_signature(prom_text(form))
+            if signature is not None:
+                updates.append((prom_id, signature, lsh_bands(signature)))
+        if updates:
+            execute_values(
+                cursor,
+                """
+                UPDATE prom_texts AS t SET minhash = v.minhash, lsh_bands = v.lsh_bands
+                FROM (VALUES %s) AS v (prom_id, minhash, lsh_bands)
+                WHERE t.prom_id = v.prom_id
+                """,
+                updates,
+                template="(%s, %s::bigint[], %s::bigint[])",
+                page_size=len(updates),
+            )
+        con.commit()
+        signed += len(updates)
+    return signed
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] != "index":
+        print(__doc__)
+        raise SystemExit(1)
+    from database.pg import get_db_connection, init_prom_table
+
+    con = init_prom_table(con=get_db_connection())
+    try:
+        print(f"signed {index_existing(con)} stored PROM forms")
+    finally:
+        con.close()
@@ -1,16 +1,13 @@
-from concurrent.futures import thread
+import os
 import re
 import time
 from typing import Dict, List, Tuple, Optional
 from datetime import datetime
 from collections import defaultdict
 from email.header import decode_header, make_header
+from mbox_reader import MboxReader, header_ids
 
 MBOX_FROM_RE = re.compile(r"^From\s")  
-MSGID_RE = re.compile(r"^Message-ID:\s*<([^>]+)>", re.IGNORECASE)
-
-
-ANGLE_RE = re.compile(r"<([^>]+)>")
 
 BANNER = r"""
 /******************************************************************************\
@@ -22,6 +19,19 @@ BANNER = r"""
 
 
 def parse_mbox_threads(file_name: str) -> Tuple[Dict[str, List[str]], Dict[str, int], Dict[str, int], List[str]]:
+    """
+    msg_refs maps each Message-ID to its References followed by its
+    In-Reply-To (when References does not already end with it), plus byte
+    offsets and file order of every message. Only header lines are read for
+    ids, so a forwarded message quoted in a body cannot pose as a new message
+    or a reference.
+    """
+    with MboxReader(file_name) as reader:
+        return reader.index()
+
+
+def parse_mbox_threads_textio(file_name: str) -> Tuple[Dict[str, List[str]], Dict[str, int], Dict[str, int], List[str]]:
+    """The line-by-line text-mode parser MboxReader replaced; kept for bench_email_parsing.py."""
 
     msg_refs: Dict[str, List[str]] = {}
     msg_start: Dict[str, int] = {}
@@ -30,13 +40,18 @@ def parse_mbox_threads(file_name: str) -> Tuple[Dict[str, List[str]], Dict[str,
 
 
     current_start: Optional[int] = None
-    current_msgid: Optional[str] = None
-    current_refs: List[str] = []
+    header_lines: List[str] = []
+    in_headers = False
 
     def close_current(end_pos: int):
-        nonlocal current_start, current_msgid, current_refs
-        if current_msgid is not None and current_start is not None:
-            msg_end[current_msgid] = end_pos
+        if current_start is None:
+            return
+        msgid, refs = header_ids(header_lines)
+        if msgid is not None:
+            msg_refs[msgid] = refs
+            msg_start[msgid] = current_start
+            msg_end[msgid] = end_pos
+            msg_order.append(msgid)
 
 
     with open(file_name, "r", errors="replace") as f:
@@ -50,40 +65,70 @@ def parse_mbox_threads(file_name: str) -> Tuple[Dict[str, List[str]], Dict[str,
 
 
             if MBOX_FROM_RE.match(line) and not line.startswith("From:"):
-                if current_start is not None:
-                    close_current(line_start)
-
-
+                close_current(line_start)
                 current_start = line_start
-                current_msgid = None
-                current_refs = []
+                header_lines = []
+                in_headers = True
                 continue 
 
 
             if current_start is None:
                 current_start = 0
+                in_headers = True
 
-            if "References:" in line:
-                current_refs.extend(ANGLE_RE.findall(line))
-                continue
+            if in_headers:
+                if not line.strip():
+                    in_headers = False
+                else:
+                    header_lines.append(line.rstrip("\n"))
 
-            if line.startswith("<") and "https" not in line:
-                current_refs.extend(ANGLE_RE.findall(line))
-                continue
 
-
-            m = MSGID_RE.match(line)
-            if m:
-                current_msgid = m.group(1)
-                msg_refs[current_msgid] = current_refs.copy()
-                msg_start[current_msgid] = current_start
-                msg_order.append(current_msgid)
-
-
-                continue
+    return msg_refs, msg_start, msg_end, msg_order
 
 
-    return msg_refs, msg_start, msg_end, msg_order
+def build_threads(msg_refs: Dict[str, List[str]], msg_order: List[str]) -> Dict[str, List[str]]:
+    """
+    JWZ-style threading in one pass over the messages: root id -> message ids
+    in file order.
+
+    Each message's parent is the last id in its references; the references
+    themselves are chained oldest to newest, so a parent that is not in the
+    archive (an earlier archive, a deleted mail) still becomes a placeholder
+    that gathers all of its replies. A thread's root may therefore be such a
+    placeholder, and its first message is then the earliest surviving reply.
+    A link is only set once and never to itself; reference cycles are cut when
+    roots are resolved.
+    """
+    parent: Dict[str, str] = {}
+    for msgid in msg_order:
+        chain = [ref for ref in msg_refs.get(msgid, []) if ref != msgid]
+        for older, newer in zip(chain, chain[1:]):
+            if older != newer and newer not in parent and newer not in msg_refs:
+                # only placeholders are linked from someone else's references;
+                # a real message's own headers decide its parent
+                parent[newer] = older
+        if chain:
+            parent[msgid] = chain[-1]
+
+    root_of: Dict[str, str] = {}
+
+    def find_root(node: str) -> str:
+        path = []
+        on_path = set()
+        while node in parent and node not in root_of and node not in on_path:
+            on_path.add(node)
+            path.append(node)
+            node = parent[node]
+        root = root_of.get(node, node)
+        for visited in path:
+            root_of[visited] = root
+        return root
+
+    threads: Dict[str, List[str]] = defaultdict(list)
+    # a Message-ID seen twice (list duplicates) is one message, placed where it first appeared
+    for msgid in dict.fromkeys(msg_order):
+        threads[find_root(msgid)].append(msgid)
+    return dict(threads)
 
 
 def parent_emails(msg_refs: Dict[str, List[str]]) -> List[str]:
@@ -99,48 +144,61 @@ def join_emails_by_root(msg_refs: Dict[str, List[str]], root_msgid: str) -> List
     return thread
 
 
-def create_dict_of_threads(file_name: str):
+def legacy_threads(msg_refs: Dict[str, List[str]], msg_order: List[str]) -> Dict[str, List[str]]:
+    """
+    The original threading: every message without references is a root and
+    collects each message that names it anywhere in its references. Costs
+    O(roots x messages x refs) and drops replies whose root is missing; kept
+    for comparison (bench_email_parsing.py) and THREADING=legacy.
+    """
+    order_pos = {mid: i for i, mid in enumerate(msg_order)}
+    threads = {}
+    for root in parent_emails(msg_refs):
+        thread_ids = join_emails_by_root(msg_refs, root)
+        thread_ids.sort(key=lambda mid: order_pos.get(mid, 10**18))
+        threads[root] = thread_ids
+    return threads
+
+
+THREADING = os.getenv("THREADING", "jwz").lower()
+THREADERS = {"jwz": build_threads, "legacy": legacy_threads}
+
+
+def create_dict_of_threads(file_name: str, threading: str = THREADING, reader: Optional[MboxReader] = None):
+    """
+    Threads keyed by (date, requestor) of their first message, plus
+    thread_roots: first message id -> the thread's root id (a placeholder when
+    the root is not in the archive), which stays the same when an earlier-dated
+    reply turns up later. Pass an open MboxReader to keep using it for the
+    message text afterwards; otherwise one is opened for this call.
+    """
+    if reader is None:
+        with MboxReader(file_name) as own_reader:
+            return create_dict_of_threads(file_name, threading, own_reader)
     dict_of_threads = defaultdict(list)
+    thread_roots = {}
     requestor_names = {}  
-    start = time.perf_counter()
-    msg_refs, msg_start, msg_end, msg_order = parse_mbox_threads(file_name)
-    end = time.perf_counter()
-   
-
-    start = time.perf_counter()
-    roots = parent_emails(msg_refs)
-    end = time.perf_counter()
-    
-
-    order_pos = {mid: i for i, mid in enumerate(msg_order)}
+    msg_refs, msg_start, msg_end, msg_order = reader.index()
 
     start = time.perf_counter()
-    with open(file_name, "r", errors="replace") as f:
-        for root in roots:
-
-            thread_ids = join_emails_by_root(msg_refs, root)
-
-            thread_ids.sort(key=lambda mid: order_pos.get(mid, 10**18))
-            if thread_ids:
-                first_msg_id = thread_ids[0]
-                first_start = msg_start[first_msg_id]
-
-                f.seek(first_start)
-                first_line = f.readline().strip()
-                second_line = f.readline().strip()
-                id_list = format_identifier_line(first_line)
-                requestor_name = extract_name_from_second_line(second_line)
-                
-                if id_list != ("", "") and requestor_name:
-                    requestor_names[id_list] = requestor_name
-                
-                dict_of_threads[id_list].append(thread_ids.copy())
-            else:
-                print("thread_ids empty")
+    threads = THREADERS[threading](msg_refs, msg_order)
+    for root, thread_ids in threads.items():
+        if thread_ids:
+            first_line, second_line = reader.head_lines(thread_ids[0])
+            id_list = format_identifier_line(first_line)
+            requestor_name = extract_name_from_second_line(second_line)
+            
+            if id_list != ("", "") and requestor_name:
+                requestor_names[id_list] = requestor_name
+            
+            dict_of_threads[id_list].append(list(thread_ids))
+            thread_roots[thread_ids[0]] = root
+        else:
+            print("thread_ids empty")
 
     end = time.perf_counter()
     print(f"main loop took {end - start} seconds")
-    return dict_of_threads, msg_start, msg_end, requestor_names
+    return dict_of_threads, msg_start, msg_end, requestor_names, thread_roots
 
 
 
@@ -184,6 +242,7 @@ def extract_name_from_second_line(line: str) -> str:
 
 
 def get_email_by_msgid(file_name: str, msg_start: Dict[str, int], msg_end: Dict[str, int], msgid: str,) -> Optional[str]:
+    """Opens the file for every call; MboxReader.get_email() reads from one shared map instead."""
     msgid = msgid.strip()
     if msgid.startswith("<") and msgid.endswith(">"):
         msgid = msgid[1:-1]
@@ -207,7 +266,7 @@ if __name__ == "__main__":
 
     for fname in files:
         path = base_dir + fname
-        dict_of_threads, msg_start, msg_end, requestor_names = create_dict_of_threads(path)
+        dict_of_threads, msg_start, msg_end, requestor_names, thread_roots = create_dict_of_threads(path)
 
         elements = dict_of_threads.get(('06/19/2023', 'narunl@stanford.edu'))
         print(elements)
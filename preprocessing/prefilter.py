@@ -0,0 +1,225 @@
+"""
+Local pre-filter that keeps obviously off-topic threads away from the LLM.
+
+Each thread is scored from lexicon hits (chemicals, processes, PROM cues,
+off-topic cues) with a small logistic model. A thread with any unambiguous
+chemical or process hit (see lexicon.AMBIGUOUS_TERMS) always goes to the
+LLM, whatever its off-topic cues score; the model only decides threads
+without one (with the hand-set DEFAULT_MODEL,
+those need PROM cues that outweigh their off-topic cues). Without a trained
+model file DEFAULT_MODEL is used. A trained model is plain JSON (weights,
+bias, threshold) fitted on past LLM decisions from the extraction journal,
+with the threshold chosen to keep TARGET_RECALL of PROM threads.
+
+While the pre-filter is on, the journal only sees threads it kept, so a
+deterministic PREFILTER_AUDIT_FRACTION of the threads it would skip still go
+to the LLM and are journaled with weight 1 / PREFILTER_AUDIT_FRACTION.
+evaluate and train weight every journaled thread that way, so the PROMs the
+pre-filter skips show up in the recall they report. With the audit set to 0
+only a journal built with PREFILTER=off gives unbiased numbers.
+
+CLI:
+    python preprocessing/prefilter.py evaluate [model.json]
+    python preprocessing/prefilter.py train [model.json]
+"""
+import hashlib
+import json
+import math
+import os
+import sys
+from typing import Dict, List, Optional, Tuple
+
+from ingest_cache import CACHE_DIR, ExtractionCache
+from span_matcher import lexicon_matcher
+
+
+PREFILTER_ENABLED = os.getenv("PREFILTER", "on").lower() not in ("0", "off", "false")
+PREFILTER_MODEL_PATH = os.getenv("PREFILTER_MODEL_PATH", os.path.join(CACHE_DIR, "prefilter_model.json"))
+TARGET_RECALL = float(os.getenv("PREFILTER_TARGET_RECALL", "0.98"))
+PREFILTER_AUDIT_FRACTION = float(os.getenv("PREFILTER_AUDIT_FRACTION", "0.02"))
+
+FEATURES = ["chemicals", "processes", "prom_cues", "off_topic_cues", "length"]
+
+DEFAULT_MODEL = {
+    "weights": {"chemicals": 1.5, "processes": 1.5, "prom_cues": 1.0, "off_topic_cues": -1.0, "length": 0.0},
+    "bias": -2.0,
+    "threshold": 0.2,
+}
+
+
+def features(thread: str) -> Dict[str, float]:
+    """log1p-scaled lexicon hit counts, plus the (unweighted) unambiguous chemical/process hits."""
+    counts = lexicon_matcher.counts(thread)
+    feats = {name: math.log1p(counts[name]) for name in FEATURES if name in counts}
+    feats["length"] = math.log1p(len(thread) / 1000)
+    feats["unambiguous"] = math.log1p(counts["unambiguous"])
+    return feats
+
+
+def has_domain_hits(feats: Dict[str, float]) -> bool:
+    """Any unambiguous chemical or process mention; such threads are never skipped."""
+    return feats.get("unambiguous", 0.0) > 0
+
+
+def _sigmoid(z: float) -> float:
+    if z < -30:
+        return 0.0
+    return 1.0 / (1.0 + math.exp(-z))
+
+
+class PrefilterModel:
+    def __init__(self, weights: Dict[str, float], bias: float, threshold: float):
+        self.weights = weights
+        self.bias = bias
+        self.threshold = threshold
+        self.checked = 0
+        self.skipped = 0
+        self.audited = 0
+
+    @classmethod
+    def load(cls, path: str = PREFILTER_MODEL_PATH) -> "PrefilterModel":
+        """The trained model at path, or DEFAULT_MODEL when there is none."""
+        spec = DEFAULT_MODEL
+        if os.path.exists(path):
+            with open(path) as f:
+                spec = json.load(f)
+        return cls(spec["weights"], spec["bias"], spec["threshold"])
+
+    def save(self, path: str = PREFILTER_MODEL_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({"weights": self.weights, "bias": self.bias, "threshold": self.threshold}, f, indent=2)
+
+    def _probability(self, feats: Dict[str, float]) -> float:
+        return _sigmoid(self.bias + sum(self.weights.get(name, 0.0) * value for name, value in feats.items()))
+
+    def probability(self, thread: str) -> float:
+        return self._probability(features(thread))
+
+    def _keep(self, feats: Dict[str, float], probability: float) -> bool:
+        # off-topic cues lower the score but never veto a chemical/process hit
+        return has_domain_hits(feats) or probability >= self.threshold
+
+    def check(self, thread: str) -> Tuple[bool, float]:
+        """(whether the thread should go to the LLM, its probability), from one lexicon scan."""
+        self.checked += 1
+        feats = features(thread)
+        probability = self._probability(feats)
+        keep = self._keep(feats, probability)
+        if not keep:
+            self.skipped += 1
+        return keep, probability
+
+    def audit(self, thread: str) -> bool:
+        """
+        Whether a thread check() rejected goes to the LLM anyway as an audit sample.
+        Chosen by content hash, so a rerun audits the same threads.
+        """
+        if PREFILTER_AUDIT_FRACTION <= 0:
+            return False
+        bucket = int(hashlib.sha256(thread.encode("utf-8", errors="replace")).hexdigest()[:8], 16) / 0x100000000
+        if bucket >= PREFILTER_AUDIT_FRACTION:
+            return False
+        self.audited += 1
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        return {"checked": self.checked, "skipped": self.skipped, "audited": self.audited}
+
+
+def labelled_threads(cache: Optional[ExtractionCache] = None) -> List[Tuple[str, int, float]]:
+    """(thread, 1 if the LLM found a PROM else 0, sample weight) from the extraction journal."""
+    cache = cache or ExtractionCache()
+    labels, weights = {}, {}
+    for thread, decision, weight in cache.weighted_decisions():
+        # any prompt version that found a PROM counts as a PROM
+        labels[thread] = max(labels.get(thread, 0), int(decision == "prom"))
+        # a thread that was ever sent unconditionally is not an audit sample
+        weights[thread] = min(weights.get(thread, weight), weight)
+    return [(thread, label, weights[thread]) for thread, label in labels.items()]
+
+
+def evaluate(model: PrefilterModel, samples: List[Tuple[str, int, float]]) -> Dict[str, float]:
+    """Precision/recall of "send to LLM" against past LLM decisions, audit samples weighted up."""
+    tp = fp = fn = tn = 0.0
+    for thread, label, weight in samples:
+        feats = features(thread)
+        keep = model._keep(feats, model._probability(feats))
+        if keep and label:
+            tp += weight
+        elif keep:
+            fp += weight
+        elif label:
+            fn += weight
+        else:
+            tn += weight
+    total = tp + fp + fn + tn
+    return {
+        "threads": len(samples),
+        "audit_samples": sum(1 for _, _, weight in samples if weight > 1),
+        "precision": tp / (tp + fp) if tp + fp else 0.0,
+        "recall": tp / (tp + fn) if tp + fn else 0.0,
+        "skip_rate": (fn + tn) / total if total else 0.0,
+        "missed_proms": round(fn, 1),
+    }
+
+
+def train(
+    samples: List[Tuple[str, int, float]],
+    epochs: int = 300,
+    learning_rate: float = 0.5,
+    l2: float = 1e-3,
+    target_recall: float = TARGET_RECALL,
+) -> PrefilterModel:
+    """Full-batch gradient descent on the weighted logistic loss; threshold set for target_recall."""
+    rows = [([features(thread)[name] for name in FEATURES], label, weight) for thread, label, weight in samples]
+    weights = [0.0] * len(FEATURES)
+    bias = 0.0
+    n = sum(weight for _, _, weight in rows)
+    for _ in range(epochs):
+        grad_w = [0.0] * len(FEATURES)
+        grad_b = 0.0
+        for x, label, weight in rows:
+            error = weight * (_sigmoid(bias + sum(w * v for w, v in zip(weights, x))) - label)
+            for i, v in enumerate(x):
+                grad_w[i] += error * v
+            grad_b += error
+        weights = [w - learning_rate * (g / n + l2 * w) for w, g in zip(weights, grad_w)]
+        bias -= learning_rate * grad_b / n
+
+    model = PrefilterModel(dict(zip(FEATURES, weights)), bias, 0.5)
+    positives = sorted((model._probability(dict(zip(FEATURES, x))), weight) for x, label, weight in rows if label)
+    if positives:
+        # highest threshold that still keeps target_recall of the (weighted) PROM threads
+        allowed_miss = sum(weight for _, weight in positives) * (1 - target_recall)
+        missed = 0.0
+        for probability, weight in positives:
+            missed += weight
+            if missed > allowed_miss:
+                model.threshold = probability
+                break
+    return model
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "evaluate"
+    path = sys.argv[2] if len(sys.argv) > 2 else PREFILTER_MODEL_PATH
+    samples = labelled_threads()
+    if not samples:
+        print("no journaled LLM decisions yet; run the email pipeline first")
+        raise SystemExit(1)
+    if not any(weight > 1 for _, _, weight in samples):
+        print(
+            "warning: no pre-filter audit samples in the journal; unless it was built with PREFILTER=off, "
+            "recall and the trained threshold ignore every thread the pre-filter skipped"
+        )
+    if command == "evaluate":
+        print(evaluate(PrefilterModel.load(path), samples))
+    elif command == "train":
+        model = train(samples)
+        model.save(path)
+        print(f"saved {path}: weights={model.weights} bias={model.bias:.3f} threshold={model.threshold:.3f}")
+        print(evaluate(model, samples))
+    else:
+        print(__doc__)
+        raise SystemExit(1)
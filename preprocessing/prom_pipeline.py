@@ -1,37 +1,47 @@
 
-from models.insert import PromForm
+from models.insert import BatchWriter, PromForm, find_existing_proms, insert_proms
 import os
 from multiprocessing import Pool
 import time
-from typing import List
+from typing import List, Optional
 from dataclasses import replace
 from database.pg import get_db_connection, init_prom_table
 import asyncio
 from test import fork_then_extract, build_embed_string
 from openai import AsyncOpenAI
+from embed_batcher import EmbeddingBatcher, EMBEDDING_MODEL
+from ingest_cache import default_embedding_cache
+from concurrency import get_limiter
+from rate_limit import RateLimiter
+from near_dup import NEAR_DUP_ENABLED, NearDuplicate, find_near_duplicates, with_signature
 
 
 
-MAX_CONCURRENT_PROM_REQUESTS = 20
-
-
+# retries are handled by the adaptive embedding limiter so it can see 429s
 client = AsyncOpenAI(
     api_key=os.environ.get("STANFORD_API_KEY"),
-    base_url="https://aiapi-prod.stanford.edu/v1"
+    base_url="https://aiapi-prod.stanford.edu/v1",
+    max_retries=0,
+)
+
+# run from app/worker the usage is reported under the worker's own name
+rate_limiter = RateLimiter("prom_pipeline")
+
+embedder = EmbeddingBatcher(
+    client,
+    model=EMBEDDING_MODEL,
+    cache=default_embedding_cache(),
+    limiter=get_limiter("embeddings"),
+    rate_limiter=rate_limiter,
 )
 
 
 async def embed_concat_json(concat_thread: str) -> List[float]:
     """
-    Async version of embedding, comes post LLM JSON retrieval in the pipeline
+    Async version of embedding, comes post LLM JSON retrieval in the pipeline.
+    Cached vectors are reused; misses are coalesced into batched requests.
     """
-    response = await client.embeddings.create(
-        model = "text-embedding-ada-002",
-        input=concat_thread
-    )
-    
-
-    return response.data[0].embedding
+    return await embedder.embed(concat_thread)
 
 # def process_file(file_path) -> PromForm:
 #     is_docx = file_path.lower().endswith('.docx')
@@ -59,11 +69,10 @@ def filter_duplicates(prom_forms: List[PromForm]) -> List[PromForm]:
     duplicates = 0
     
     for prom in prom_forms:
-        if prom.date is None or prom.requestor is None or prom.request_title is None:
+        key = prom.normalized_key()
+        if key is None:
             continue
         
-        key = (prom.date.lower(), prom.requestor.lower(), prom.request_title.lower())
-        
         if key in seen:
             print(f"Duplicate found: {prom.request_title} by {prom.requestor} on {prom.date}")
             duplicates += 1
@@ -76,7 +85,14 @@ def filter_duplicates(prom_forms: List[PromForm]) -> List[PromForm]:
     
     return unique
 
-async def embed_pipeline(prom_form: PromForm, embed_sem: asyncio.Semaphore) -> PromForm:
+async def reused(embedding: List[float]) -> List[float]:
+    return embedding
+
+
+near_stats = {"linked": 0, "reused_embeddings": 0}
+
+
+async def embed_pipeline(prom_form: PromForm, near: Optional[NearDuplicate] = None) -> PromForm:
     required_fields = {
         'date',
         'filename',
@@ -96,26 +112,74 @@ async def embed_pipeline(prom_form: PromForm, embed_sem: asyncio.Semaphore) -> P
     if not embed_string:
         return f"Could not build embed string in {prom_form.filename}:{has_empty}"
     
-    async with embed_sem:
-        prom_embed = await embed_concat_json(embed_string)
-    async with embed_sem:
-        process_embed = await embed_concat_json(prom_form.process_flow)
+    # a near-duplicate keeps the stored form's vector for every input it did not change
+    reuse_request = near is not None and near.request_embedding is not None and near.embedded_string == embed_string
+    reuse_process = near is not None and near.process_embedding is not None and near.process_flow == prom_form.process_flow
+    if reuse_request:
+        near_stats["reused_embeddings"] += 1
+    if reuse_process:
+        near_stats["reused_embeddings"] += 1
+
+    # both texts land in the same embedding batch; the embedder's limiter bounds concurrency
+    prom_embed, process_embed = await asyncio.gather(
+        reused(near.request_embedding) if reuse_request else embed_concat_json(embed_string),
+        reused(near.process_embedding) if reuse_process else embed_concat_json(prom_form.process_flow),
+    )
     
     return replace(prom_form, embedded_string=embed_string, request_embedding=prom_embed, process_embedding=process_embed)
 
-async def run_prom_pipeline(prom_objects: List[PromForm], con) -> int:
-    embed_sem = asyncio.Semaphore(MAX_CONCURRENT_PROM_REQUESTS)
-    tasks = [embed_pipeline(prom_object, embed_sem=embed_sem) for prom_object in prom_objects]
+async def run_prom_pipeline(prom_objects: List[PromForm], con) -> List[str]:
+    """
+    Embed and insert every form. Returns one outcome per input form, in input order:
+    "inserted", "duplicate" (already in prom_embeddings, or an ON CONFLICT hit)
+    or the reason it was skipped ("database insert failed" when the row was
+    rejected even on its own). Forms already in the table are found before
+    embedding and never reach the embedder.
+    """
+    prom_objects = list(prom_objects)
+    outcomes = [None] * len(prom_objects)
+    writer = BatchWriter(con, insert_proms)
+    for idx, present in enumerate(find_existing_proms(con, prom_objects)):
+        if present:
+            print(f"Already in prom_embeddings: {prom_objects[idx].request_title} | {prom_objects[idx].filename}")
+            outcomes[idx] = "duplicate"
+    skipped = outcomes.count("duplicate")
+    if skipped:
+        print(f"Skipped {skipped} form(s) already in prom_embeddings before embedding")
+
+    pending = [idx for idx in range(len(prom_objects)) if outcomes[idx] is None]
+    near = [None] * len(prom_objects)
+    if NEAR_DUP_ENABLED:
+        near_stats.update(linked=0, reused_embeddings=0)
+        signed = [with_signature(prom_objects[idx]) for idx in pending]
+        for idx, prom_object, match in zip(pending, signed, find_near_duplicates(con, signed)):
+            if match is not None:
+                print(f"Near-duplicate ({match.similarity:.2f}) of prom_id {match.prom_id}: {prom_object.request_title} | {prom_object.filename}")
+                prom_object = replace(prom_object, near_duplicate_of=match.prom_id)
+                near_stats["linked"] += 1
+            prom_objects[idx], near[idx] = prom_object, match
+
+    async def indexed(idx: int, prom_object: PromForm):
+        return idx, await embed_pipeline(prom_object, near[idx])
+
+    tasks = [indexed(idx, prom_objects[idx]) for idx in pending]
     for coro in asyncio.as_completed(tasks):
-        finished_prom_object = await coro
+        idx, finished_prom_object = await coro
         # Skip if embed_pipeline returned an error string
         if isinstance(finished_prom_object, str):
-            print(finished_prom_object)
             print(f"Skipping: {finished_prom_object}")
+            outcomes[idx] = finished_prom_object
             continue
-        finished_prom_object.insert_prom(con)
-        print(f"Finished Inserting {finished_prom_object.request_title}")
-    
+        for written_idx, outcome in writer.add(finished_prom_object, tag=idx):
+            outcomes[written_idx] = outcome if outcome != "failed" else "database insert failed"
+        print(f"Finished embedding {finished_prom_object.request_title}")
+    for written_idx, outcome in writer.close():
+        outcomes[written_idx] = outcome if outcome != "failed" else "database insert failed"
+    print(f"insert batches: {writer.stats()}")
+    print(f"embedding batches: {embedder.stats()} | limiter: {embedder.limiter.stats()}")
+    if NEAR_DUP_ENABLED:
+        print(f"near-duplicates: {near_stats}")
+    return outcomes
 
 
 if __name__ == "__main__":
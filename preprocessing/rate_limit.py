@@ -0,0 +1,182 @@
+"""
+Cluster-wide rate limiting for the shared Stanford AI API key.
+
+The server, the upload workers and ad-hoc pipeline runs all draw from the
+same two Redis token buckets (requests/min and tokens/min) for the API key.
+Batch consumers may not drain the buckets below INTERACTIVE_RESERVE_FRACTION
+of capacity, which is held back for interactive (server) traffic. Every grant
+is tallied per consumer per hour for usage reporting.
+
+If Redis is unreachable the limiter fails open (with a warning) so offline
+pipeline runs still work.
+
+CLI:
+    python preprocessing/rate_limit.py usage [hours]
+"""
+import asyncio
+import hashlib
+import os
+import sys
+import time
+from collections import defaultdict
+from typing import Dict
+
+import redis
+import redis.asyncio as aioredis
+
+
+REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", os.getenv("REDIS_URL", "redis://redis:6379/0"))
+UPSTREAM_RPM = int(os.getenv("UPSTREAM_RPM", "500"))
+UPSTREAM_TPM = int(os.getenv("UPSTREAM_TPM", "300000"))
+INTERACTIVE_RESERVE_FRACTION = float(os.getenv("INTERACTIVE_RESERVE_FRACTION", "0.2"))
+USAGE_TTL_SECONDS = 7 * 24 * 3600
+MAX_WAIT_SLICE_SECONDS = 5.0
+
+
+# KEYS: request bucket, token bucket, usage hash
+# ARGV: rpm, tpm, cost in tokens, reserve fraction, consumer, usage TTL
+# Returns 0 when granted, otherwise milliseconds to wait before trying again.
+# A cost above what the caller may draw (tpm less the reserve) is charged as
+# that much, otherwise it could never be granted; usage records the real cost.
+TOKEN_BUCKET_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local rpm = tonumber(ARGV[1])
+local tpm = tonumber(ARGV[2])
+local reserve = tonumber(ARGV[4])
+local cost = math.min(tonumber(ARGV[3]), math.floor(tpm * (1 - reserve)))
+
+local function refill(key, capacity)
+    local state = redis.call('HMGET', key, 'level', 'ts')
+    local level = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    return math.min(capacity, level + (now - ts) * capacity / 60000)
+end
+
+local requests = refill(KEYS[1], rpm)
+local tokens = refill(KEYS[2], tpm)
+local wait = 0
+if requests - 1 < rpm * reserve then
+    wait = math.max(wait, (rpm * reserve + 1 - requests) * 60000 / rpm)
+end
+if tokens - cost < tpm * reserve then
+    wait = math.max(wait, (tpm * reserve + cost - tokens) * 60000 / tpm)
+end
+if wait == 0 then
+    requests = requests - 1
+    tokens = tokens - cost
+    redis.call('HINCRBY', KEYS[3], ARGV[5] .. ':requests', 1)
+    redis.call('HINCRBY', KEYS[3], ARGV[5] .. ':tokens', tonumber(ARGV[3]))
+    redis.call('EXPIRE', KEYS[3], ARGV[6])
+end
+redis.call('HSET', KEYS[1], 'level', tostring(requests), 'ts', now)
+redis.call('HSET', KEYS[2], 'level', tostring(tokens), 'ts', now)
+redis.call('EXPIRE', KEYS[1], 120)
+redis.call('EXPIRE', KEYS[2], 120)
+return math.ceil(wait)
+"""
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 chars per token) used for batching and rate limiting."""
+    return len(text) // 4 + 1
+
+
+def _key_prefix() -> str:
+    api_key = os.getenv("STANFORD_API_KEY", "")
+    return f"ratelimit:{hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:12]}"
+
+
+def _usage_key(prefix: str, at: float) -> str:
+    return f"{prefix}:usage:{int(at // 3600)}"
+
+
+class RateLimiter:
+    """
+    priority="interactive" may use the full buckets; "batch" stops at the reserve.
+    consumer is the name usage is reported under (server, worker, email_pipeline...).
+    """
+
+    def __init__(self, consumer: str, priority: str = "batch", redis_url: str = REDIS_URL):
+        self.consumer = os.getenv("RATE_LIMIT_CONSUMER", consumer)
+        self.reserve = 0.0 if priority == "interactive" else INTERACTIVE_RESERVE_FRACTION
+        self.redis_url = redis_url
+        self.prefix = _key_prefix()
+        self.waited_seconds = 0.0
+        self._async_client = None
+        self._async_loop = None
+        self._sync_client = None
+        self._disabled_reason = None
+
+    def _args(self, tokens: int):
+        keys = [f"{self.prefix}:rpm", f"{self.prefix}:tpm", _usage_key(self.prefix, time.time())]
+        args = [UPSTREAM_RPM, UPSTREAM_TPM, max(1, tokens), self.reserve, self.consumer, USAGE_TTL_SECONDS]
+        return keys, args
+
+    def _fail_open(self, error: Exception):
+        if self._disabled_reason is None:
+            print(f"[rate_limit] redis unavailable, not rate limiting: {error}")
+        self._disabled_reason = str(error)
+
+    def _async_redis(self):
+        # redis.asyncio connections belong to one event loop
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_loop is not loop:
+            self._async_client = aioredis.from_url(self.redis_url)
+            self._async_loop = loop
+        return self._async_client
+
+    async def acquire(self, tokens: int):
+        """Wait until the shared buckets grant one request of ~tokens tokens."""
+        while True:
+            keys, args = self._args(tokens)
+            try:
+                wait_ms = await self._async_redis().eval(TOKEN_BUCKET_SCRIPT, len(keys), *keys, *args)
+            except (redis.RedisError, OSError) as error:
+                self._fail_open(error)
+                return
+            if not wait_ms:
+                return
+            pause = min(MAX_WAIT_SLICE_SECONDS, wait_ms / 1000)
+            self.waited_seconds += pause
+            await asyncio.sleep(pause)
+
+    def acquire_sync(self, tokens: int):
+        """Blocking variant for synchronous call sites (FastAPI sync endpoints)."""
+        if self._sync_client is None:
+            self._sync_client = redis.from_url(self.redis_url)
+        while True:
+            keys, args = self._args(tokens)
+            try:
+                wait_ms = self._sync_client.eval(TOKEN_BUCKET_SCRIPT, len(keys), *keys, *args)
+            except (redis.RedisError, OSError) as error:
+                self._fail_open(error)
+                return
+            if not wait_ms:
+                return
+            pause = min(MAX_WAIT_SLICE_SECONDS, wait_ms / 1000)
+            self.waited_seconds += pause
+            time.sleep(pause)
+
+
+def usage_report(hours: int = 1, redis_url: str = REDIS_URL) -> Dict[str, Dict[str, int]]:
+    """Requests and tokens granted per consumer over the last `hours` hours."""
+    client = redis.from_url(redis_url, decode_responses=True)
+    prefix = _key_prefix()
+    now = time.time()
+    report = defaultdict(lambda: {"requests": 0, "tokens": 0})
+    for hour in range(hours):
+        for field, value in client.hgetall(_usage_key(prefix, now - hour * 3600)).items():
+            consumer, _, metric = field.rpartition(":")
+            report[consumer][metric] += int(value)
+    return dict(report)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "usage":
+        hours = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+        for consumer, usage in sorted(usage_report(hours).items()):
+            print(f"{consumer:20s} requests={usage['requests']:6d} tokens={usage['tokens']:9d}")
+    else:
+        print(__doc__)
+        raise SystemExit(1)
@@ -0,0 +1,147 @@
+"""
+Linear-time dictionary matching over the lexicon.
+
+One Aho-Corasick automaton holds every lexicon term. The text is scanned
+once, lower-cased character by character so offsets stay aligned with the
+original; case-sensitive terms (chemical formulas) are re-checked against the
+original text. Matches must sit on word boundaries, and within a category the
+leftmost-longest match wins ("wet etch" rather than "etch").
+
+CAS registry numbers are found with a regex and kept only if their check
+digit is valid. Matches of AMBIGUOUS_TERMS are counted but never returned by
+spans(), so they are not prefilled.
+"""
+import re
+from collections import deque
+from typing import Dict, List, Tuple
+
+from lexicon import AMBIGUOUS_TERMS, CHEMICAL_FORMULAS, CHEMICAL_NAMES, OFF_TOPIC_CUES, PROCESSES, PROM_CUES
+
+
+CAS_RE = re.compile(r"(?<![\d-])(\d{2,7})-(\d{2})-(\d)(?![\d-])")
+
+# category -> (terms, case_sensitive)
+LEXICON_CATEGORIES = {
+    "chemicals": [(CHEMICAL_NAMES, False), (CHEMICAL_FORMULAS, True)],
+    "processes": [(PROCESSES, False)],
+    "prom_cues": [(PROM_CUES, False)],
+    "off_topic_cues": [(OFF_TOPIC_CUES, False)],
+}
+
+
+def valid_cas(number: str) -> bool:
+    """CAS check digit: sum of the other digits weighted 1, 2, 3... from the right, mod 10."""
+    digits = number.replace("-", "")
+    body, check = digits[:-1], int(digits[-1])
+    return sum(int(d) * i for i, d in enumerate(reversed(body), start=1)) % 10 == check
+
+
+def cas_numbers(text: str) -> List[Tuple[int, int]]:
+    return [match.span() for match in CAS_RE.finditer(text) if valid_cas(match.group(0))]
+
+
+def _fold(ch: str) -> str:
+    lowered = ch.lower()
+    # a few characters lower-case to two; keep offsets aligned instead
+    return lowered if len(lowered) == 1 else ch
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isalnum() or ch == "_"
+
+
+class AhoCorasick:
+    """Automaton over lower-cased patterns; each pattern carries a payload."""
+
+    def __init__(self):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.out: List[List[Tuple[int, object]]] = [[]]
+
+    def add(self, pattern: str, payload):
+        state = 0
+        for ch in pattern:
+            ch = _fold(ch)
+            if ch not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append([])
+                self.goto[state][ch] = len(self.goto) - 1
+            state = self.goto[state][ch]
+        self.out[state].append((len(pattern), payload))
+
+    def build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(ch, 0) if state else 0
+                self.out[child] = self.out[child] + self.out[self.fail[child]]
+        return self
+
+    def iter(self, text: str):
+        """Yield (start, end, payload) for every occurrence, in order of end offset."""
+        state = 0
+        for i, ch in enumerate(text):
+            ch = _fold(ch)
+            while state and ch not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(ch, 0)
+            for length, payload in self.out[state]:
+                yield i + 1 - length, i + 1, payload
+
+
+class LexiconMatcher:
+    def __init__(self, categories=LEXICON_CATEGORIES, ambiguous=AMBIGUOUS_TERMS):
+        self.automaton = AhoCorasick()
+        for category, groups in categories.items():
+            for terms, case_sensitive in groups:
+                for term in set(terms):
+                    self.automaton.add(term, (category, term if case_sensitive else None, term in ambiguous))
+        self.automaton.build()
+        self.categories = list(categories)
+
+    def _matches(self, text: str) -> Dict[str, List[Tuple[int, int, bool]]]:
+        """category -> (start, end, ambiguous) spans."""
+        found = {category: [] for category in self.categories}
+        for start, end, (category, exact, ambiguous) in self.automaton.iter(text):
+            if exact is not None and text[start:end] != exact:
+                continue
+            if start > 0 and _is_word_char(text[start - 1]):
+                continue
+            if end < len(text) and _is_word_char(text[end]):
+                continue
+            found[category].append((start, end, ambiguous))
+        # leftmost-longest, non-overlapping within each category
+        for category, spans in found.items():
+            spans.sort(key=lambda span: (span[0], -span[1]))
+            kept, last_end = [], -1
+            for start, end, ambiguous in spans:
+                if start >= last_end:
+                    kept.append((start, end, ambiguous))
+                    last_end = end
+            found[category] = kept
+        found["chemicals"] = sorted(found["chemicals"] + [(start, end, False) for start, end in cas_numbers(text)])
+        return found
+
+    def counts(self, text: str) -> Dict[str, int]:
+        """Hits per category, plus "unambiguous": chemical/process hits outside AMBIGUOUS_TERMS."""
+        found = self._matches(text)
+        counts = {category: len(spans) for category, spans in found.items()}
+        counts["unambiguous"] = sum(1 for category in ("chemicals", "processes") for *_, ambiguous in found[category] if not ambiguous)
+        return counts
+
+    def spans(self, text: str) -> Dict[str, List[str]]:
+        """Verbatim unambiguous chemical and process mentions, exact-string deduplicated, first-seen order."""
+        found = self._matches(text)
+        result = {}
+        for category in ("chemicals", "processes"):
+            result[category] = list(dict.fromkeys(text[start:end] for start, end, ambiguous in found[category] if not ambiguous))
+        return result
+
+
+lexicon_matcher = LexiconMatcher()
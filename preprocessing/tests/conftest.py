@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the pipeline modules use flat imports, as when run from preprocessing/
+PREPROCESSING_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PREPROCESSING_DIR not in sys.path:
+    sys.path.insert(0, PREPROCESSING_DIR)
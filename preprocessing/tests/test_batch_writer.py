@@ -0,0 +1,51 @@
+from models.insert import BatchWriter
+
+
+class FakeConnection:
+    """Rows become visible on commit and vanish on rollback, like one open transaction."""
+
+    def __init__(self):
+        self.committed = []
+        self.open = []
+
+    def commit(self):
+        self.committed.extend(self.open)
+        self.open = []
+
+    def rollback(self):
+        self.open = []
+
+
+def fake_insert(con, objs, batch_size, commit_every):
+    if "bad" in objs:
+        raise ValueError("value too long for type character varying(100)")
+    outcomes = []
+    for obj in objs:
+        outcomes.append("duplicate" if obj in con.committed or obj in con.open else "inserted")
+        con.open.append(obj)
+    return outcomes
+
+
+def test_outcomes_are_reported_on_commit():
+    con = FakeConnection()
+    writer = BatchWriter(con, fake_insert, batch_size=2, commit_every=2)
+    assert writer.add("a", tag=0) == []
+    assert writer.add("b", tag=1) == []
+    assert writer.add("a", tag=2) == []
+    assert writer.add("c", tag=3) == [(0, "inserted"), (1, "inserted"), (2, "duplicate"), (3, "inserted")]
+    assert con.committed == ["a", "b", "a", "c"]
+    assert writer.stats() == {"batches": 2, "inserted": 3, "duplicates": 1, "failed": 0}
+
+
+def test_failed_batch_is_retried_row_by_row():
+    con = FakeConnection()
+    writer = BatchWriter(con, fake_insert, batch_size=2, commit_every=4)
+    writer.add("a", tag=0)
+    writer.add("b", tag=1)
+    writer.add("bad", tag=2)
+    # the earlier uncommitted batch was rolled back with the failing one and is replayed too
+    written = writer.add("c", tag=3)
+    assert written == [(0, "inserted"), (1, "inserted"), (2, "failed"), (3, "inserted")]
+    assert con.committed == ["a", "b", "c"]
+    assert writer.close() == []
+    assert writer.stats()["failed"] == 1
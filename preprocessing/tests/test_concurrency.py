@@ -0,0 +1,37 @@
+import asyncio
+
+import pytest
+
+from concurrency import AdaptiveLimiter
+
+
+def test_cancelled_call_releases_its_slot():
+    async def scenario():
+        limiter = AdaptiveLimiter("test", initial=1)
+        task = asyncio.ensure_future(limiter.call(asyncio.sleep, 60))
+        await asyncio.sleep(0)
+        assert limiter.in_flight == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert limiter.in_flight == 0
+        # the single slot is free again
+        assert await asyncio.wait_for(limiter.call(asyncio.sleep, 0, result="ok"), 1) == "ok"
+        return limiter
+
+    limiter = asyncio.run(scenario())
+    assert limiter.errors == 0 and limiter.throttled == 0
+
+
+def test_non_retryable_error_releases_and_raises():
+    async def fail():
+        raise ValueError("bad request")
+
+    async def scenario():
+        limiter = AdaptiveLimiter("test", initial=2)
+        with pytest.raises(ValueError):
+            await limiter.call(fail)
+        return limiter
+
+    limiter = asyncio.run(scenario())
+    assert limiter.in_flight == 0 and limiter.errors == 1
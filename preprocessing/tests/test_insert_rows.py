@@ -0,0 +1,70 @@
+import models.insert
+from models.insert import BatchWriter, TableSpec, insert_rows
+
+SPEC = TableSpec("forms", "form_id", ("key", "value"), ("key",), "form_texts", ("text",))
+
+
+class FakeTable:
+    """One table with a unique key, and its text side table; rows become visible on commit."""
+
+    def __init__(self):
+        self.rows = {}
+        self.texts = {}
+        self.open_rows = {}
+        self.open_texts = {}
+        self.next_id = 1
+
+    def cursor(self):
+        return self
+
+    def commit(self):
+        self.rows.update(self.open_rows)
+        self.texts.update(self.open_texts)
+        self.open_rows, self.open_texts = {}, {}
+
+    def rollback(self):
+        self.open_rows, self.open_texts = {}, {}
+
+
+def fake_execute_values(cursor, sql, rows, page_size=100, fetch=False):
+    """ON CONFLICT DO NOTHING skips any key already written, earlier rows of the same statement included."""
+    if sql.startswith(f"INSERT INTO {SPEC.text_table}"):
+        for row_id, text in rows:
+            cursor.open_texts[row_id] = text
+        return None
+    returned = []
+    for key, value in rows:
+        if value == "bad":
+            raise ValueError("value too long for type character varying(100)")
+        if key in cursor.rows or key in cursor.open_rows:
+            continue
+        cursor.open_rows[key] = cursor.next_id
+        returned.append((cursor.next_id, key))
+        cursor.next_id += 1
+    return returned
+
+
+def insert_forms(con, forms, batch_size, commit_every):
+    return insert_rows(con, SPEC, [f[:2] for f in forms], [f[2:] for f in forms], batch_size, commit_every)
+
+
+def test_repeated_key_in_one_batch_keeps_the_first_row(monkeypatch):
+    monkeypatch.setattr(models.insert, "execute_values", fake_execute_values)
+    con = FakeTable()
+    forms = [("a", "1", "first a"), ("b", "2", "b"), ("a", "3", "second a")]
+    assert insert_forms(con, forms, batch_size=10, commit_every=1) == ["inserted", "inserted", "duplicate"]
+    assert con.rows == {"a": 1, "b": 2}
+    # the returned id goes with the text of the row that was actually written
+    assert con.texts == {1: "first a", 2: "b"}
+
+
+def test_one_by_one_fallback_with_a_repeated_key(monkeypatch):
+    monkeypatch.setattr(models.insert, "execute_values", fake_execute_values)
+    con = FakeTable()
+    writer = BatchWriter(con, insert_forms, batch_size=4, commit_every=1)
+    for tag, form in enumerate([("a", "1", "first a"), ("a", "2", "second a"), ("b", "bad", "b"), ("c", "3", "c")]):
+        written = writer.add(form, tag=tag)
+    assert written == [(0, "inserted"), (1, "duplicate"), (2, "failed"), (3, "inserted")]
+    # like a sequence, the rolled-back batch used up ids
+    assert {key: con.texts[row_id] for key, row_id in con.rows.items()} == {"a": "first a", "c": "c"}
+    assert writer.stats() == {"batches": 0, "inserted": 2, "duplicates": 1, "failed": 1}
@@ -0,0 +1,90 @@
+import pytest
+
+from json_repair import TruncatedOutput, UnrepairableOutput, coerce_extraction, parse_json_lenient, repair_extraction
+
+
+FULL = (
+    '{"prom_request": "HF etch", "prom_considerations": "", "chemicals_mentioned": ["HF", "BOE"], '
+    '"processes_mentioned": ["wet etch"], "prom_approval": "approved", "approval_evidence": "", "llm_context": ""}'
+)
+
+
+def test_plain_json():
+    assert repair_extraction(FULL)["chemicals_mentioned"] == ["HF", "BOE"]
+
+
+def test_markdown_fence():
+    assert repair_extraction(f"```json\n{FULL}\n```")["prom_request"] == "HF etch"
+
+
+def test_prose_around_json():
+    assert repair_extraction(f"Here is the extraction:\n{FULL}\nLet me know if you need more.")["prom_approval"] == "approved"
+
+
+def test_stray_bracket_in_prose():
+    assert repair_extraction(f"Result [see below]:\n{FULL}")["processes_mentioned"] == ["wet etch"]
+
+
+def test_trailing_commas():
+    assert parse_json_lenient('{"a": [1, 2,], "b": "x",}') == {"a": [1, 2], "b": "x"}
+
+
+def test_python_literals():
+    assert parse_json_lenient("Answer: {'a': None, 'b': True, 'c': 'x'}") == {"a": None, "b": True, "c": "x"}
+
+
+def test_duplicate_keys_keep_non_empty():
+    assert parse_json_lenient('{"prom_request": "", "prom_request": "HF etch"}') == {"prom_request": "HF etch"}
+    assert parse_json_lenient('{"prom_request": "HF etch", "prom_request": ""}') == {"prom_request": "HF etch"}
+
+
+def test_brackets_inside_strings():
+    assert parse_json_lenient('ok {"a": "x } ] \\" {"}') == {"a": 'x } ] " {'}
+
+
+@pytest.mark.parametrize(
+    "truncated",
+    [
+        '{"prom_request": "HF etch", "chemicals_mentioned": ["HF", "BO',
+        '{"prom_request": "HF etch", "chemicals_mentioned": ["HF", "BOE"',
+        '{"prom_request": "HF etch", "chemicals_mentioned": ["HF", "BOE"],',
+        '{"prom_request": "HF etch", "prom_considerations":',
+        '```json\n{"prom_request": "HF et',
+        '[{"thread_id": "T1", "prom_request": "HF etch"}, {"thread_id": "T2", "prom_req',
+    ],
+)
+def test_truncated_output_is_unrepairable(truncated):
+    with pytest.raises(TruncatedOutput):
+        repair_extraction(truncated)
+
+
+def test_truncated_output_is_not_salvaged_from_a_nested_value():
+    with pytest.raises(TruncatedOutput):
+        parse_json_lenient('{"prom_request": "HF etch", "chemicals_mentioned": ["HF", "BOE"], "llm_con')
+
+
+def test_empty_and_missing_json():
+    with pytest.raises(UnrepairableOutput):
+        repair_extraction("   ")
+    with pytest.raises(UnrepairableOutput):
+        repair_extraction("I could not find a PROM request in this thread.")
+
+
+def test_coerce_fills_defaults_and_normalises_types():
+    result = coerce_extraction({"prom_request": ["line 1", "line 2"], "chemicals_mentioned": "HF", "prom_approval": "Maybe"})
+    assert result["prom_request"] == "line 1\nline 2"
+    assert result["chemicals_mentioned"] == ["HF"]
+    assert result["processes_mentioned"] == []
+    assert result["prom_approval"] == "hard_to_tell"
+    assert result["llm_context"] == ""
+
+
+def test_coerce_single_item_list():
+    assert coerce_extraction([{"prom_request": "x"}])["prom_request"] == "x"
+
+
+def test_coerce_rejects_answer_without_core_fields():
+    with pytest.raises(UnrepairableOutput):
+        coerce_extraction({"prom_approval": "approved"})
+    with pytest.raises(UnrepairableOutput):
+        coerce_extraction({"prom_request": "x", "chemicals_mentioned": {"HF": 1}})
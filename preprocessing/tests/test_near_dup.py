@@ -0,0 +1,79 @@
+import near_dup
+from models.insert import PromForm
+from near_dup import NEAR_DUP_THRESHOLD, estimated_jaccard, find_near_duplicates, with_signature
+
+REASON = (
+    "We need to strip photoresist from patterned silicon wafers after the oxide etch step. "
+    "The wafers are dipped in the heated solvent bath for ten minutes, rinsed in deionized water "
+    "for five minutes and dried with nitrogen before inspection under the optical microscope. "
+    "All work happens in the wet bench with face shield, apron and trionic gloves."
+)
+
+
+def form(title, reason, process_flow="strip, rinse, dry"):
+    return with_signature(PromForm(
+        date="03/04/2024",
+        filename="prom.pdf",
+        requestor="alice",
+        request_title=title,
+        chemicals_and_processes="Remover PG, deionized water",
+        request_reason=reason,
+        process_flow=process_flow,
+    ))
+
+
+class FakeCursor:
+    """prom_texts / prom_embeddings holding the given signed forms under their prom_id."""
+
+    def __init__(self, stored):
+        self.stored = stored
+        self.rows = []
+
+    def execute(self, sql, params):
+        (prom_ids,) = params
+        self.rows = [(prom_id, "embed input", self.stored[prom_id].process_flow, "[0.5, 0.25]", None) for prom_id in prom_ids]
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeConnection:
+    def __init__(self, stored):
+        self.stored = stored
+
+    def cursor(self):
+        return FakeCursor(self.stored)
+
+
+def fake_execute_values(cursor, sql, values, template=None, page_size=100, fetch=False):
+    """The candidate query: every stored form sharing at least one LSH bucket."""
+    return [
+        (idx, prom_id, stored.minhash)
+        for idx, bands in values
+        for prom_id, stored in cursor.stored.items()
+        if set(bands) & set(stored.lsh_bands)
+    ]
+
+
+def test_near_identical_form_is_linked_and_unrelated_is_not(monkeypatch):
+    monkeypatch.setattr(near_dup, "execute_values", fake_execute_values)
+    stored = form("Photoresist strip", REASON)
+    resubmitted = form("Photoresist strip", REASON.replace("ten minutes", "twelve minutes"))
+    unrelated = form(
+        "Furnace anneal",
+        "Anneal the implanted samples in forming gas at four hundred degrees for half an hour, "
+        "then let the tube cool under argon before unloading the boat.",
+    )
+    assert estimated_jaccard(stored.minhash, resubmitted.minhash) >= NEAR_DUP_THRESHOLD
+    assert estimated_jaccard(stored.minhash, unrelated.minhash) < NEAR_DUP_THRESHOLD
+
+    match, no_match = find_near_duplicates(FakeConnection({7: stored}), [resubmitted, unrelated])
+    assert match.prom_id == 7 and match.similarity >= NEAR_DUP_THRESHOLD
+    assert match.process_flow == stored.process_flow and match.request_embedding == [0.5, 0.25]
+    assert no_match is None
+
+
+def test_signatures_are_deterministic():
+    assert form("Photoresist strip", REASON).lsh_bands == form("Photoresist strip", REASON).lsh_bands
+    empty = with_signature(PromForm(date=None, filename=None, requestor=None))
+    assert empty.minhash is None and empty.lsh_bands is None
@@ -0,0 +1,98 @@
+from mbox_reader import MboxReader
+from order_emails import build_threads, parse_mbox_threads_textio
+
+
+def test_replies_gather_under_a_missing_parent():
+    msg_refs = {"b": ["a"], "c": ["a", "b"], "d": ["a"], "e": []}
+    assert build_threads(msg_refs, ["b", "c", "d", "e"]) == {"a": ["b", "c", "d"], "e": ["e"]}
+
+
+def test_missing_middle_of_a_reference_chain_is_a_placeholder():
+    # m2 is gone; m3 still hangs under m1 through the chain in its own references
+    msg_refs = {"m1": [], "m3": ["m1", "m2"]}
+    assert build_threads(msg_refs, ["m1", "m3"]) == {"m1": ["m1", "m3"]}
+
+
+def test_self_reference_is_ignored():
+    msg_refs = {"x": ["x"], "y": ["x", "y"]}
+    assert build_threads(msg_refs, ["x", "y"]) == {"x": ["x", "y"]}
+
+
+def test_reference_cycle_is_one_thread():
+    msg_refs = {"p": ["q"], "q": ["p"], "r": ["q"]}
+    threads = build_threads(msg_refs, ["p", "q", "r"])
+    assert list(threads.values()) == [["p", "q", "r"]]
+
+
+def test_repeated_message_id_is_threaded_once():
+    msg_refs = {"a": [], "b": ["a"]}
+    assert build_threads(msg_refs, ["a", "b", "a"]) == {"a": ["a", "b"]}
+
+
+MBOX = """\
+From alice at example.org  Mon Mar  4 09:12:01 2024
+From: alice at example.org (Alice Smith)
+Date: Mon, 4 Mar 2024 09:12:01 -0800
+Subject: [PROM] HF etch
+Message-ID: <one@example.org>
+
+Requesting approval for an HF dip.
+>From the datasheet: 49% HF.
+
+-------- Forwarded Message --------
+From: carol at example.org (Carol)
+Message-ID: <quoted@example.org>
+
+From: and Message-ID: lines down here are body text.
+
+From bob at example.org  Tue Mar  5 10:00:00 2024
+From: bob at example.org (Bob Jones)
+Date: Tue, 5 Mar 2024 10:00:00 -0800
+Subject: Re: [PROM] HF etch
+In-Reply-To: <one@example.org>
+References: <one@example.org>
+Message-ID: <two@example.org>
+
+Approved.
+
+From dave at example.org  Wed Mar  6 11:30:00 2024
+From: dave at example.org (Dave)
+Subject: Re: [PROM] HF etch
+References: <one@example.org>
+\t<two@example.org>
+Message-ID: <three@example.org>
+
+Thanks.
+"""
+
+
+def write_mbox(tmp_path, text=MBOX):
+    path = tmp_path / "archive.txt"
+    path.write_bytes(text.encode("utf-8"))
+    return str(path)
+
+
+def test_from_lines_in_a_body_stay_in_the_message(tmp_path):
+    with MboxReader(write_mbox(tmp_path)) as reader:
+        msg_refs, _, _, msg_order = reader.index()
+        first = reader.get_email("one@example.org")
+    assert msg_order == ["one@example.org", "two@example.org", "three@example.org"]
+    assert "quoted@example.org" not in msg_refs
+    assert ">From the datasheet" in first
+    assert "are body text." in first
+    assert msg_refs["three@example.org"] == ["one@example.org", "two@example.org"]
+
+
+def test_mboxreader_matches_the_text_mode_parser(tmp_path):
+    for text in (MBOX, MBOX.replace("\n", "\r\n"), "preamble without an envelope\n\n" + MBOX):
+        path = write_mbox(tmp_path, text)
+        with MboxReader(path) as reader:
+            indexed = reader.index()
+            texts = {msgid: reader.get_email(msgid) for msgid in indexed[3]}
+        assert indexed == parse_mbox_threads_textio(path)
+        with open(path, "rb") as f:
+            raw = f.read()
+        for msgid, start in indexed[1].items():
+            message = raw[start:indexed[2][msgid]].decode("utf-8").replace("\r\n", "\n")
+            assert message == texts[msgid]
+            assert message.startswith("From ") and f"<{msgid}>" in message